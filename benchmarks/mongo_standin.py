@@ -0,0 +1,70 @@
+"""
+MongoDB stand-in for the benchmarks.
+
+With a mongo_uri the benchmarks talk to a real (local) mongod. Without one they
+use mongomock, an in-memory fake: good enough to time the Python side of
+URLImporter, but its query engine is not MongoDB's, so Mongo-side numbers are
+only meaningful against a real server.
+"""
+
+import inspect
+from contextlib import contextmanager
+
+
+def mongomock_available() -> bool:
+    try:
+        import mongomock  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_mongomock_compatible(mongomock):
+    """
+    Lets mongomock 4.x run bulk writes built by pymongo 4.9+.
+
+    Newer pymongo passes a sort argument (None unless UpdateOne/ReplaceOne got one) to
+    the bulk builder, which older mongomock releases don't accept. The builder methods
+    are wrapped to drop sort=None; a real sort still fails loudly. Releases that already
+    accept sort are left alone.
+    """
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        method = getattr(builder, name)
+        if "sort" in inspect.signature(method).parameters:
+            continue
+
+        def accept_sort(self, *args, _method=method, sort=None, **kwargs):
+            if sort is not None:
+                raise NotImplementedError("mongomock does not support sort in bulk writes")
+            return _method(self, *args, **kwargs)
+
+        setattr(builder, name, accept_sort)
+
+
+@contextmanager
+def importer_backend(mongo_uri: str = None):
+    """
+    Yields the mongo_uri to pass to URLImporter.
+
+    For a real server the URI is passed through. Without one, URLImporter's
+    MongoClient is swapped for mongomock.MongoClient for the duration of the block.
+    """
+    if mongo_uri:
+        yield mongo_uri
+        return
+
+    try:
+        import mongomock
+    except ImportError:
+        raise RuntimeError("mongomock is not installed; pip install mongomock or pass --mongo-uri of a local mongod") from None
+    make_mongomock_compatible(mongomock)
+
+    from wmscraper4000 import url_import_utils
+
+    original = url_import_utils.MongoClient
+    url_import_utils.MongoClient = mongomock.MongoClient
+    try:
+        yield "mongodb://mongomock"
+    finally:
+        url_import_utils.MongoClient = original
@@ -0,0 +1,517 @@
+"""
+Benchmark scenarios for wmscraper4000 against the local stub archive.
+
+Every scenario starts a stub server (see stub_server.py) configured for it and
+runs the workload in a fresh child process, so the reported peak RSS belongs to
+that scenario alone. Results are printed as a table and can be saved as a JSON
+baseline and compared against an earlier one:
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json
+
+Latency percentiles come from the package's own metrics (wmscraper_cdx_request_seconds,
+wmscraper_download_seconds, wmscraper_mongo_seconds), registered with fine buckets
+so p50/p99 are accurate to about 20%.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+# run from a checkout without installing the package
+sys.path.insert(1, str(BENCHMARKS_DIR.parent / "src"))
+
+from stub_server import StubConfig, start_stub_server, synthetic_urls, capture_lines  # noqa: E402
+
+# ~20% wide buckets from 0.1ms to ~30s
+FINE_BUCKETS = tuple(1e-4 * 1.2 ** i for i in range(70))
+
+SCENARIOS = {
+    "preprocess-10k": {
+        "description": "preprocess_urls_from_json_file: validate, stage, batched existence check and CDX fetch of 10k URLs",
+        "bench": "preprocess",
+        "urls": 10000,
+        "workers": 8,
+        "stub": {"latency": 0.002, "captures": 20},
+    },
+    "preprocess-1m": {
+        "description": "preprocess_urls_from_json_file on 1M URLs, 90% already in the database",
+        "bench": "preprocess",
+        "urls": 1000000,
+        "workers": 16,
+        "stub": {"captures": 5, "known_fraction": 0.9},
+        "slow": True,
+    },
+    "cdx-heavy-get": {
+        "description": "get_cdx_records on heavy-capture hosts (whole response in memory)",
+        "bench": "cdx_heavy",
+        "mode": "get",
+        "urls": 10,
+        "stub": {"heavy_captures": 200000},
+    },
+    "cdx-heavy-iter": {
+        "description": "iter_cdx_records on heavy-capture hosts (paged, streamed, compact records)",
+        "bench": "cdx_heavy",
+        "mode": "iter",
+        "urls": 10,
+        "stub": {"heavy_captures": 200000},
+    },
+    "cdx-heavy-digests": {
+        "description": "get_cdx_records(fields=(timestamp, digest), as_records=True) on heavy-capture hosts, dedupe-only",
+        "bench": "cdx_heavy",
+        "mode": "get",
+        "fields": ["timestamp", "digest"],
+        "as_records": True,
+        "urls": 10,
+        "stub": {"heavy_captures": 200000},
+    },
+    "download-10k": {
+        "description": "plan_downloads + run_download_plan of 10k unique payloads with 1% injected 503s",
+        "bench": "download",
+        "urls": 2000,
+        "workers": 8,
+        "stub": {"latency": 0.005, "jitter": 0.01, "error_rate": 0.01, "captures": 20, "duplicate_factor": 4, "payload_size": 50000},
+    },
+    "validate-2m": {
+        "description": "validate_and_normalize(_series) vs. the old per-URL urlparse validator on 2M synthetic URLs",
+        "bench": "validate",
+        "urls": 2000000,
+        "stub": {},
+    },
+    "mongo-import-10k": {
+        "description": "URLImporter bulk URL/snapshot import and unique-snapshot aggregation for 10k URLs",
+        "bench": "mongo_import",
+        "urls": 10000,
+        "stub": {"captures": 20},
+    },
+}
+
+
+def peak_rss_mb():
+    # VmHWM starts fresh at exec; ru_maxrss on Linux keeps the peak of the parent the child was forked from
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _latency(metrics, name: str, **labels) -> dict:
+    histogram = metrics.histogram(name)
+    return {"p50": histogram.quantile(0.5, **labels), "p99": histogram.quantile(0.99, **labels)}
+
+
+def _counter_total(metrics, name: str) -> float:
+    return sum(metrics.counter(name).snapshot().values())
+
+
+def bench_preprocess(spec: dict, base_url: str, metrics) -> dict:
+    from wmscraper4000 import HTTPClient, check_urls_already_in_db, preprocess_urls_from_json_file
+
+    workers = spec["workers"]
+    directory = tempfile.mkdtemp(prefix="wmscraper-bench-")
+    try:
+        path = os.path.join(directory, "urls.jsonl")
+        with open(path, "w") as file:
+            for i, url in enumerate(synthetic_urls(spec["urls"])):
+                file.write(json.dumps({"url": url, "title": f"Page {i}", "description": "benchmark"}) + "\n")
+
+        with HTTPClient(pool_maxsize=max(workers, 10)) as client:
+            existence_checker = partial(check_urls_already_in_db, bulk_endpoint=f"{base_url}/exists", client=client)
+            start = time.perf_counter()
+            preprocess_urls_from_json_file(
+                path,
+                {"base": f"{base_url}/cdx", "sleep": 0},
+                workers=workers,
+                requests_per_second=1e9,
+                burst=workers,
+                client=client,
+                existence_checker=existence_checker,
+            )
+            seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "operations": spec["urls"],
+        "unit": "urls",
+        "seconds": seconds,
+        "latency_metric": "wmscraper_cdx_request_seconds",
+        **_latency(metrics, "wmscraper_cdx_request_seconds"),
+        "extra": {
+            "cdx_requests": _counter_total(metrics, "wmscraper_cdx_requests_total"),
+            "cdx_records": _counter_total(metrics, "wmscraper_cdx_records_total"),
+        },
+    }
+
+
+def bench_cdx_heavy(spec: dict, base_url: str, metrics) -> dict:
+    from wmscraper4000 import HTTPClient, get_cdx_records, iter_cdx_records
+
+    records = 0
+    with HTTPClient() as client:
+        start = time.perf_counter()
+        for url in synthetic_urls(0, heavy=spec["urls"]):
+            if spec["mode"] == "get":
+                records += len(get_cdx_records(url, sleep=0, base=f"{base_url}/cdx", client=client, fields=spec.get("fields"), as_records=spec.get("as_records", False)))
+            else:
+                for _ in iter_cdx_records(url, page_size=5000, sleep=0, base=f"{base_url}/cdx", client=client, as_records=True):
+                    records += 1
+        seconds = time.perf_counter() - start
+
+    return {
+        "operations": records,
+        "unit": "records",
+        "seconds": seconds,
+        "latency_metric": "wmscraper_cdx_request_seconds",
+        **_latency(metrics, "wmscraper_cdx_request_seconds"),
+        "extra": {"cdx_requests": _counter_total(metrics, "wmscraper_cdx_requests_total")},
+    }
+
+
+def _unique_snapshots(urls, config: StubConfig):
+    # the same shape URLImporter.get_unique_url_snapshots returns, built from the stub's CDX data
+    for url in urls:
+        digest_to_snapshot = {}
+        lines = capture_lines(url, config)
+        for line in lines:
+            fields = line.split(" ")
+            digest_to_snapshot.setdefault(fields[5], []).append(fields[1])
+        yield {"url": url, "urlkey": lines[0].split(" ", 1)[0], "digest_to_snapshot": digest_to_snapshot}
+
+
+def bench_download(spec: dict, base_url: str, metrics) -> dict:
+    from wmscraper4000 import HTTPClient, RetryPolicy, plan_downloads, run_download_plan
+
+    config = StubConfig(**spec["stub"])
+    plan = plan_downloads(_unique_snapshots(synthetic_urls(spec["urls"]), config))
+    references = 0
+
+    def on_result(url, timestamp, digest, result):
+        nonlocal references
+        references += 1
+
+    workers = spec["workers"]
+    with HTTPClient(pool_maxsize=max(workers, 10)) as client:
+        start = time.perf_counter()
+        stats = run_download_plan(
+            plan,
+            on_result,
+            workers=workers,
+            requests_per_second=1e9,
+            burst=workers,
+            client=client,
+            retry_policy=RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.2),
+            base=f"{base_url}/web/",
+        )
+        seconds = time.perf_counter() - start
+
+    downloaded_bytes = _counter_total(metrics, "wmscraper_download_bytes_total")
+    return {
+        "operations": stats["downloaded"],
+        "unit": "payloads",
+        "seconds": seconds,
+        "latency_metric": "wmscraper_download_seconds",
+        **_latency(metrics, "wmscraper_download_seconds"),
+        "extra": {
+            "references": references,
+            "retries": stats["retries"],
+            "failed": len(stats["failed"]),
+            "megabytes_per_second": downloaded_bytes / seconds / 1e6 if seconds else None,
+        },
+    }
+
+
+def bench_mongo_import(spec: dict, base_url: str, metrics) -> dict:
+    from wmscraper4000 import URLImporter, CDXRecordBatch
+    from mongo_standin import importer_backend
+
+    config = StubConfig(**spec["stub"])
+    urls = synthetic_urls(spec["urls"])
+    entries = (
+        {"url": url, "lot_id": "bench", "site_title": "Benchmark", "lot_path": f"/lot/{i % 10}"}
+        for i, url in enumerate(urls)
+    )
+    phases = {}
+    with importer_backend(spec.get("mongo_uri")) as mongo_uri:
+        with URLImporter(mongo_uri, database_name="wmscraper_bench") as importer:
+            importer.collection.delete_many({})
+            importer.snapshot_collection.delete_many({})
+            start = time.perf_counter()
+            importer.add_urls_bulk(entries)
+            phases["add_urls_bulk"] = time.perf_counter() - start
+
+            phase_start = time.perf_counter()
+            importer.add_url_snapshots_bulk((url, CDXRecordBatch.from_lines(capture_lines(url, config))) for url in urls)
+            phases["add_url_snapshots_bulk"] = time.perf_counter() - phase_start
+
+            phase_start = time.perf_counter()
+            try:
+                importer.get_unique_url_snapshots_batch(urls, to_date=20301231000000)
+                phases["get_unique_url_snapshots_batch"] = time.perf_counter() - phase_start
+            except NotImplementedError as e:
+                # mongomock doesn't implement every aggregation operator
+                phases["get_unique_url_snapshots_batch"] = f"skipped: {e}"
+            seconds = time.perf_counter() - start
+            if spec.get("mongo_uri"):
+                importer.client.drop_database("wmscraper_bench")
+
+    return {
+        "operations": len(urls),
+        "unit": "urls",
+        "seconds": seconds,
+        "latency_metric": "wmscraper_mongo_seconds{op=bulk_write}",
+        **_latency(metrics, "wmscraper_mongo_seconds", op="bulk_write"),
+        "extra": {"phases": phases, "aggregate": _latency(metrics, "wmscraper_mongo_seconds", op="aggregate")},
+    }
+
+
+def legacy_validate_url(url):
+    # the per-URL urlparse validator that validate_and_normalize replaced, kept as the reference
+    from urllib.parse import urlparse
+    from wmscraper4000.list_of_valid_tlds import list_of_valid_tlds
+
+    try:
+        result = urlparse(url)
+    except ValueError:
+        return False
+    if not result.hostname:
+        return False
+    try:
+        parts = result.hostname.split('.')
+        if all(0 <= int(part) < 256 for part in parts):
+            return True
+    except ValueError:
+        pass
+    hostname_parts = result.hostname.split('.')
+    if len(hostname_parts) < 2 or hostname_parts[-1] not in list_of_valid_tlds:
+        return False
+    if url.count("//") > 1:
+        return False
+    invalid_chars = set('<>{}|\\^[]`')
+    if any(char in invalid_chars for char in url):
+        return False
+    return ' ' not in url
+
+
+def bench_validate(spec: dict, base_url: str, metrics) -> dict:
+    from wmscraper4000.url_normalize_utils import validate_and_normalize, validate_and_normalize_series
+
+    n = spec["urls"]
+    tlds = ["com", "org", "net", "co.uk", "de", "invalidtld", "fr"]
+    urls = [
+        f"http://WWW.Site{i % 50000}.{tlds[i % len(tlds)]}/path/{i}?q={i}" if i % 97 else f"http://bad url {i}.com/"
+        for i in range(n)
+    ]
+
+    start = time.perf_counter()
+    legacy = [legacy_validate_url(url) for url in urls]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mask, _ = validate_and_normalize(urls)
+    seconds = time.perf_counter() - start
+    if mask != legacy:
+        raise AssertionError("validate_and_normalize disagrees with the urlparse validator")
+
+    extra = {"legacy_seconds": legacy_seconds}
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+    if pd is not None:
+        series = pd.Series(urls)
+        start = time.perf_counter()
+        series_mask, _ = validate_and_normalize_series(series)
+        extra["series_seconds"] = time.perf_counter() - start
+        if series_mask.tolist() != legacy:
+            raise AssertionError("validate_and_normalize_series disagrees with the urlparse validator")
+
+    return {"operations": n, "unit": "urls", "seconds": seconds, "extra": extra}
+
+
+BENCHES = {
+    "preprocess": bench_preprocess,
+    "cdx_heavy": bench_cdx_heavy,
+    "download": bench_download,
+    "mongo_import": bench_mongo_import,
+    "validate": bench_validate,
+}
+
+
+def run_child(spec: dict, base_url: str, result_path: str):
+    import wmscraper4000
+    from wmscraper4000 import metrics
+
+    # progress logging would dominate the timings of the fast paths
+    wmscraper4000.set_log_level(logging.WARNING)
+    for name in ("wmscraper_cdx_request_seconds", "wmscraper_download_seconds", "wmscraper_mongo_seconds"):
+        metrics.histogram(name, buckets=FINE_BUCKETS)
+
+    result = BENCHES[spec["bench"]](spec, base_url, metrics)
+    result["throughput"] = result["operations"] / result["seconds"] if result["seconds"] else None
+    result["peak_rss_mb"] = peak_rss_mb()
+    with open(result_path, "w") as file:
+        json.dump(result, file, default=str)
+
+
+def run_scenario(name: str, spec: dict) -> dict:
+    """Starts a stub server for the scenario and runs it in a child process."""
+    server, base_url = start_stub_server(StubConfig(**spec["stub"]))
+    handle, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(handle)
+    try:
+        completed = subprocess.run(
+            [sys.executable, __file__, "--child", json.dumps(spec), "--base-url", base_url, "--result", result_path],
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            return {"scenario": name, "error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}"}
+        with open(result_path) as file:
+            result = json.load(file)
+    finally:
+        os.remove(result_path)
+        with server.stats_lock:
+            server_stats = dict(server.stats)
+        server.shutdown()
+        server.server_close()
+    result["scenario"] = name
+    result["server_requests"] = server_stats
+    result["stub"] = spec["stub"]
+    return result
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}" if isinstance(seconds, (int, float)) else "-"
+
+
+def print_table(results: list):
+    header = f"{'scenario':<18} {'ops':>9} {'unit':<9} {'seconds':>8} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if "error" in result:
+            print(f"{result['scenario']:<18} failed: {result['error']}")
+            continue
+        rss = result.get("peak_rss_mb")
+        print(
+            f"{result['scenario']:<18} {result['operations']:>9} {result['unit']:<9} {result['seconds']:>8.2f} "
+            f"{result['throughput']:>10.1f} {_ms(result.get('p50')):>8} {_ms(result.get('p99')):>8} "
+            f"{'-' if rss is None else round(rss, 1):>8}"
+        )
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """Returns a description of every metric that got worse than the baseline by more than tolerance."""
+    with open(baseline_path) as file:
+        baseline = {result["scenario"]: result for result in json.load(file)["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if old is None or "error" in old or "error" in result:
+            continue
+        checks = (
+            ("throughput", result.get("throughput"), old.get("throughput"), False),
+            ("p99", result.get("p99"), old.get("p99"), True),
+            ("peak_rss_mb", result.get("peak_rss_mb"), old.get("peak_rss_mb"), True),
+        )
+        for metric, new_value, old_value, lower_is_better in checks:
+            if not isinstance(new_value, (int, float)) or not old_value:
+                continue
+            change = new_value / old_value - 1
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            print(f"{result['scenario']:<18} {metric:<12} {old_value:>12.4g} -> {new_value:<12.4g} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f"{result['scenario']} {metric} {change:+.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run wmscraper4000 benchmarks against a local stub archive.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all but the slow ones). Available: {', '.join(SCENARIOS)}")
+    parser.add_argument("--all", action="store_true", help="Include slow scenarios such as preprocess-1m.")
+    parser.add_argument("--urls", type=int, help="Override the number of URLs of every scenario.")
+    parser.add_argument("--workers", type=int, help="Override the worker count.")
+    parser.add_argument("--latency", type=float, help="Stub latency per response in seconds.")
+    parser.add_argument("--jitter", type=float, help="Extra random stub latency of up to this many seconds.")
+    parser.add_argument("--error-rate", type=float, help="Fraction of stub responses that are 503s.")
+    parser.add_argument("--payload-size", type=int, help="Bytes per replayed snapshot.")
+    parser.add_argument("--heavy-captures", type=int, help="Captures per heavy-host URL.")
+    parser.add_argument("--mongo-uri", help="Use this MongoDB instead of mongomock for the import scenario.")
+    parser.add_argument("--output", help="Write the results as a JSON baseline to this path.")
+    parser.add_argument("--compare", help="Compare against a JSON baseline written by --output.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change before --compare reports a regression. Defaults to 0.2.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(json.loads(args.child), args.base_url, args.result)
+        return 0
+
+    names = args.scenarios or [name for name, spec in SCENARIOS.items() if args.all or not spec.get("slow")]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = []
+    for name in names:
+        spec = json.loads(json.dumps(SCENARIOS[name]))
+        if args.urls is not None:
+            spec["urls"] = args.urls
+        if args.workers is not None:
+            spec["workers"] = args.workers
+        if args.mongo_uri:
+            spec["mongo_uri"] = args.mongo_uri
+        for option, key in (("latency", "latency"), ("jitter", "jitter"), ("error_rate", "error_rate"), ("payload_size", "payload_size"), ("heavy_captures", "heavy_captures")):
+            if getattr(args, option) is not None:
+                spec["stub"][key] = getattr(args, option)
+        print(f"Running {name}: {spec['description']}", flush=True)
+        results.append(run_scenario(name, spec))
+
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, file, indent=2, default=str)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        print()
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {'; '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Local stand-in for the Wayback CDX server, the Wayback replay endpoint and the
+pastinternet existence endpoints, used by the benchmarks.
+
+Everything is generated deterministically from the requested URL, so the same
+configuration always serves the same data:
+
+    GET  /cdx?url=...            space separated CDX lines, with filter, fl, collapse and limit/showResumeKey/resumeKey paging
+    GET  /web/<ts><mod>/<url>    the payload of that capture, payload_size bytes
+    HEAD /redirect/<url>         302 for URLs that are "already in the database", 404 otherwise
+    POST /exists                 {"urls": [...]} -> {"existing": [...]}
+    GET  /stats                  request counters of the server
+
+URLs whose host starts with "heavy" get heavy_captures captures instead of captures.
+Captures sharing a payload (see duplicate_factor) are served identical bytes, and the
+CDX digest of every capture is the real SHA-1 of its payload, so digest verification
+succeeds like it does against the archive.
+Only the standard library is used, so the server can run anywhere the benchmarks do.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+CDX_FIELDS = ("urlkey", "timestamp", "original", "mimetype", "statuscode", "digest", "length")
+FIRST_CAPTURE = datetime(1996, 1, 1)
+CAPTURE_INTERVAL = timedelta(minutes=15)
+# payloads end in a fixed-size tag naming their content, everything before it is shared filler
+PAYLOAD_TAG_SIZE = 40
+
+
+class StubConfig:
+    """Behaviour of the stub archive.
+
+    Args:
+        latency (float, optional): Seconds added to every response. Defaults to 0.
+        jitter (float, optional): Extra random delay of up to jitter seconds. Defaults to 0.
+        error_rate (float, optional): Fraction of requests answered with 503. Defaults to 0.
+        captures (int, optional): Captures per ordinary URL. Defaults to 20.
+        heavy_captures (int, optional): Captures per URL on a "heavy*" host. Defaults to 100000.
+        duplicate_factor (int, optional): Average number of captures sharing one digest. Defaults to 4.
+        payload_size (int, optional): Bytes per replayed snapshot (at least 40). Defaults to 50000.
+        known_fraction (float, optional): Fraction of URLs reported as already in the database. Defaults to 0.
+        seed (int, optional): Seed of the error injection. Defaults to 0.
+    """
+
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0, captures: int = 20, heavy_captures: int = 100000, duplicate_factor: int = 4, payload_size: int = 50000, known_fraction: float = 0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.captures = captures
+        self.heavy_captures = heavy_captures
+        self.duplicate_factor = max(1, duplicate_factor)
+        self.payload_size = payload_size
+        self.known_fraction = known_fraction
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _surt(url: str) -> str:
+    parts = urlsplit(url if "://" in url else "http://" + url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return ",".join(reversed(host.split("."))) + ")" + (parts.path or "/").lower()
+
+
+@lru_cache(maxsize=8)
+def _filler(payload_size: int) -> tuple:
+    # (filler bytes, SHA-1 state after them): hashing a payload then only costs its tag
+    filler = (b"<html><body>" + b"x" * payload_size)[:max(0, payload_size - PAYLOAD_TAG_SIZE)]
+    return filler, hashlib.sha1(filler)
+
+
+def _payload_tag(url: str, version: int) -> bytes:
+    return hashlib.sha1(f"{url}#{version}".encode("utf-8")).hexdigest().encode("ascii")
+
+
+def payload(url: str, version: int, payload_size: int) -> bytes:
+    """Body of the version-th distinct payload of url."""
+    return _filler(payload_size)[0] + _payload_tag(url, version)
+
+
+def payload_digest(url: str, version: int, payload_size: int) -> str:
+    """CDX digest (base32 SHA-1) of payload(url, version, payload_size)."""
+    sha1 = _filler(payload_size)[1].copy()
+    sha1.update(_payload_tag(url, version))
+    return base64.b32encode(sha1.digest()).decode("ascii")
+
+
+def capture_count(url: str, config: StubConfig) -> int:
+    host = urlsplit(url if "://" in url else "http://" + url).hostname or ""
+    return config.heavy_captures if host.startswith("heavy") else config.captures
+
+
+def payload_version(url: str, timestamp: str, config: StubConfig) -> int:
+    """Which distinct payload the capture of url at timestamp has; captures i and i + distinct share one."""
+    try:
+        index = int((datetime.strptime(timestamp, "%Y%m%d%H%M%S") - FIRST_CAPTURE) / CAPTURE_INTERVAL)
+    except ValueError:
+        index = 0
+    return index % max(1, capture_count(url, config) // config.duplicate_factor)
+
+
+@lru_cache(maxsize=64)
+def _capture_lines(url: str, count: int, duplicate_factor: int, payload_size: int) -> tuple:
+    urlkey = _surt(url)
+    distinct = max(1, count // duplicate_factor)
+    digests = [payload_digest(url, version, payload_size) for version in range(min(count, distinct))]
+    lines = []
+    for i in range(count):
+        timestamp = (FIRST_CAPTURE + i * CAPTURE_INTERVAL).strftime("%Y%m%d%H%M%S")
+        lines.append(f"{urlkey} {timestamp} {url} text/html 200 {digests[i % distinct]} {2000 + i % 997}")
+    return tuple(lines)
+
+
+def capture_lines(url: str, config: StubConfig) -> tuple:
+    """CDX lines of every capture of url, oldest first."""
+    return _capture_lines(url, capture_count(url, config), config.duplicate_factor, config.payload_size)
+
+
+def _filter_lines(lines, specs) -> list:
+    # CDX filter=[!]field:regex, the regex has to match the whole field; all filters must hold
+    for spec in specs:
+        negate = spec.startswith("!")
+        name, _, pattern = spec.lstrip("!").partition(":")
+        index = CDX_FIELDS.index(name)
+        regex = re.compile(pattern)
+        lines = [line for line in lines if (regex.fullmatch(line.split(" ")[index]) is None) == negate]
+    return lines
+
+
+def is_known(url: str, config: StubConfig) -> bool:
+    """Whether url counts as already in the database; stable for a given known_fraction."""
+    if config.known_fraction <= 0:
+        return False
+    bucket = int.from_bytes(hashlib.md5(url.encode("utf-8")).digest()[:4], "little") % 10000
+    return bucket < config.known_fraction * 10000
+
+
+def synthetic_urls(count: int, heavy: int = 0) -> list:
+    """count ordinary URLs spread over 1000 hosts, followed by heavy URLs on "heavy*" hosts."""
+    urls = [f"http://site{i % 1000}.example.com/page/{i}" for i in range(count)]
+    urls += [f"http://heavy{i}.example.org/" for i in range(heavy)]
+    return urls
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, Nagle + delayed ACKs would add ~40ms to each response
+    disable_nagle_algorithm = True
+    server_version = "wmscraper-stub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.config
+
+    def _count(self, name: str):
+        with self.server.stats_lock:
+            self.server.stats[name] = self.server.stats.get(name, 0) + 1
+
+    def _delay_or_fail(self) -> bool:
+        # returns True when the request was answered with an injected error
+        delay = self.config.latency
+        if self.config.jitter:
+            delay += random.uniform(0, self.config.jitter)
+        if delay:
+            time.sleep(delay)
+        with self.server.stats_lock:
+            failed = self.server.random.random() < self.config.error_rate
+        if failed:
+            self._count("errors")
+            self._send(503, b"injected error", "text/plain", {"Retry-After": "0"})
+        return failed
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == "/cdx":
+            self._count("cdx")
+            if not self._delay_or_fail():
+                self._cdx(parse_qs(parts.query))
+        elif parts.path.startswith("/web/"):
+            self._count("web")
+            if not self._delay_or_fail():
+                self._send(200, self._replay(parts.path[len("/web/"):]), "text/html; charset=utf-8")
+        elif parts.path == "/stats":
+            with self.server.stats_lock:
+                body = json.dumps(self.server.stats).encode("utf-8")
+            self._send(200, body, "application/json")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_HEAD(self):
+        if self.path.startswith("/redirect/"):
+            self._count("redirect")
+            if self._delay_or_fail():
+                return
+            url = unquote(self.path[len("/redirect/"):])
+            if is_known(url, self.config):
+                self._send(302, b"", "text/plain", {"Location": url})
+            else:
+                self._send(404, b"", "text/plain")
+        else:
+            self._send(404, b"", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/exists":
+            self._send(404, b"not found", "text/plain")
+            return
+        self._count("exists")
+        if self._delay_or_fail():
+            return
+        urls = json.loads(body or b"{}").get("urls", [])
+        existing = [url for url in urls if is_known(url, self.config)]
+        self._send(200, json.dumps({"existing": existing}).encode("utf-8"), "application/json")
+
+    def _replay(self, path: str) -> bytes:
+        # path is <timestamp><modifier>/<quoted original url>
+        capture, _, url = path.partition("/")
+        timestamp = capture[:14]
+        url = unquote(url)
+        return payload(url, payload_version(url, timestamp, self.config), self.config.payload_size)
+
+    def _cdx(self, query: dict):
+        url = query.get("url", [""])[0]
+        lines = capture_lines(url, self.config)
+        from_date = query.get("from", [None])[0]
+        to_date = query.get("to", [None])[0]
+        if from_date or to_date:
+            # CDX dates may be given as prefixes, compare them padded to 14 digits
+            low = (from_date or "").ljust(14, "0")
+            high = (to_date or "").ljust(14, "9") if to_date else "99999999999999"
+            lines = [line for line in lines if low <= line.split(" ", 2)[1] <= high]
+
+        lines = _filter_lines(lines, query.get("filter", []))
+
+        for spec in query.get("collapse", []):
+            # like the CDX server: drop lines whose field (or its first N characters) equals the previous line's
+            name, _, length = spec.partition(":")
+            index = CDX_FIELDS.index(name)
+            length = int(length) if length else None
+            collapsed = []
+            previous = None
+            for line in lines:
+                key = line.split(" ")[index][:length]
+                if key != previous:
+                    collapsed.append(line)
+                previous = key
+            lines = collapsed
+
+        fl = query.get("fl", [None])[0]
+        if fl:
+            indexes = [CDX_FIELDS.index(name) for name in fl.split(",")]
+            lines = [" ".join(parts[index] for index in indexes) for parts in (line.split(" ") for line in lines)]
+
+        offset = int(query.get("resumeKey", ["0"])[0] or 0)
+        limit = query.get("limit", [None])[0]
+        end = offset + int(limit) if limit else len(lines)
+        body = "\n".join(lines[offset:end])
+        if body:
+            body += "\n"
+        if query.get("showResumeKey", ["false"])[0] == "true" and end < len(lines):
+            body += f"\n{end}\n"
+        self._send(200, body.encode("utf-8"), "text/plain")
+
+
+def start_stub_server(config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """
+    Starts the stub archive on a background thread.
+
+    Returns:
+        tuple: (server, base_url). Stop it with server.shutdown() and server.server_close().
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    server.config = config or StubConfig()
+    server.random = random.Random(server.config.seed)
+    server.stats = {}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stub Wayback/CDX server in the foreground.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--captures", type=int, default=20)
+    parser.add_argument("--heavy-captures", type=int, default=100000)
+    parser.add_argument("--payload-size", type=int, default=50000)
+    parser.add_argument("--known-fraction", type=float, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.captures, args.heavy_captures, payload_size=args.payload_size, known_fraction=args.known_fraction)
+    server, base_url = start_stub_server(config, port=args.port)
+    print(f"Stub archive listening on {base_url} (CDX: {base_url}/cdx, replay: {base_url}/web/)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.server_close()
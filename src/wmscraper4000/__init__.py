@@ -1,5 +1,19 @@
 from .wm_uri_utils import dissect_wm_memento_uri, create_wm_memento_uri
-from .wm_cdx_utils import get_cdx_records
+from .wm_cdx_utils import get_cdx_records, iter_cdx_records
 from .url_preimport_utils import preprocess_urls_from_json_file, preprocess_urls_from_csv_file
 from .url_import_utils import URLImporter
-from .url_download_utils import download_archived_snapshot
\ No newline at end of file
+from .url_download_utils import download_archived_snapshot, stream_archived_snapshot
+from .rate_limiter import TokenBucket
+from .http_client import HTTPClient
+from .cdx_record import CDXRecord, CDXRecordBatch
+from .cache import DiskCache
+from .download_scheduler import plan_downloads, run_download_plan
+from .warc_utils import WARCWriter
+from .retry_policy import RetryPolicy, CircuitBreaker
+from .url_dedupe_utils import check_urls_already_in_db, find_urls_in_collection, KnownURLIndex, BloomFilter
+from .url_normalize_utils import normalize_url, validate_url, validate_and_normalize, validate_and_normalize_series
+from .staging_store import StagingStore
+from .url_input_readers import iter_json_entries, iter_json_batches, iter_csv_batches, csv_chunk_rows
+from .work_queue import MongoWorkQueue, run_cdx_worker
+from .instrumentation import metrics, set_log_level, enable_console_logging, use_application_logging
+from .pipeline import run_pipeline
\ No newline at end of file
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+from .instrumentation import metrics
+
+CACHE_LOOKUPS = "wmscraper_cache_lookups_total"
+# entries removed per eviction query, so eviction never loads the whole index
+EVICT_BATCH_SIZE = 100
+
+
+def normalize_cache_url(url: str) -> str:
+    url = url.strip()
+    netloc = urlparse(url).netloc
+    if netloc:
+        url = url.replace(netloc, netloc.lower(), 1)
+    return url
+
+
+class DiskCache:
+    """Persistent content-addressed cache for CDX responses and snapshot payloads.
+
+    Entries map a key to a blob stored under blobs/ by the SHA-256 of its content,
+    so identical payloads (e.g. snapshots with the same CDX digest) are written
+    to disk once no matter how many keys point at them. Entries older than ttl
+    seconds are treated as misses, and the least recently used entries are
+    evicted once the blobs exceed max_bytes. Each blob's size and reference count
+    and the running byte total are kept in the index, so writes and evictions cost
+    the same no matter how large the cache gets. The cache is safe to share between
+    threads and between runs.
+
+    Args:
+        directory (str): Directory holding the index database and the blobs.
+        max_bytes (int, optional): Size limit for stored blobs. Defaults to 10 GiB.
+        ttl (float, optional): Maximum entry age in seconds. Defaults to None (never expire).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 ** 3, ttl: float = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                blob TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                meta TEXT,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed);")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_blob ON entries(blob);")
+        self._create_blob_tables()
+        self._conn.commit()
+
+    def _create_blob_tables(self):
+        exists = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='blobs';").fetchone()
+        if exists:
+            return
+        self._conn.execute("CREATE TABLE blobs (blob TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL);")
+        self._conn.execute("CREATE TABLE cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+        # caches written by earlier versions only have the entries table, count their blobs once here
+        self._conn.execute("INSERT INTO blobs (blob, size, refs) SELECT blob, MAX(size), COUNT(*) FROM entries GROUP BY blob;")
+        self._conn.execute("INSERT INTO cache_meta (key, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM blobs;")
+
+    @staticmethod
+    def cdx_key(url: str, params: dict, base: str) -> str:
+        # the endpoint is part of the key, so e.g. a test server and production can share a cache directory
+        params = {k: v for k, v in params.items() if k != "url"}
+        return f"cdx:{base} " + normalize_cache_url(url) + "?" + json.dumps(params, sort_keys=True, default=str)
+
+    @staticmethod
+    def snapshot_key(url: str, timestamp, rewrite_modifier: str = "id_", base: str = "") -> str:
+        return f"snapshot:{base} {timestamp}{rewrite_modifier}/{normalize_cache_url(url)}"
+
+    @staticmethod
+    def digest_key(digest: str, rewrite_modifier: str = "id_") -> str:
+        # the CDX digest identifies the original payload, so only share it between identical modifiers
+        return f"digest:{rewrite_modifier}:{digest}"
+
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self.directory, "blobs", blob[:2], blob)
+
+    def get(self, key: str):
+        """Returns (data, meta) for a cached key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT blob, meta, created FROM entries WHERE key = ?;", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self._delete(key, row[0])
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                metrics.counter(CACHE_LOOKUPS, "Disk cache lookups by result").inc(result="miss")
+                return None
+            try:
+                with open(self._blob_path(row[0]), "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                # blob removed behind our back, drop the dangling entry
+                self._delete(key, row[0])
+                self._conn.commit()
+                self.misses += 1
+                metrics.counter(CACHE_LOOKUPS, "Disk cache lookups by result").inc(result="miss")
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?;", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            metrics.counter(CACHE_LOOKUPS, "Disk cache lookups by result").inc(result="hit")
+            return data, json.loads(row[1]) if row[1] else {}
+
+    def set(self, key: str, data: bytes, meta: dict = None):
+        blob = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob)
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            old = self._conn.execute("SELECT blob FROM entries WHERE key = ?;", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, blob, size, meta, created, accessed) VALUES (?, ?, ?, ?, ?, ?);",
+                (key, blob, len(data), json.dumps(meta) if meta else None, now, now),
+            )
+            if old is None or old[0] != blob:
+                self._add_ref(blob, len(data))
+                if old is not None:
+                    self._release_ref(old[0])
+            self._evict()
+            self._conn.commit()
+
+    def _add_ref(self, blob: str, size: int):
+        updated = self._conn.execute("UPDATE blobs SET refs = refs + 1 WHERE blob = ?;", (blob,)).rowcount
+        if not updated:
+            self._conn.execute("INSERT INTO blobs (blob, size, refs) VALUES (?, ?, 1);", (blob, size))
+            self._conn.execute("UPDATE cache_meta SET value = value + ? WHERE key = 'bytes';", (size,))
+
+    def _release_ref(self, blob: str) -> int:
+        # returns the bytes freed, which is 0 while other keys still point at the blob
+        row = self._conn.execute("SELECT size, refs FROM blobs WHERE blob = ?;", (blob,)).fetchone()
+        if row is None:
+            return 0
+        size, refs = row
+        if refs > 1:
+            self._conn.execute("UPDATE blobs SET refs = refs - 1 WHERE blob = ?;", (blob,))
+            return 0
+        self._conn.execute("DELETE FROM blobs WHERE blob = ?;", (blob,))
+        self._conn.execute("UPDATE cache_meta SET value = value - ? WHERE key = 'bytes';", (size,))
+        try:
+            os.remove(self._blob_path(blob))
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _delete(self, key: str, blob: str) -> int:
+        self._conn.execute("DELETE FROM entries WHERE key = ?;", (key,))
+        return self._release_ref(blob)
+
+    def _stored_bytes(self) -> int:
+        # blobs shared by several keys only take space once
+        return self._conn.execute("SELECT value FROM cache_meta WHERE key = 'bytes';").fetchone()[0]
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self._stored_bytes()
+        while total > self.max_bytes:
+            rows = self._conn.execute("SELECT key, blob FROM entries ORDER BY accessed LIMIT ?;", (EVICT_BATCH_SIZE,)).fetchall()
+            if not rows:
+                break
+            for key, blob in rows:
+                total -= self._delete(key, blob)
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries;").fetchone()[0]
+            stored_bytes = self._stored_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": stored_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
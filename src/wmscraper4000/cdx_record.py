@@ -0,0 +1,204 @@
+import sys
+from array import array
+
+CDX_FIELDS = ("urlkey", "timestamp", "original", "mimetype", "statuscode", "digest", "length")
+
+# sentinel for "-" (missing) status codes and lengths in the integer columns
+_MISSING = -1
+
+
+def _to_int(value) -> int:
+    if isinstance(value, int):
+        return value
+    return int(value) if value and value.isdigit() else _MISSING
+
+
+def _to_str(value: int) -> str:
+    return "-" if value == _MISSING else str(value)
+
+
+class CDXRecord:
+    """Compact representation of a single CDX line.
+
+    Timestamp, status code and length are stored as integers and the highly
+    repetitive urlkey and mimetype strings are interned, so a record costs a
+    fraction of the equivalent 7-key dict of strings. Status codes and lengths
+    reported as "-" by the CDX server are stored as -1.
+    """
+
+    __slots__ = CDX_FIELDS
+
+    def __init__(self, urlkey: str, timestamp: int, original: str, mimetype: str, statuscode: int, digest: str, length: int):
+        self.urlkey = sys.intern(urlkey)
+        self.timestamp = timestamp
+        self.original = original
+        self.mimetype = sys.intern(mimetype)
+        self.statuscode = statuscode
+        self.digest = digest
+        self.length = length
+
+    @classmethod
+    def from_line(cls, line: str, fields=CDX_FIELDS) -> "CDXRecord":
+        """Parses a CDX line whose columns are fields (the fl= of the query). Missing fields are empty, or -1 for numbers."""
+        if fields is CDX_FIELDS or tuple(fields) == CDX_FIELDS:
+            urlkey, timestamp, original, mimetype, statuscode, digest, length = line.split(" ")[:7]
+            return cls(urlkey, int(timestamp), original, mimetype, _to_int(statuscode), digest, _to_int(length))
+        values = dict(zip(fields, line.split(" ")))
+        return cls(
+            values.get("urlkey", ""),
+            _to_int(values.get("timestamp")),
+            values.get("original", ""),
+            values.get("mimetype", ""),
+            _to_int(values.get("statuscode")),
+            values.get("digest", ""),
+            _to_int(values.get("length")),
+        )
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "CDXRecord":
+        return cls(
+            record["urlkey"],
+            int(record["timestamp"]),
+            record["original"],
+            record["mimetype"],
+            _to_int(record["statuscode"]),
+            record["digest"],
+            _to_int(record["length"]),
+        )
+
+    def to_dict(self) -> dict:
+        """Converts the record to the dict-of-strings format returned by get_cdx_records."""
+        return {
+            "urlkey": self.urlkey,
+            "timestamp": _to_str(self.timestamp),
+            "original": self.original,
+            "mimetype": self.mimetype,
+            "statuscode": _to_str(self.statuscode),
+            "digest": self.digest,
+            "length": _to_str(self.length),
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, CDXRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in CDX_FIELDS)
+
+    def __repr__(self):
+        return f"CDXRecord({self.urlkey!r}, {self.timestamp}, {self.original!r}, {self.mimetype!r}, {self.statuscode}, {self.digest!r}, {self.length})"
+
+
+class CDXRecordBatch:
+    """Struct-of-arrays container for many CDX records.
+
+    Integer columns live in typed arrays (8 bytes per value) and string columns
+    in plain lists of interned strings, which keeps memory per million captures
+    far below a list of dicts. `to_columns`/`from_columns` give a compact JSON
+    friendly form where every field name is stored once.
+    """
+
+    def __init__(self):
+        self.urlkey = []
+        self.timestamp = array("q")
+        self.original = []
+        self.mimetype = []
+        self.statuscode = array("h")
+        self.digest = []
+        self.length = array("q")
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, index: int) -> CDXRecord:
+        return CDXRecord(
+            self.urlkey[index],
+            self.timestamp[index],
+            self.original[index],
+            self.mimetype[index],
+            self.statuscode[index],
+            self.digest[index],
+            self.length[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, record: CDXRecord):
+        self.urlkey.append(record.urlkey)
+        self.timestamp.append(record.timestamp)
+        self.original.append(record.original)
+        self.mimetype.append(record.mimetype)
+        self.statuscode.append(record.statuscode)
+        self.digest.append(record.digest)
+        self.length.append(record.length)
+
+    def append_line(self, line: str, fields=CDX_FIELDS):
+        if fields is not CDX_FIELDS and tuple(fields) != CDX_FIELDS:
+            self.append(CDXRecord.from_line(line, fields))
+            return
+        urlkey, timestamp, original, mimetype, statuscode, digest, length = line.split(" ")[:7]
+        self.urlkey.append(sys.intern(urlkey))
+        self.timestamp.append(int(timestamp))
+        self.original.append(original)
+        self.mimetype.append(sys.intern(mimetype))
+        self.statuscode.append(_to_int(statuscode))
+        self.digest.append(digest)
+        self.length.append(_to_int(length))
+
+    @classmethod
+    def from_lines(cls, lines, fields=CDX_FIELDS) -> "CDXRecordBatch":
+        batch = cls()
+        for line in lines:
+            if line:
+                batch.append_line(line, fields)
+        return batch
+
+    @classmethod
+    def from_dicts(cls, records) -> "CDXRecordBatch":
+        batch = cls()
+        for record in records:
+            batch.append(CDXRecord.from_dict(record))
+        return batch
+
+    def to_dicts(self) -> list:
+        """Converts the batch to the list-of-dicts format returned by get_cdx_records."""
+        return [record.to_dict() for record in self]
+
+    def to_columns(self) -> dict:
+        return {
+            "urlkey": list(self.urlkey),
+            "timestamp": self.timestamp.tolist(),
+            "original": list(self.original),
+            "mimetype": list(self.mimetype),
+            "statuscode": self.statuscode.tolist(),
+            "digest": list(self.digest),
+            "length": self.length.tolist(),
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "CDXRecordBatch":
+        batch = cls()
+        batch.urlkey = [sys.intern(value) for value in columns["urlkey"]]
+        batch.timestamp = array("q", columns["timestamp"])
+        batch.original = list(columns["original"])
+        batch.mimetype = [sys.intern(value) for value in columns["mimetype"]]
+        batch.statuscode = array("h", columns["statuscode"])
+        batch.digest = list(columns["digest"])
+        batch.length = array("q", columns["length"])
+        return batch
+
+    def group_by_digest(self, from_date: int = None, to_date: int = None, status_codes=None) -> dict:
+        """Returns digest -> [timestamp, ...] for records inside the date range and status codes."""
+        status_codes = set(status_codes) if status_codes is not None else None
+        digest_to_snapshot = {}
+        for index, timestamp in enumerate(self.timestamp):
+            if from_date is not None and timestamp < from_date:
+                continue
+            if to_date is not None and timestamp > to_date:
+                continue
+            if status_codes is not None and self.statuscode[index] not in status_codes:
+                continue
+            digest = self.digest[index]
+            if digest:
+                digest_to_snapshot.setdefault(digest, []).append(str(timestamp))
+        return digest_to_snapshot
@@ -0,0 +1,163 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+import tenacity
+from .url_download_utils import download_archived_snapshot, DEFAULT_RETRY_POLICY, WAYBACK_BASE_URL
+from .retry_policy import CircuitBreaker, DelayedQueue, classify_error, PERMANENT
+from .rate_limiter import TokenBucket
+from .http_client import HTTPClient
+from .instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# a single attempt per call; retries go through the scheduler's delayed queue instead of sleeping inline
+_download_once = download_archived_snapshot.retry_with(stop=tenacity.stop_after_attempt(1))
+
+
+def plan_downloads(unique_snapshots) -> dict:
+    """
+    Builds a job-wide download plan that fetches each unique payload once.
+
+    Args:
+        unique_snapshots (iterable): Results of URLImporter.get_unique_url_snapshots
+            (or the values of get_unique_url_snapshots_batch).
+
+    Returns:
+        dict: digest -> {"url", "timestamp", "references"}, where url/timestamp is the
+            representative capture to download (the earliest one) and references lists
+            every (url, timestamp) pair across the job that shares the digest.
+    """
+    plan = {}
+    for result in unique_snapshots:
+        url = result["url"]
+        for digest, timestamps in result["digest_to_snapshot"].items():
+            if not timestamps:
+                continue
+            entry = plan.get(digest)
+            if entry is None:
+                entry = plan[digest] = {"url": url, "timestamp": min(timestamps), "references": []}
+            elif min(timestamps) < entry["timestamp"]:
+                entry["url"] = url
+                entry["timestamp"] = min(timestamps)
+            entry["references"].extend((url, timestamp) for timestamp in timestamps)
+    return plan
+
+
+def run_download_plan(plan: dict, on_result, workers: int = 4, requests_per_second: float = 1.0, burst: int = 1, rewrite_modifier: str = "id_", client: HTTPClient = None, cache=None, use_apparent_encoding: bool = True, retry_policy=None, circuit_breaker=None, base: str = WAYBACK_BASE_URL) -> dict:
+    """
+    Downloads every digest of a plan concurrently and fans the result out to all its references.
+
+    All workers share one token bucket, so the combined request rate stays under
+    requests_per_second. on_result is always called on the calling thread, once per
+    (url, timestamp) reference, so it can write to a database without locking.
+
+    Failed downloads are never retried inline: retryable errors (429, 5xx, connection
+    errors) put the digest back on a delayed queue with jittered backoff while the
+    workers keep going, and permanent errors fail the digest immediately. A per-host
+    circuit breaker pauses all requests to a host after repeated failures.
+
+    Args:
+        plan (dict): Output of plan_downloads.
+        on_result (callable): Called as on_result(url, timestamp, digest, result) where result
+            is the dict returned by download_archived_snapshot.
+        workers (int, optional): Number of concurrent downloads. Defaults to 4.
+        requests_per_second (float, optional): Shared download rate. Defaults to 1.0.
+        burst (int, optional): Burst size of the rate limiter. Defaults to 1.
+        rewrite_modifier (str, optional): Wayback rewrite modifier. Defaults to "id_".
+        client (HTTPClient, optional): Pooled HTTP client; one is created when not given.
+        cache (DiskCache, optional): Cache consulted before downloading.
+        use_apparent_encoding (bool, optional): Passed to download_archived_snapshot.
+        retry_policy (RetryPolicy, optional): Defaults to the policy of download_archived_snapshot.
+        circuit_breaker (CircuitBreaker, optional): Defaults to a new CircuitBreaker().
+        base (str, optional): Wayback replay prefix. Defaults to WAYBACK_BASE_URL.
+
+    Returns:
+        dict: Counts of "digests", "references", "downloaded" and "retries", plus "failed",
+            a dict of digest -> exception for payloads that could not be fetched.
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    rate_limiter = TokenBucket(requests_per_second, burst)
+    retry_policy = retry_policy if retry_policy is not None else DEFAULT_RETRY_POLICY
+    circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+    host = urlsplit(base).hostname
+    stats = {"digests": len(plan), "references": 0, "downloaded": 0, "retries": 0, "failed": {}}
+    attempts = {}
+
+    def fetch(digest, entry):
+        rate_limiter.acquire()
+        return _download_once(
+            entry["url"],
+            entry["timestamp"],
+            rewrite_modifier=rewrite_modifier,
+            sleep=0,
+            use_apparent_encoding=use_apparent_encoding,
+            client=client,
+            cache=cache,
+            digest=digest,
+            base=base,
+        )
+
+    def fan_out(digest, future, delayed):
+        try:
+            result = future.result()
+        except Exception as e:
+            attempts[digest] = attempts.get(digest, 0) + 1
+            # the host did answer a permanent error, so it counts as a success for the breaker (and ends a half-open trial)
+            if classify_error(e) == PERMANENT:
+                circuit_breaker.record_success(host)
+            else:
+                circuit_breaker.record_failure(host)
+            if retry_policy.should_retry(e, attempts[digest]):
+                delay = retry_policy.delay(e, attempts[digest])
+                logger.info("Retrying digest %s in %.1fs after error: %s", digest, delay, e)
+                stats["retries"] += 1
+                metrics.counter("wmscraper_retries_total", "Retried requests by source and error class").inc(source="scheduler", reason=classify_error(e))
+                delayed.push(digest, delay)
+                return
+            logger.warning("Failed to download digest %s: %s", digest, e)
+            stats["failed"][digest] = e
+            return
+        circuit_breaker.record_success(host)
+        stats["downloaded"] += 1
+        for url, timestamp in plan[digest]["references"]:
+            on_result(url, timestamp, digest, result)
+            stats["references"] += 1
+
+    own_client = client is None
+    if own_client:
+        client = HTTPClient(pool_maxsize=max(workers, 10))
+    try:
+        # keep a bounded number of downloads in flight so large plans don't hold every payload at once
+        max_in_flight = workers * 2
+        pending = deque(plan)
+        delayed = DelayedQueue()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            while pending or in_flight or len(delayed):
+                pending.extend(delayed.pop_ready())
+                while pending and len(in_flight) < max_in_flight:
+                    if not circuit_breaker.allow(host):
+                        break
+                    digest = pending.popleft()
+                    in_flight[executor.submit(fetch, digest, plan[digest])] = digest
+
+                # wake up when a download finishes or a delayed retry becomes due
+                timeout = delayed.next_ready_in()
+                if pending and circuit_breaker.is_open(host):
+                    timeout = max(circuit_breaker.retry_in(host), 0.1)
+                if not in_flight:
+                    time.sleep(timeout if timeout is not None else 0)
+                    continue
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fan_out(in_flight.pop(future), future, delayed)
+    finally:
+        if own_client:
+            client.close()
+
+    logger.info("Downloaded %d of %d unique payloads for %d snapshots", stats["downloaded"], stats["digests"], stats["references"])
+    return stats
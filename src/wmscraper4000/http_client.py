@@ -0,0 +1,76 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HTTPClient:
+    """Pooled keep-alive HTTP client shared by the CDX, download and dedupe helpers.
+
+    One client keeps its TCP/TLS connections open between calls, so requests to
+    web.archive.org and the pastinternet service skip the handshake after the
+    first one. The client is safe to share between worker threads.
+
+    Args:
+        pool_connections (int, optional): Number of per-host connection pools to cache. Defaults to 10.
+        pool_maxsize (int, optional): Maximum number of connections kept open per host. Defaults to 32.
+        timeout (float or tuple, optional): Default (connect, read) timeout in seconds. Defaults to (10, 60).
+        http2 (bool, optional): Use HTTP/2 through httpx (requires `httpx[http2]`). Defaults to False.
+        headers (dict, optional): Headers sent with every request.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 32, timeout=(10, 60), http2: bool = False, headers: dict = None):
+        self.timeout = timeout
+        self.http2 = http2
+        if http2:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError("HTTP/2 support requires httpx: pip install 'httpx[http2]'")
+            self._httpx = httpx
+            self._session = httpx.Client(
+                http2=True,
+                timeout=self._httpx_timeout(timeout),
+                limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+                headers=headers,
+            )
+        else:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            if headers:
+                self._session.headers.update(headers)
+
+    def _httpx_timeout(self, timeout):
+        # httpx doesn't take requests-style (connect, read) tuples
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return self._httpx.Timeout(read, connect=connect)
+        return timeout
+
+    def get(self, url: str, params=None, allow_redirects: bool = True, timeout=None, stream: bool = False, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        if self.http2:
+            request = self._session.build_request("GET", url, params=params, timeout=self._httpx_timeout(timeout), **kwargs)
+            return self._session.send(request, follow_redirects=allow_redirects, stream=stream)
+        return self._session.get(url, params=params, allow_redirects=allow_redirects, timeout=timeout, stream=stream, **kwargs)
+
+    def head(self, url: str, allow_redirects: bool = False, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        if self.http2:
+            return self._session.head(url, follow_redirects=allow_redirects, timeout=self._httpx_timeout(timeout), **kwargs)
+        return self._session.head(url, allow_redirects=allow_redirects, timeout=timeout, **kwargs)
+
+    def post(self, url: str, json=None, data=None, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        if self.http2:
+            return self._session.post(url, json=json, data=data, timeout=self._httpx_timeout(timeout), **kwargs)
+        return self._session.post(url, json=json, data=data, timeout=timeout, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
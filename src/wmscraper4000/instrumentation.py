@@ -0,0 +1,208 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# package logger; every module logs through a child of it (logging.getLogger(__name__)).
+# Like any library it only has a NullHandler, records go wherever the application's logging config sends them.
+logger = logging.getLogger("wmscraper4000")
+logger.addHandler(logging.NullHandler())
+
+_console_handler = None
+
+
+def set_log_level(level):
+    """Sets the package log level, e.g. logging.WARNING to keep hot loops silent or logging.DEBUG for per-URL output."""
+    logger.setLevel(level)
+
+
+def enable_console_logging(level=logging.INFO, stream=None):
+    """
+    Prints the package's log messages to stream (stdout by default), the way progress used to be printed.
+
+    Meant for scripts and the command line entry point, not for code that configures
+    logging itself. Records stop propagating to the root logger while the handler is
+    installed, so they aren't printed twice. Calling it again replaces the handler.
+    """
+    global _console_handler
+    use_application_logging()
+    _console_handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    _console_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_console_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def use_application_logging():
+    """Removes the handler installed by enable_console_logging, so records propagate to the application's logging setup again."""
+    global _console_handler
+    if _console_handler is not None:
+        logger.removeHandler(_console_handler)
+        _console_handler = None
+    logger.propagate = True
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str = "", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = 0
+            while index < len(self.buckets) and value > self.buckets[index]:
+                index += 1
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def quantile(self, q: float, **labels):
+        """Estimates a quantile from the bucket counts (upper bound of the bucket holding it)."""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if not series or not series["count"]:
+                return None
+            rank = q * series["count"]
+            seen = 0
+            for index, count in enumerate(series["counts"]):
+                seen += count
+                if seen >= rank:
+                    return self.buckets[index] if index < len(self.buckets) else float("inf")
+            return float("inf")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]} for key, s in self._series.items()}
+
+
+class MetricsRegistry:
+    """Process-wide registry of counters and histograms.
+
+    Exported either in the Prometheus text format (to_prometheus) or as a JSON
+    stats dump (to_json). Recording a value is a dict update under a lock, cheap
+    enough for per-request hot paths.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help)
+            return self._metrics[name]
+
+    def histogram(self, name: str, help: str = "", buckets=DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help, buckets)
+            return self._metrics[name]
+
+    @contextmanager
+    def timer(self, name: str, help: str = "", **labels):
+        """Observes the duration of the with-block in seconds, also when it raises."""
+        histogram = self.histogram(name, help)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {metric.name} counter")
+                for key, value in metric.snapshot().items():
+                    lines.append(f"{metric.name}{_format_labels(key)} {value}")
+            else:
+                lines.append(f"# TYPE {metric.name} histogram")
+                for key, series in metric.snapshot().items():
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets) + ["+Inf"], series["counts"]):
+                        cumulative += count
+                        lines.append(f"{metric.name}_bucket{_format_labels(key, {'le': bound})} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(key)} {series['sum']}")
+                    lines.append(f"{metric.name}_count{_format_labels(key)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        stats = {}
+        for metric in metrics:
+            series_stats = {}
+            if isinstance(metric, Counter):
+                for key, value in metric.snapshot().items():
+                    series_stats[_format_labels(key) or "total"] = value
+            else:
+                for key, series in metric.snapshot().items():
+                    labels = dict(key)
+                    series_stats[_format_labels(key) or "total"] = {
+                        "count": series["count"],
+                        "sum": series["sum"],
+                        "mean": series["sum"] / series["count"] if series["count"] else None,
+                        "p50": metric.quantile(0.5, **labels),
+                        "p99": metric.quantile(0.99, **labels),
+                    }
+            stats[metric.name] = series_stats
+        return stats
+
+    def to_json(self, indent: int = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent, default=str)
+
+
+metrics = MetricsRegistry()
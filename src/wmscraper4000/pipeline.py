@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .wm_cdx_utils import get_cdx_records
+from .url_normalize_utils import validate_and_normalize
+from .url_input_readers import iter_json_batches, iter_csv_batches, csv_chunk_rows
+from .url_preimport_utils import DEFAULT_CDX_REQUESTS_PER_SECOND
+from .url_import_utils import URLImporter
+from .url_download_utils import stream_archived_snapshot, WAYBACK_BASE_URL
+from .url_dedupe_utils import check_urls_already_in_db
+from .rate_limiter import TokenBucket
+from .http_client import HTTPClient
+from .cache import DiskCache
+from .warc_utils import WARCWriter
+from .instrumentation import metrics, enable_console_logging
+
+logger = logging.getLogger(__name__)
+
+# marks the end of a stage's input
+_DONE = object()
+
+STAGE_SECONDS = "wmscraper_pipeline_stage_seconds"
+STAGE_SECONDS_HELP = "Time spent in blocking pipeline work, by stage"
+
+
+def _read_batches(file_path: str, batch_size: int):
+    # (url, title, description, category, page_number) rows, batch_size at a time
+    if file_path.lower().endswith(".csv"):
+        for chunk in iter_csv_batches(file_path, batch_size):
+            required_columns = {"url", "title", "description"}
+            if not required_columns.issubset(chunk.columns):
+                raise ValueError(f"The CSV file must contain the following columns: {required_columns}")
+            yield list(csv_chunk_rows(chunk))
+        return
+    for batch in iter_json_batches(file_path, batch_size):
+        if not all(all(key in entry for key in ("url", "title", "description")) for entry in batch):
+            raise ValueError("Each entry must contain 'url', 'title', and 'description' keys.")
+        yield [(entry["url"], entry["title"], entry["description"], entry.get("category"), entry.get("page_number", 0)) for entry in batch]
+
+
+def _lot_entry(item: dict, lot_id) -> dict:
+    # maps a URL list row onto the keyword arguments of URLImporter.add_url
+    entry = {"url": item["url"], "lot_id": lot_id, "site_title": item["title"], "site_desc": item["description"] or ""}
+    if item["category"]:
+        entry["lot_path"] = item["category"]
+    if item["page_number"] not in (None, ""):
+        entry["page_number"] = item["page_number"]
+    return entry
+
+
+async def run_pipeline(file_path: str, importer: URLImporter, lot_id, from_date: str = None, to_date: str = None, status_codes=(200,), output_dir: str = None, warc_writer: WARCWriter = None, cdx_workers: int = 2, cdx_requests_per_second: float = DEFAULT_CDX_REQUESTS_PER_SECOND, download_workers: int = 4, download_requests_per_second: float = 1.0, burst: int = 1, mongo_batch_size: int = 500, mongo_flush_interval: float = 1.0, queue_size: int = 1000, read_batch_size: int = 10000, existence_checker=None, client: HTTPClient = None, cache: DiskCache = None, cdx_params: dict = None, rewrite_modifier: str = "id_", download_base: str = WAYBACK_BASE_URL) -> dict:
+    """
+    Streams a URL list through validation, CDX lookup, MongoDB import and snapshot download.
+
+    The four stages run at the same time and are connected by bounded queues. A slow
+    stage fills its input queue and stalls the stages before it, so at most queue_size
+    items wait between two stages, and total run time approaches that of the slowest
+    stage rather than the sum of all of them. To fetch each URL and payload once, the
+    run also remembers every URL and digest it has seen, which takes roughly 150 bytes
+    per unique URL and 120 bytes per unique digest. Blocking work (file reading, HTTP requests, MongoDB writes)
+    runs on a thread pool, so the event loop only moves items between queues.
+
+    - validate: reads the list in batches, drops invalid and repeated URLs and, with an
+      existence_checker, marks URLs already in the database (those skip CDX and download).
+    - CDX: cdx_workers concurrent get_cdx_records calls sharing one rate limiter.
+    - Mongo: results are written with add_urls_bulk and add_url_snapshots_bulk once
+      mongo_batch_size have arrived or mongo_flush_interval seconds after the first one.
+      Each unique payload digest with a status in status_codes is then queued for
+      download once per run.
+    - download: download_workers concurrent stream_archived_snapshot calls sharing one
+      rate limiter. The body is checked against the CDX digest and stored as
+      output_dir/<digest> or appended to warc_writer. Payloads that fail the check are
+      kept as output_dir/mismatched/<digest> instead and fetched again by the next run.
+      Without output_dir or warc_writer there is no download stage.
+
+    Rows are mapped onto add_url as site_title=title, site_desc=description,
+    lot_path=category and page_number. A URL whose CDX request fails is logged and still
+    imported without snapshots.
+
+    Args:
+        file_path (str): URL list (.json, .jsonl/.ndjson or .csv) with url, title and description.
+        importer (URLImporter): An entered importer.
+        lot_id: Lot the URLs are recorded under.
+        from_date (str, optional): Start of the CDX timestamp range.
+        to_date (str, optional): End of the CDX timestamp range.
+        status_codes (iterable, optional): Status codes of captures worth downloading. Defaults to (200,).
+        output_dir (str, optional): Directory payloads are written to, one file per digest.
+        warc_writer (WARCWriter, optional): Writer payloads are appended to.
+        cdx_workers (int, optional): Concurrent CDX requests. Defaults to 2.
+        cdx_requests_per_second (float, optional): Shared CDX request rate. Defaults to DEFAULT_CDX_REQUESTS_PER_SECOND.
+        download_workers (int, optional): Concurrent downloads. Defaults to 4.
+        download_requests_per_second (float, optional): Shared download rate. Defaults to 1.0.
+        burst (int, optional): Burst size of both rate limiters. Defaults to 1.
+        mongo_batch_size (int, optional): Maximum URLs per MongoDB write. Defaults to 500.
+        mongo_flush_interval (float, optional): Longest time a result waits for its batch to fill. Defaults to 1.0.
+        queue_size (int, optional): Capacity of each queue between stages. Defaults to 1000.
+        read_batch_size (int, optional): Rows read and validated at a time. Defaults to 10000.
+        existence_checker (callable, optional): Batched existence check, see fill_pending_cdx_data.
+        client (HTTPClient, optional): Pooled HTTP client; one is created when not given.
+        cache (DiskCache, optional): Cache for CDX responses.
+        cdx_params (dict, optional): Extra keyword arguments for get_cdx_records, e.g. filter.
+        rewrite_modifier (str, optional): Wayback rewrite modifier for downloads. Defaults to "id_".
+        download_base (str, optional): Wayback replay prefix. Defaults to WAYBACK_BASE_URL.
+
+    Returns:
+        dict: Counts per stage, the seconds of blocking work per stage ("stage_seconds")
+            and the total wall-clock "seconds".
+    """
+    if cdx_workers < 1 or download_workers < 1:
+        raise ValueError("cdx_workers and download_workers must be at least 1")
+    if output_dir is not None and warc_writer is not None:
+        raise ValueError("Pass either output_dir or warc_writer, not both")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    download = output_dir is not None or warc_writer is not None
+    status_codes = set(status_codes) if status_codes is not None else None
+    cdx_params = dict(cdx_params or {})
+
+    stats = {
+        "urls": 0, "invalid": 0, "repeated": 0, "known": 0,
+        "cdx_fetched": 0, "cdx_failed": 0, "excluded": 0, "captures": 0,
+        "imported": 0, "digests": 0, "duplicate_payloads": 0,
+        "downloaded": 0, "download_failed": 0, "digest_mismatches": 0,
+        "stage_seconds": {"validate": 0.0, "cdx": 0.0, "mongo": 0.0, "download": 0.0},
+    }
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=cdx_workers + download_workers + 2)
+    own_client = client is None
+    if own_client:
+        client = HTTPClient(pool_maxsize=max(cdx_workers + download_workers, 10))
+    cdx_limiter = TokenBucket(cdx_requests_per_second, burst)
+    download_limiter = TokenBucket(download_requests_per_second, burst)
+    cdx_queue = asyncio.Queue(maxsize=queue_size)
+    mongo_queue = asyncio.Queue(maxsize=queue_size)
+    download_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def blocking(stage, function, *args):
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, function, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats["stage_seconds"][stage] += elapsed
+            metrics.histogram(STAGE_SECONDS, STAGE_SECONDS_HELP).observe(elapsed, stage=stage)
+
+    def validate(rows):
+        mask, canonical = validate_and_normalize([row[0] for row in rows])
+        valid = []
+        for row, ok, url in zip(rows, mask, canonical):
+            if ok:
+                valid.append((url, row))
+            else:
+                logger.error("Skipping URL that failed validation: %s", row[0])
+        existing = existence_checker([url for url, _ in valid]) if existence_checker is not None and valid else set()
+        return valid, len(rows) - len(valid), existing
+
+    def fetch_cdx(url):
+        # cached responses don't take a token from the rate limiter
+        return get_cdx_records(url, from_date=from_date, to_date=to_date, rate_limiter=cdx_limiter, client=client, cache=cache, as_records=True, **cdx_params)
+
+    def write_to_mongo(buffer):
+        importer.add_urls_bulk([_lot_entry(item, lot_id) for item, _ in buffer])
+        importer.add_url_snapshots_bulk([(item["url"], records) for item, records in buffer if records is not None])
+
+    def fetch_payload(job):
+        url, timestamp, digest = job
+        dest = None
+        if output_dir is not None:
+            dest = os.path.join(output_dir, digest)
+            if os.path.exists(dest):
+                # fetched and verified by an earlier run
+                return {"status_code": 200, "path": dest, "digest_matches": True}
+        download_limiter.acquire()
+        result = stream_archived_snapshot(
+            url, timestamp,
+            dest=dest + ".part" if dest else None,
+            rewrite_modifier=rewrite_modifier,
+            expected_digest=digest,
+            warc_writer=warc_writer,
+            sleep=0,
+            client=client,
+            base=download_base,
+        )
+        if dest and result["path"] is not None:
+            if result["digest_matches"] is False:
+                # only verified payloads may be named by their digest, a later run would take them as done
+                os.makedirs(os.path.join(output_dir, "mismatched"), exist_ok=True)
+                result["path"] = os.path.join(output_dir, "mismatched", digest)
+            else:
+                result["path"] = dest
+            os.replace(dest + ".part", result["path"])
+        return result
+
+    async def source():
+        seen = set()
+        batches = _read_batches(file_path, read_batch_size)
+        while True:
+            rows = await blocking("validate", next, batches, None)
+            if rows is None:
+                break
+            valid, invalid, existing = await blocking("validate", validate, rows)
+            stats["invalid"] += invalid
+            for url, (_, title, description, category, page_number) in valid:
+                if url in seen:
+                    stats["repeated"] += 1
+                    continue
+                seen.add(url)
+                stats["urls"] += 1
+                item = {"url": url, "title": title, "description": description, "category": category, "page_number": page_number, "known": url in existing}
+                await cdx_queue.put(item)
+        for _ in range(cdx_workers):
+            await cdx_queue.put(_DONE)
+
+    async def cdx_worker():
+        while True:
+            item = await cdx_queue.get()
+            if item is _DONE:
+                return
+            records = None
+            if item["known"]:
+                stats["known"] += 1
+            else:
+                try:
+                    records = await blocking("cdx", fetch_cdx, item["url"])
+                except Exception as e:
+                    logger.warning("CDX request failed for %s: %s", item["url"], e)
+                    stats["cdx_failed"] += 1
+                if isinstance(records, str):
+                    # error marker for URLs excluded from the Wayback Machine
+                    stats["excluded"] += 1
+                    records = None
+                elif records is not None:
+                    stats["cdx_fetched"] += 1
+                    stats["captures"] += len(records)
+            await mongo_queue.put((item, records))
+
+    async def cdx_stage():
+        await asyncio.gather(*(cdx_worker() for _ in range(cdx_workers)))
+        await mongo_queue.put(_DONE)
+
+    async def mongo_stage():
+        seen_digests = set()
+        done = False
+        while not done:
+            buffer = []
+            deadline = None
+            while len(buffer) < mongo_batch_size:
+                timeout = deadline - loop.time() if deadline is not None else None
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(mongo_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _DONE:
+                    done = True
+                    break
+                buffer.append(entry)
+                if deadline is None:
+                    deadline = loop.time() + mongo_flush_interval
+            if not buffer:
+                continue
+            await blocking("mongo", write_to_mongo, buffer)
+            stats["imported"] += len(buffer)
+            if not download:
+                continue
+            for item, records in buffer:
+                if records is None:
+                    continue
+                for digest, timestamps in records.group_by_digest(status_codes=status_codes).items():
+                    if digest in seen_digests:
+                        stats["duplicate_payloads"] += 1
+                        continue
+                    seen_digests.add(digest)
+                    stats["digests"] += 1
+                    await download_queue.put((item["url"], min(timestamps), digest))
+        for _ in range(download_workers if download else 0):
+            await download_queue.put(_DONE)
+
+    async def download_worker():
+        while True:
+            job = await download_queue.get()
+            if job is _DONE:
+                return
+            try:
+                result = await blocking("download", fetch_payload, job)
+            except Exception as e:
+                logger.warning("Failed to download %s at %s: %s", job[0], job[1], e)
+                stats["download_failed"] += 1
+                continue
+            if result["status_code"] != 200:
+                stats["download_failed"] += 1
+                continue
+            stats["downloaded"] += 1
+            if result["digest_matches"] is False:
+                stats["digest_mismatches"] += 1
+
+    start = time.perf_counter()
+    stages = [source(), cdx_stage(), mongo_stage()]
+    if download:
+        stages += [download_worker() for _ in range(download_workers)]
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # a failed stage would leave the others blocked on their queues
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        if own_client:
+            client.close()
+    stats["seconds"] = time.perf_counter() - start
+
+    logger.info(
+        "Pipeline finished in %.1fs: %d URLs (%d invalid, %d already known), %d captures, %d imported, %d of %d unique payloads downloaded",
+        stats["seconds"], stats["urls"], stats["invalid"], stats["known"], stats["captures"], stats["imported"], stats["downloaded"], stats["digests"],
+    )
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="wmscraper4000",
+        description="Stream a URL list through validation, CDX lookup, MongoDB import and snapshot download.",
+    )
+    parser.add_argument("input", help="URL list (.json, .jsonl/.ndjson or .csv) with url, title and description")
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--database", default="xm")
+    parser.add_argument("--collection", default="urls_international")
+    parser.add_argument("--snapshot-collection", default="url_snapshots")
+    parser.add_argument("--lot-id", required=True, help="Lot the URLs are recorded under")
+    parser.add_argument("--from-date", help="Start of the CDX timestamp range, e.g. 1996")
+    parser.add_argument("--to-date", help="End of the CDX timestamp range, e.g. 20051231")
+    parser.add_argument("--filter", action="append", help="CDX filter expression, may be repeated")
+    parser.add_argument("--status-code", type=int, action="append", help="Status code of captures to download, may be repeated (default: 200)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--output-dir", help="Write each unique payload to this directory, named by digest")
+    output.add_argument("--warc", help="Append the payloads to this WARC file (plus a .cdx index)")
+    parser.add_argument("--cdx-workers", type=int, default=2)
+    parser.add_argument("--cdx-rps", type=float, default=DEFAULT_CDX_REQUESTS_PER_SECOND, help="Shared CDX request rate")
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--download-rps", type=float, default=1.0, help="Shared download rate")
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--mongo-batch-size", type=int, default=500)
+    parser.add_argument("--mongo-flush-interval", type=float, default=1.0, help="Seconds a result waits for its MongoDB batch to fill")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Capacity of each queue between stages")
+    parser.add_argument("--existence-endpoint", help="Bulk pastinternet endpoint; URLs it knows skip CDX and download")
+    parser.add_argument("--cache-dir", help="Cache CDX responses in this directory")
+    parser.add_argument("--metrics-file", help="Write metrics here when done (.prom for the Prometheus text format, JSON otherwise)")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    # progress goes to stderr, stdout is left for the stats JSON
+    enable_console_logging(args.log_level.upper(), sys.stderr)
+    cdx_params = {"filter": args.filter} if args.filter else None
+
+    with URLImporter(args.mongo_uri, args.database, args.collection, args.snapshot_collection) as importer, \
+            HTTPClient(pool_maxsize=max(args.cdx_workers + args.download_workers, 10)) as client:
+        existence_checker = partial(check_urls_already_in_db, bulk_endpoint=args.existence_endpoint, client=client) if args.existence_endpoint else None
+        warc_writer = WARCWriter(args.warc) if args.warc else None
+        cache = DiskCache(args.cache_dir) if args.cache_dir else None
+        try:
+            stats = asyncio.run(run_pipeline(
+                args.input,
+                importer,
+                args.lot_id,
+                from_date=args.from_date,
+                to_date=args.to_date,
+                status_codes=args.status_code or (200,),
+                output_dir=args.output_dir,
+                warc_writer=warc_writer,
+                cdx_workers=args.cdx_workers,
+                cdx_requests_per_second=args.cdx_rps,
+                download_workers=args.download_workers,
+                download_requests_per_second=args.download_rps,
+                burst=args.burst,
+                mongo_batch_size=args.mongo_batch_size,
+                mongo_flush_interval=args.mongo_flush_interval,
+                queue_size=args.queue_size,
+                existence_checker=existence_checker,
+                client=client,
+                cache=cache,
+                cdx_params=cdx_params,
+            ))
+        finally:
+            if warc_writer is not None:
+                warc_writer.close()
+            if cache is not None:
+                cache.close()
+
+    if args.metrics_file:
+        with open(args.metrics_file, "w") as file:
+            file.write(metrics.to_prometheus() if args.metrics_file.endswith(".prom") else metrics.to_json())
+    print(json.dumps(stats, indent=2))
+    return 0 if not stats["cdx_failed"] and not stats["download_failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import heapq
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+import urllib3
+from .instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# error classes returned by classify_error
+RATE_LIMITED = "rate_limited"
+SERVER_ERROR = "server_error"
+CONNECTION_ERROR = "connection_error"
+PERMANENT = "permanent"
+
+# transport failures worth retrying; anything else raised by requests (bad URLs, redirect loops)
+# or by the OS (missing directories, permissions) fails the same way on every attempt
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.TimeoutError,
+    urllib3.exceptions.DecodeError,
+    http.client.IncompleteRead,
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+)
+
+
+def _response_of(error):
+    return getattr(error, "response", None)
+
+
+def retry_after_seconds(response):
+    """Parses a Retry-After header (seconds or HTTP date). Returns None if absent or invalid."""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error) -> str:
+    """Classifies an exception raised while talking to the archive."""
+    response = _response_of(error)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        if status == 429:
+            return RATE_LIMITED
+        if status >= 500:
+            return SERVER_ERROR
+        if status == 408:
+            return CONNECTION_ERROR
+        return PERMANENT
+    if isinstance(error, TRANSIENT_ERRORS) or _is_httpx_transport_error(error):
+        return CONNECTION_ERROR
+    return PERMANENT
+
+
+def _is_httpx_transport_error(error):
+    # httpx is optional, so its exceptions are recognized by name; UnsupportedProtocol is a bad URL
+    names = {cls.__name__ for cls in type(error).__mro__ if cls.__module__.startswith("httpx")}
+    return "TransportError" in names and "UnsupportedProtocol" not in names
+
+
+class RetryPolicy:
+    """Decides whether and when a failed request is retried.
+
+    Permanent errors (non-retryable 4xx, programming errors) are never retried.
+    Other errors wait base * 2**attempt seconds capped at max_delay, with full
+    jitter so workers that failed together don't retry together. A 429 with a
+    Retry-After header waits at least as long as the server asked for.
+
+    Args:
+        max_attempts (int, optional): Total number of attempts. Defaults to 6.
+        base_delay (float, optional): Backoff base in seconds. Defaults to 2.
+        max_delay (float, optional): Upper bound for a single wait. Defaults to 60.
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 2, max_delay: float = 60):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error) -> bool:
+        return classify_error(error) != PERMANENT
+
+    def should_retry(self, error, attempt: int) -> bool:
+        """attempt is the number of attempts made so far (1 after the first failure)."""
+        return attempt < self.max_attempts and self.is_retryable(error)
+
+    def delay(self, error, attempt: int) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if classify_error(error) == RATE_LIMITED:
+            retry_after = retry_after_seconds(_response_of(error))
+            if retry_after is not None:
+                return max(backoff, min(retry_after, self.max_delay * 5))
+        return backoff
+
+    def tenacity_kwargs(self, source: str = "tenacity") -> dict:
+        """Arguments for tenacity.retry implementing this policy inline; retries are counted under source."""
+        import tenacity
+
+        def count_retry(state):
+            error = state.outcome.exception()
+            metrics.counter("wmscraper_retries_total", "Retried requests by source and error class").inc(source=source, reason=classify_error(error))
+            logger.debug("Retrying %s after error: %s", source, error)
+
+        return {
+            "stop": tenacity.stop_after_attempt(self.max_attempts),
+            "retry": tenacity.retry_if_exception(self.is_retryable),
+            "wait": lambda state: self.delay(state.outcome.exception(), state.attempt_number),
+            "before_sleep": count_retry,
+            "reraise": True,
+        }
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker.
+
+    After failure_threshold consecutive retryable failures for a host, the circuit
+    opens and allow() returns False for reset_timeout seconds. After that one
+    trial request is let through; success closes the circuit, failure opens it again.
+    Every request let through by allow() must end in record_success or record_failure,
+    otherwise a trial never finishes and the circuit stays open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = set()
+        self._lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at < self.reset_timeout or host in self._trial:
+                return False
+            self._trial.add(host)
+            return True
+
+    def is_open(self, host: str) -> bool:
+        """True while requests to host are blocked. Unlike allow(), never starts a trial."""
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return False
+            return time.monotonic() - opened_at < self.reset_timeout or host in self._trial
+
+    def retry_in(self, host: str) -> float:
+        """Seconds until the circuit for host lets a trial request through."""
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - opened_at))
+
+    def record_success(self, host: str):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trial.discard(host)
+
+    def record_failure(self, host: str):
+        with self._lock:
+            self._trial.discard(host)
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self.failure_threshold:
+                self._opened_at[host] = time.monotonic()
+
+
+class DelayedQueue:
+    """Thread-safe queue of items that become available after a delay."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def push(self, item, delay: float = 0):
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, item))
+            self._counter += 1
+
+    def pop_ready(self) -> list:
+        """Removes and returns every item whose delay has passed."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                ready.append(heapq.heappop(self._heap)[2])
+        return ready
+
+    def next_ready_in(self):
+        """Seconds until the next item is ready, or None if the queue is empty."""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.monotonic())
@@ -0,0 +1,217 @@
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+URLS_TABLE_SCHEMA = '''
+    CREATE TABLE urls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL UNIQUE,
+        title TEXT,
+        description TEXT,
+        category TEXT,
+        page_number INTEGER DEFAULT 0,
+        cdx_data TEXT,
+        lease_owner TEXT,
+        lease_expires REAL
+    );
+'''
+
+# tuned for bulk loading a local staging file: WAL lets readers run alongside the
+# writer and synchronous=NORMAL only fsyncs at checkpoints instead of every commit
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-65536;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA busy_timeout=30000;",
+)
+
+
+class StagingStore:
+    """SQLite staging database (the preimport .db) shared by both preprocess functions.
+
+    Rows are inserted with executemany in transactions of batch_size rows, the url
+    column is unique so duplicate input rows collapse into one, and a partial index
+    on rows whose cdx_data is NULL keeps the pending-work query cheap. Databases
+    created by earlier versions are upgraded in place where possible.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        batch_size (int, optional): Rows per insert transaction. Defaults to 10000.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self._create_schema()
+
+    def _table_exists(self, name: str) -> bool:
+        return self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (name,)).fetchone() is not None
+
+    def _create_schema(self):
+        with self.conn:
+            urls_existed = self._table_exists("urls")
+            meta_existed = self._table_exists("staging_meta")
+            if not urls_existed:
+                self.conn.execute(URLS_TABLE_SCHEMA)
+            if not meta_existed:
+                self.conn.execute("CREATE TABLE staging_meta (key TEXT PRIMARY KEY, value TEXT);")
+                # databases written by earlier versions were fully ingested when the table was created
+                self._set_meta("ingest_complete", "1" if urls_existed else "0")
+            # lease columns for multi-process work claiming, added to databases created before they existed
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(urls);")}
+            for column, column_type in (("lease_owner", "TEXT"), ("lease_expires", "REAL")):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE urls ADD COLUMN {column} {column_type};")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_pending ON urls(id) WHERE cdx_data IS NULL;")
+        if urls_existed:
+            try:
+                with self.conn:
+                    self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_url ON urls(url);")
+            except sqlite3.IntegrityError:
+                logger.warning("Existing duplicate URLs in %s, duplicate rows will not be collapsed.", self.db_path)
+
+    def _get_meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM staging_meta WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO staging_meta (key, value) VALUES (?, ?);", (key, value))
+
+    @property
+    def ingest_complete(self) -> bool:
+        return self._get_meta("ingest_complete") == "1"
+
+    def mark_ingest_complete(self):
+        with self.conn:
+            self._set_meta("ingest_complete", "1")
+
+    def insert_rows(self, rows) -> int:
+        """
+        Inserts (url, title, description, category, page_number) tuples in batched transactions.
+
+        Rows whose url is already staged are ignored. Returns the number of rows inserted.
+        """
+        inserted = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                inserted += self._insert_batch(batch)
+                batch = []
+        if batch:
+            inserted += self._insert_batch(batch)
+        return inserted
+
+    def _insert_batch(self, batch) -> int:
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO urls (url, title, description, category, page_number)
+                VALUES (?, ?, ?, ?, ?);
+            ''', batch)
+        return self.conn.total_changes - before
+
+    def count_rows(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM urls;").fetchone()[0]
+
+    def count_pending(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM urls WHERE cdx_data IS NULL;").fetchone()[0]
+
+    def pending_rows(self, batch_size: int = None):
+        """
+        Yields (id, url) for every row that has cdx_data as NULL, in id order.
+
+        Rows are read batch_size (default: the store's batch_size) at a time, each batch
+        starting after the last id of the previous one, so memory use doesn't grow with
+        the number of pending rows and rows can be updated while iterating.
+        """
+        batch_size = batch_size or self.batch_size
+        last_id = 0
+        while True:
+            rows = self.conn.execute(
+                "SELECT id, url FROM urls WHERE cdx_data IS NULL AND id > ? ORDER BY id LIMIT ?;",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def claim_batch(self, worker_id: str, batch_size: int = 100, lease_seconds: float = 600) -> list:
+        """
+        Atomically leases up to batch_size pending rows to worker_id.
+
+        Rows leased by another worker are skipped until their lease expires, so any
+        number of processes sharing the database file can claim work safely; rows of a
+        crashed worker become claimable again after lease_seconds.
+
+        Returns:
+            list: (id, url) tuples of the claimed rows.
+        """
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so select + update can't interleave with another claimer
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            rows = self.conn.execute('''
+                SELECT id, url FROM urls
+                WHERE cdx_data IS NULL AND (lease_expires IS NULL OR lease_expires < ?)
+                ORDER BY id LIMIT ?;
+            ''', (now, batch_size)).fetchall()
+            self.conn.executemany(
+                "UPDATE urls SET lease_owner = ?, lease_expires = ? WHERE id = ?;",
+                [(worker_id, now + lease_seconds, id) for id, _ in rows],
+            )
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return rows
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = 600):
+        """Extends every lease held by worker_id."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE urls SET lease_expires = ? WHERE lease_owner = ? AND cdx_data IS NULL;",
+                (time.time() + lease_seconds, worker_id),
+            )
+
+    def complete(self, worker_id: str, updates):
+        """Stores cdx_data for (id, cdx_data) pairs and drops their leases."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE urls SET cdx_data = ?, lease_owner = NULL, lease_expires = NULL WHERE id = ?;",
+                [(json.dumps(cdx_data), id) for id, cdx_data in updates],
+            )
+
+    def release(self, worker_id: str):
+        """Gives back the unfinished rows leased by worker_id."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE urls SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ? AND cdx_data IS NULL;",
+                (worker_id,),
+            )
+
+    def leased_elsewhere(self, worker_id: str) -> tuple:
+        """Returns the number of pending rows under unexpired leases of other workers and the earliest expiry (None if there are none)."""
+        return self.conn.execute(
+            "SELECT COUNT(*), MIN(lease_expires) FROM urls WHERE cdx_data IS NULL AND lease_expires >= ? AND lease_owner != ?;",
+            (time.time(), worker_id),
+        ).fetchone()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
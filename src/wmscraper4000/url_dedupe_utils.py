@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import math
+import requests
+from .url_normalize_utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_urls_in_collection(collection, urls, batch_size: int = 5000) -> set:
+    """
+    Returns the subset of urls that already have a document in a Mongo collection.
+
+    One indexed $in query is issued per batch_size URLs instead of one request per URL.
+    """
+    urls = list(dict.fromkeys(urls))
+    normalized = {}
+    for url in urls:
+        normalized.setdefault(normalize_url(url), []).append(url)
+
+    existing = set()
+    for chunk in _chunks(list(normalized), batch_size):
+        for document in collection.find({"url": {"$in": chunk}}, {"url": 1, "_id": 0}):
+            existing.update(normalized.get(document["url"], ()))
+    return existing
+
+
+def check_urls_already_in_db(urls, bulk_endpoint: str = "http://localhost:5000/exists", batch_size: int = 1000, client=None) -> set:
+    """
+    Batched version of check_if_url_already_in_db against a bulk pastinternet endpoint.
+
+    POSTs {"urls": [...]} for every batch_size URLs and expects {"existing": [...]} back.
+
+    Returns:
+        set: The URLs that are already in the database.
+    """
+    http = client if client is not None else requests
+    urls = list(dict.fromkeys(urls))
+    existing = set()
+    for chunk in _chunks(urls, batch_size):
+        response = http.post(bulk_endpoint, json={"urls": chunk})
+        response.raise_for_status()
+        existing.update(response.json().get("existing", []))
+    return existing
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings.
+
+    Args:
+        capacity (int): Expected number of items.
+        error_rate (float, optional): Target false positive rate. Defaults to 0.001.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # double hashing: two 64-bit halves of one blake2b digest give all k positions
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class KnownURLIndex:
+    """In-process index of the URLs already in the database.
+
+    Preloaded once from the Mongo collection (streaming only the url field), then
+    answers membership for whole batches without any round trip. With use_bloom the
+    URLs are kept in a BloomFilter instead of a set, which needs a few bytes per URL;
+    Bloom hits are then confirmed against the collection in one batched query, so
+    false positives never cause a URL to be skipped.
+
+    Args:
+        collection: Mongo collection holding a "url" field (e.g. urls_international).
+        use_bloom (bool, optional): Store a Bloom filter instead of a set. Defaults to False.
+        error_rate (float, optional): Bloom filter false positive rate. Defaults to 0.001.
+    """
+
+    def __init__(self, collection, use_bloom: bool = False, error_rate: float = 0.001):
+        self.collection = collection
+        self.use_bloom = use_bloom
+        if use_bloom:
+            self._urls = BloomFilter(collection.estimated_document_count(), error_rate)
+        else:
+            self._urls = set()
+        self.size = 0
+        for document in collection.find({}, {"url": 1, "_id": 0}, batch_size=10000):
+            url = document.get("url")
+            if url:
+                self.add(url)
+        logger.info("Loaded %d known URLs from '%s'", self.size, collection.name)
+
+    def add(self, url: str):
+        self._urls.add(normalize_url(url))
+        self.size += 1
+
+    def __contains__(self, url: str) -> bool:
+        if normalize_url(url) not in self._urls:
+            return False
+        return not self.use_bloom or bool(find_urls_in_collection(self.collection, [url]))
+
+    def filter_existing(self, urls) -> set:
+        """Returns the subset of urls that are already in the database."""
+        candidates = [url for url in urls if normalize_url(url) in self._urls]
+        if not self.use_bloom or not candidates:
+            return set(candidates)
+        return find_urls_in_collection(self.collection, candidates)
+
+    __call__ = filter_existing
@@ -1,20 +1,100 @@
 import tenacity
 import requests
 import time
+import re
+import base64
+import hashlib
+import tempfile
+import logging
 from urllib.parse import quote
+from .retry_policy import RetryPolicy
+from .instrumentation import metrics
 
-retry = tenacity.retry(
-    stop=tenacity.stop_after_attempt(12), 
-    wait=tenacity.wait_exponential(multiplier=1, min=32, max=64)
-)
+logger = logging.getLogger(__name__)
+
+WAYBACK_BASE_URL = "https://web.archive.org/web/"
+
+# permanent 4xx errors fail fast, 429/5xx/connection errors back off with jitter (honoring Retry-After)
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=6, base_delay=2, max_delay=60)
+
+retry = tenacity.retry(**DEFAULT_RETRY_POLICY.tenacity_kwargs(source="download"))
+
+BYTES_PER_SECOND_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+def _detect_encoding(sample: bytes):
+    # requests ships with either charset_normalizer or chardet
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        return best.encoding if best is not None else None
+    except ImportError:
+        import chardet
+        return chardet.detect(sample).get("encoding")
+
+def _charset_from_content_type(content_type: str):
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.IGNORECASE)
+    return match.group(1) if match else None
+
+def cdx_digest(sha1) -> str:
+    """Formats a SHA-1 hash object the way CDX digests are written (base32)."""
+    return base64.b32encode(sha1.digest()).decode("ascii")
+
+def _iter_raw_body(response, chunk_size: int):
+    # CDX digests cover the entity as archived, so any Content-Encoding (gzip, deflate) is kept;
+    # requests and httpx responses stream raw bytes through differently named methods
+    if hasattr(response, "iter_raw"):
+        return response.iter_raw(chunk_size=chunk_size)
+    return response.raw.stream(chunk_size, decode_content=False)
+
+def _is_content_encoded(headers) -> bool:
+    return headers.get("Content-Encoding", "identity").strip().lower() not in ("", "identity")
+
+def _from_cache(cache, keys):
+    for key in keys:
+        cached = cache.get(key)
+        if cached is None:
+            continue
+        content, meta = cached
+        payload = content
+        if meta.get("is_text"):
+            payload = content.decode(meta.get("encoding") or "utf-8", errors="replace")
+        return {
+            "status_code": meta["status_code"],
+            "payload": payload,
+            "headers": meta["headers"]
+        }
+    return None
+
+def _record_download(status_code, length, seconds):
+    # download latency covers the whole body, so throughput is meaningful for streamed payloads too
+    metrics.counter("wmscraper_downloads_total", "Snapshot downloads by status code").inc(status=status_code)
+    metrics.histogram("wmscraper_download_seconds", "Snapshot download latency").observe(seconds)
+    if length:
+        metrics.counter("wmscraper_download_bytes_total", "Snapshot payload bytes downloaded").inc(length)
+        if seconds > 0:
+            metrics.histogram("wmscraper_download_bytes_per_second", "Snapshot download throughput", BYTES_PER_SECOND_BUCKETS).observe(length / seconds)
 
 @retry
-def download_archived_snapshot(original_url, timestamp, rewrite_modifier="id_", sleep=1, use_apparent_encoding=True):
+def download_archived_snapshot(original_url, timestamp, rewrite_modifier="id_", sleep=1, use_apparent_encoding=True, client=None, cache=None, digest=None, encoding_sample_size=None, base=WAYBACK_BASE_URL):
+    # payloads are cached by base+timestamp+modifier+URL and, when the CDX digest is known, by digest
+    cache_keys = []
+    if cache is not None:
+        cache_keys.append(cache.snapshot_key(original_url, timestamp, rewrite_modifier, base))
+        if digest:
+            cache_keys.append(cache.digest_key(digest, rewrite_modifier))
+        cached = _from_cache(cache, cache_keys)
+        if cached is not None:
+            logger.debug("Using cached snapshot for: %s%s/%s", timestamp, rewrite_modifier, original_url)
+            return cached
+
     original_url = quote(original_url, safe="")
-    snapshot_url = f"https://web.archive.org/web/{timestamp}{rewrite_modifier}/{original_url}"
-    print(f"Fetching archived snapshot for: {snapshot_url}")
-    response = requests.get(snapshot_url, allow_redirects=True)
-    print(f"Received response with status code: {response.status_code}")
+    snapshot_url = f"{base}{timestamp}{rewrite_modifier}/{original_url}"
+    logger.debug("Fetching archived snapshot for: %s", snapshot_url)
+    http = client if client is not None else requests
+    start = time.perf_counter()
+    response = http.get(snapshot_url, allow_redirects=True)
+    _record_download(response.status_code, len(response.content), time.perf_counter() - start)
+    logger.debug("Received response with status code: %s", response.status_code)
     time.sleep(sleep)
 
     if response.status_code in [404, 403]: 
@@ -26,10 +106,33 @@ def download_archived_snapshot(original_url, timestamp, rewrite_modifier="id_",
     response.raise_for_status()
     
     content_type = response.headers.get("Content-Type")
+    is_text = bool(content_type and content_type.startswith("text"))
 
-    if content_type and content_type.startswith("text"):
-        if use_apparent_encoding:
+    if is_text:
+        # detecting the charset on a sample is much faster than apparent_encoding on large pages
+        if use_apparent_encoding and encoding_sample_size:
+            response.encoding = _detect_encoding(response.content[:encoding_sample_size]) or response.encoding
+        # httpx responses (HTTP/2 clients) have no apparent_encoding
+        elif use_apparent_encoding and hasattr(response, "apparent_encoding"):
             response.encoding = response.apparent_encoding
+
+    if cache is not None:
+        meta = {
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "is_text": is_text,
+            "encoding": response.encoding if is_text else None,
+        }
+        cache.set(cache_keys[0], response.content, meta)
+        # the digest entry is shared with every capture of the same payload, so it only gets verified bodies
+        if digest:
+            actual = cdx_digest(hashlib.sha1(response.content))
+            if actual == digest:
+                cache.set(cache_keys[1], response.content, meta)
+            else:
+                logger.warning("Digest mismatch for %s: expected %s, got %s, not caching it by digest", snapshot_url, digest, actual)
+
+    if is_text:
         return {
             "status_code": response.status_code,
             "payload": response.text,
@@ -40,4 +143,118 @@ def download_archived_snapshot(original_url, timestamp, rewrite_modifier="id_",
             "status_code": response.status_code,
             "payload": response.content,
             "headers": dict(response.headers)
-        }
\ No newline at end of file
+        }
+
+@retry
+def stream_archived_snapshot(original_url, timestamp, dest=None, rewrite_modifier="id_", expected_digest=None, warc_writer=None, chunk_size=65536, detect_encoding=False, encoding_sample_size=65536, sleep=1, client=None, base=WAYBACK_BASE_URL):
+    """
+    Streams an archived snapshot to a file or a WARC file without holding the body in memory.
+
+    The body is read in chunk_size pieces while its SHA-1 is computed in CDX digest
+    format, so it can be checked against the digest from the CDX record. Like the
+    digest, the written body is the entity as archived: a gzip or deflate
+    Content-Encoding (see the returned headers) is not decoded. When
+    warc_writer is given the body is spooled to a temporary file (kept in memory only
+    up to chunk_size bytes) and then appended as a WARC response record, which also
+    adds a CDX line to the writer's index.
+
+    Args:
+        original_url (str): The original URL of the snapshot.
+        timestamp (str): The timestamp of the snapshot.
+        dest (str, optional): Path the body is written to. Required unless warc_writer is given.
+        rewrite_modifier (str, optional): Wayback rewrite modifier. Defaults to "id_".
+        expected_digest (str, optional): CDX digest the payload is verified against.
+        warc_writer (WARCWriter, optional): Writer the record is appended to.
+        chunk_size (int, optional): Read size in bytes. Defaults to 65536.
+        detect_encoding (bool, optional): Detect the charset of text bodies without one in
+            Content-Type, using only the first encoding_sample_size bytes. Content-encoded
+            bodies are not sampled. Defaults to False.
+        encoding_sample_size (int, optional): Bytes used for charset detection. Defaults to 65536.
+        sleep (float, optional): Seconds to wait after the request. Defaults to 1.
+        client (HTTPClient, optional): Pooled HTTP client.
+        base (str, optional): Wayback replay prefix. Defaults to WAYBACK_BASE_URL.
+
+    Returns:
+        dict: status_code, headers, path, length, digest, digest_matches (None when no
+            expected_digest was given) and encoding (text bodies only). For 404/403 responses
+            nothing is written and path, length and digest are None.
+    """
+    if dest is None and warc_writer is None:
+        raise ValueError("Either dest or warc_writer must be given")
+
+    quoted_url = quote(original_url, safe="")
+    snapshot_url = f"{base}{timestamp}{rewrite_modifier}/{quoted_url}"
+    logger.debug("Streaming archived snapshot for: %s", snapshot_url)
+    http = client if client is not None else requests
+    start = time.perf_counter()
+    response = http.get(snapshot_url, allow_redirects=True, stream=True)
+    try:
+        logger.debug("Received response with status code: %s", response.status_code)
+
+        if response.status_code in [404, 403]:
+            _record_download(response.status_code, 0, time.perf_counter() - start)
+            time.sleep(sleep)
+            return {
+                "status_code": response.status_code,
+                "headers": dict(response.headers),
+                "path": None,
+                "length": None,
+                "digest": None,
+                "digest_matches": None,
+                "encoding": None,
+            }
+        if response.status_code >= 400:
+            _record_download(response.status_code, 0, time.perf_counter() - start)
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type")
+        is_text = bool(content_type and content_type.startswith("text"))
+        encoding = _charset_from_content_type(content_type) if is_text else None
+        sample = bytearray() if is_text and detect_encoding and encoding is None and not _is_content_encoded(response.headers) else None
+
+        sha1 = hashlib.sha1()
+        length = 0
+        if warc_writer is not None:
+            out = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+        else:
+            out = open(dest, "wb")
+        try:
+            for chunk in _iter_raw_body(response, chunk_size):
+                if not chunk:
+                    continue
+                sha1.update(chunk)
+                length += len(chunk)
+                out.write(chunk)
+                if sample is not None and len(sample) < encoding_sample_size:
+                    sample.extend(chunk[:encoding_sample_size - len(sample)])
+
+            _record_download(response.status_code, length, time.perf_counter() - start)
+            time.sleep(sleep)
+            digest = cdx_digest(sha1)
+            if warc_writer is not None:
+                target_uri = original_url if "://" in original_url else "http://" + original_url
+                reason = getattr(response, "reason", None) or getattr(response, "reason_phrase", "")
+                warc_writer.write_response(target_uri, timestamp, response.status_code, reason, dict(response.headers), out, length, digest, chunk_size)
+        finally:
+            out.close()
+
+        if sample is not None:
+            encoding = _detect_encoding(bytes(sample))
+
+        digest_matches = None
+        if expected_digest:
+            digest_matches = digest == expected_digest
+            if not digest_matches:
+                logger.warning("Digest mismatch for %s: expected %s, got %s", snapshot_url, expected_digest, digest)
+
+        return {
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "path": warc_writer.path if warc_writer is not None else dest,
+            "length": length,
+            "digest": digest,
+            "digest_matches": digest_matches,
+            "encoding": encoding,
+        }
+    finally:
+        response.close()
@@ -1,14 +1,32 @@
 # General URL importer
 # This script defines functions to import URLs into the MongoDB database
 
-from pymongo import MongoClient
-from urllib.parse import urlparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+from .url_normalize_utils import normalize_url
+from .cdx_record import CDXRecord, CDXRecordBatch
+from .instrumentation import metrics
+from .wm_cdx_utils import get_cdx_records
+from .url_preimport_utils import make_cdx_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+MONGO_SECONDS = "wmscraper_mongo_seconds"
+MONGO_SECONDS_HELP = "MongoDB operation latency by operation"
+
+REQUIRED_SNAPSHOT_KEYS = frozenset(['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length'])
+# keys that identify a capture; "-" is a legitimate CDX value for statuscode and length, but not for these
+SNAPSHOT_IDENTITY_KEYS = frozenset(['timestamp', 'digest'])
 
 class URLImporter:
     """Context manager for URL importing with reusable MongoDB connection."""
     
-    def __init__(self, mongo_uri, database_name="xm", collection_name="urls_international", snapshot_collection_name="url_snapshots"):
+    def __init__(self, mongo_uri, database_name="xm", collection_name="urls_international", snapshot_collection_name="url_snapshots", create_indexes=True):
         self.mongo_uri = mongo_uri
+        self.create_indexes = create_indexes
         self.database_name = database_name
         self.collection_name = collection_name
         self.snapshot_collection_name = snapshot_collection_name
@@ -20,23 +38,30 @@ class URLImporter:
         self.client = MongoClient(self.mongo_uri)
         self.collection = self.client[self.database_name][self.collection_name]
         self.snapshot_collection = self.client[self.database_name][self.snapshot_collection_name]
-        print("Connected to MongoDB")
-        # print the number of documents in the collection
-        print(f"Number of documents in collection '{self.collection_name}': {self.collection.count_documents({})}")
-        print(f"Number of documents in collection '{self.snapshot_collection_name}': {self.snapshot_collection.count_documents({})}")
+        logger.info("Connected to MongoDB")
+        if self.create_indexes:
+            self.ensure_indexes()
+        # log the number of documents in the collection
+        logger.info("Number of documents in collection '%s': %d", self.collection_name, self.collection.count_documents({}))
+        logger.info("Number of documents in collection '%s': %d", self.snapshot_collection_name, self.snapshot_collection.count_documents({}))
         return self
     
+    def ensure_indexes(self):
+        """Create the indexes the importer's queries rely on. Safe to call repeatedly."""
+        for collection in (self.collection, self.snapshot_collection):
+            try:
+                collection.create_index("url", unique=True)
+            except OperationFailure as e:
+                # existing duplicate URLs (or an existing non-unique url index) prevent a unique index
+                logger.warning("Could not create unique url index on '%s', falling back to a non-unique index: %s", collection.name, e)
+                collection.create_index("url")
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.client:
             self.client.close()
     
-    def add_url(self, url, lot_id, site_title, site_desc="", lot_path="", lot_path_code="", page_number=""):
-        """Add a URL to the database."""
-        netloc = urlparse(url).netloc
-        url = url.replace(netloc, netloc.lower())
-
-        print("Adding URL: " + url)
-
+    @staticmethod
+    def _build_lot_info(lot_id, site_title, site_desc="", lot_path="", lot_path_code="", page_number=""):
         lot_info = {
             "lot_id": lot_id,
             "site_title": site_title,
@@ -52,6 +77,21 @@ class URLImporter:
         if page_number != "":
             lot_info["page_number"] = page_number
 
+        return lot_info
+
+    @staticmethod
+    def _lot_recorded_filter(lot_id, lot_path, lot_path_code):
+        # same semantics as the in_lots.* queries in add_url: each condition may match a different array element
+        return {"in_lots.lot_id": lot_id, "$or": [{"in_lots.lot_path": lot_path}, {"in_lots.lot_path_code": lot_path_code}]}
+
+    def add_url(self, url, lot_id, site_title, site_desc="", lot_path="", lot_path_code="", page_number=""):
+        """Add a URL to the database."""
+        url = normalize_url(url)
+
+        logger.debug("Adding URL: %s", url)
+
+        lot_info = self._build_lot_info(lot_id, site_title, site_desc, lot_path, lot_path_code, page_number)
+
         # query if url already in database
         query = self.collection.find_one({"url": url})
 
@@ -60,29 +100,169 @@ class URLImporter:
                 "url": url,
                 "in_lots": [lot_info],
             })
-            print("Added URL: " + url)
+            logger.debug("Added URL: %s", url)
         else:
             lot_path_query = self.collection.find_one({"url": url, "in_lots.lot_id": lot_id, "in_lots.lot_path": lot_path})
             lot_path_code_query = self.collection.find_one({"url": url, "in_lots.lot_id": lot_id, "in_lots.lot_path_code": lot_path_code})
             if lot_path_query is not None or lot_path_code_query is not None:
-                print("URL already in database: " + url)
+                logger.debug("URL already in database: %s", url)
             else: 
                 self.collection.update_one({"url": url}, {"$push": {"in_lots": lot_info}})
-                print("Updated URL: " + url)
+                logger.debug("Updated URL: %s", url)
 
-    def add_url_snapshots(self, url, snapshots, force_update = False):
-        """Add snapshots to an existing URL in the database."""
-        
-        print("Adding snapshots to URL: " + url)
+    def add_urls_bulk(self, entries, batch_size=1000):
+        """
+        Add many URLs to the database with batched bulk writes.
+
+        Applies the same dedupe rules as add_url on (url, lot_id, lot_path/lot_path_code),
+        but costs two unordered bulk_writes and one find per batch instead of several round trips per
+        URL. New URLs are upserted with $setOnInsert so concurrent importers cannot create
+        duplicates, and lots are appended with a $push whose filter excludes documents
+        that already record the lot, so the check and the write happen atomically.
 
-        # verify if each element in snapshots is a dictionary with keys 'urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length'
+        Args:
+            entries (iterable): Dicts with the keyword arguments of add_url
+                (url, lot_id, site_title and optionally site_desc, lot_path, lot_path_code, page_number).
+            batch_size (int, optional): Number of entries per bulk write. Defaults to 1000.
+
+        Returns:
+            dict: Counts of "inserted", "updated" and "skipped" entries.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                self._add_urls_batch(batch, counts)
+                batch = []
+        if batch:
+            self._add_urls_batch(batch, counts)
+
+        logger.info("Bulk import finished: %d inserted, %d updated, %d skipped", counts["inserted"], counts["updated"], counts["skipped"])
+        return counts
+
+    def _add_urls_batch(self, batch, counts):
+        # every write checks and changes a single document atomically, so concurrent importers can't lose lots:
+        # new URLs are upserted together with their first lot, then the other lots are pushed unless already recorded
+        entries = []
+        first_lots = {}
+        for entry in batch:
+            url = normalize_url(entry["url"])
+            lot_info = self._build_lot_info(
+                entry["lot_id"],
+                entry["site_title"],
+                entry.get("site_desc", ""),
+                entry.get("lot_path", ""),
+                entry.get("lot_path_code", ""),
+                entry.get("page_number", ""),
+            )
+            entries.append((url, lot_info, entry))
+            first_lots.setdefault(url, len(entries) - 1)
+
+        inserts = [
+            UpdateOne({"url": url}, {"$setOnInsert": {"url": url, "in_lots": [entries[index][1]]}}, upsert=True)
+            for url, index in first_lots.items()
+        ]
+        with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="bulk_write"):
+            result = self.collection.bulk_write(inserts, ordered=False)
+        inserted_urls = set()
+        if result.upserted_count:
+            upserted = self.collection.find({"_id": {"$in": list(result.upserted_ids.values())}}, {"url": 1})
+            inserted_urls = {document["url"] for document in upserted}
+
+        # an inserted URL already holds its first lot; pushing it again would record it twice when the
+        # lot has neither lot_path nor lot_path_code, because the filter below can't match missing fields
+        pushes = [
+            UpdateOne(
+                {"url": url, "$nor": [self._lot_recorded_filter(lot_info["lot_id"], entry.get("lot_path", ""), entry.get("lot_path_code", ""))]},
+                {"$push": {"in_lots": lot_info}},
+            )
+            for index, (url, lot_info, entry) in enumerate(entries)
+            if not (url in inserted_urls and first_lots[url] == index)
+        ]
+        pushed = 0
+        if pushes:
+            with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="bulk_write"):
+                pushed = self.collection.bulk_write(pushes, ordered=False).modified_count
+
+        counts["inserted"] += len(inserted_urls)
+        counts["updated"] += pushed
+        counts["skipped"] += len(batch) - len(inserted_urls) - pushed
+
+    @staticmethod
+    def _prepare_snapshots(snapshots):
+        # compact records are stored in the same dict format as get_cdx_records returns
+        if isinstance(snapshots, CDXRecordBatch):
+            snapshots = snapshots.to_dicts()
+        else:
+            snapshots = [snapshot.to_dict() if isinstance(snapshot, CDXRecord) else snapshot for snapshot in snapshots]
+
+        # verify if each element in snapshots is a dictionary with keys 'urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length'.
+        # records parsed from a query with a field subset (fl=) have "" for the fields it didn't return
         for snapshot in snapshots:
             if not isinstance(snapshot, dict):
                 raise ValueError("Each snapshot must be a dictionary")
-            required_keys = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length']
-            for key in required_keys:
-                if key not in snapshot:
-                    raise ValueError(f"Snapshot is missing required key: {key}")
+            missing = sorted(
+                key for key in REQUIRED_SNAPSHOT_KEYS
+                if snapshot.get(key) in (None, "") or (key in SNAPSHOT_IDENTITY_KEYS and snapshot[key] == "-")
+            )
+            if missing:
+                raise ValueError(f"Snapshot is missing required key: {missing[0]}")
+        return snapshots
+
+    def add_url_snapshots_bulk(self, url_snapshots, force_update=False, batch_size=500):
+        """
+        Add snapshots for many URLs with unordered bulk upserts.
+
+        Behaves like add_url_snapshots for every (url, snapshots) pair: missing URLs are
+        inserted, existing ones are left alone unless force_update is set, in which case
+        their wayback_cdx array is replaced. No per-URL find_one is needed.
+
+        Args:
+            url_snapshots (iterable): (url, snapshots) pairs; snapshots as accepted by add_url_snapshots.
+            force_update (bool, optional): Replace existing wayback_cdx arrays. Defaults to False.
+            batch_size (int, optional): Number of URLs per bulk write. Defaults to 500.
+
+        Returns:
+            dict: Counts of "inserted", "updated" and "skipped" URLs.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        operator = "$set" if force_update else "$setOnInsert"
+        operations = []
+
+        def flush():
+            with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="bulk_write"):
+                result = self.snapshot_collection.bulk_write(operations, ordered=False)
+            counts["inserted"] += result.upserted_count
+            if force_update:
+                counts["updated"] += result.matched_count
+            else:
+                counts["skipped"] += result.matched_count
+
+        for url, snapshots in url_snapshots:
+            snapshots = self._prepare_snapshots(snapshots)
+            operations.append(UpdateOne({"url": url}, {operator: {"wayback_cdx": snapshots}}, upsert=True))
+            if len(operations) >= batch_size:
+                flush()
+                operations = []
+        if operations:
+            flush()
+
+        logger.info("Bulk snapshot import finished: %d inserted, %d updated, %d skipped", counts["inserted"], counts["updated"], counts["skipped"])
+        return counts
+
+    def add_url_snapshots(self, url, snapshots, force_update = False):
+        """Add snapshots to an existing URL in the database."""
+        
+        logger.debug("Adding snapshots to URL: %s", url)
+
+        snapshots = self._prepare_snapshots(snapshots)
 
         query = self.snapshot_collection.find_one({"url": url})
         if query is None:
@@ -90,50 +270,257 @@ class URLImporter:
                 "url": url,
                 "wayback_cdx": snapshots,
             })
-            print("Added snapshots to URL: " + url)
+            logger.debug("Added snapshots to URL: %s", url)
         elif force_update:
             self.snapshot_collection.update_one({"url": url}, {"$set": {"wayback_cdx": snapshots}})
-            print("Force updated snapshots for URL: " + url)
+            logger.debug("Force updated snapshots for URL: %s", url)
         else:
-            print("Snapshots already exist for URL: " + url)
+            logger.debug("Snapshots already exist for URL: %s", url)
 
-    def get_unique_url_snapshots(self, url: str, from_date: int = 19960101000000, to_date: int = 20051231000000, status_code_filter: list = [200]) -> dict:
+    def get_latest_snapshot_timestamps(self, urls=None, batch_size: int = 1000):
+        """
+        Yields batches of (url, latest_timestamp) pairs from the snapshot collection.
+
+        latest_timestamp is the newest stored capture of the URL, or None when its
+        wayback_cdx array is empty. The maximum is computed on the server, so only
+        one short document per URL comes back. Without urls the whole collection is
+        walked in url order, one indexed range query per batch, so no cursor stays
+        open while the caller works on a batch. URLs given explicitly that have no
+        snapshot document are left out.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        def latest(match, limit=None):
+            pipeline = [{"$match": match}]
+            if limit is not None:
+                pipeline += [{"$sort": {"url": 1}}, {"$limit": limit}]
+            pipeline.append({"$project": {"_id": 0, "url": 1, "latest": {"$max": "$wayback_cdx.timestamp"}}})
+            with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="aggregate"):
+                documents = list(self.snapshot_collection.aggregate(pipeline, allowDiskUse=True))
+            return [(document["url"], str(document["latest"]) if document.get("latest") is not None else None) for document in documents]
+
+        if urls is not None:
+            urls = list(dict.fromkeys(urls))
+            for start in range(0, len(urls), batch_size):
+                batch = latest({"url": {"$in": urls[start:start + batch_size]}})
+                if batch:
+                    yield batch
+            return
+
+        last_url = None
+        while True:
+            batch = latest({"url": {"$gt": last_url}} if last_url is not None else {}, batch_size)
+            if not batch:
+                return
+            yield batch
+            last_url = batch[-1][0]
+
+    @staticmethod
+    def _refresh_from_date(latest: str) -> str:
+        # one second after the newest stored capture; CDX "from" is inclusive
+        moment = datetime.strptime(latest[:14].ljust(14, "0"), "%Y%m%d%H%M%S")
+        return (moment + timedelta(seconds=1)).strftime("%Y%m%d%H%M%S")
+
+    def refresh_url_snapshots(self, urls=None, cdx_params: dict = None, batch_size: int = 500, workers: int = 1):
+        """
+        Appends only the captures that are newer than what is stored, for many URLs.
+
+        For every URL the newest stored timestamp is read (see
+        get_latest_snapshot_timestamps) and get_cdx_records is queried with from_date
+        one second after it. Captures not newer than the stored maximum, and
+        duplicates within the response, are dropped. The rest are appended with
+        $push/$each in one unordered bulk_write per batch. A periodic re-sync
+        therefore transfers and writes only new captures. It does not re-download
+        each URL's whole history as force_update does.
+
+        Each append only applies if no newer capture was stored in the meantime, so
+        two refreshes running at once don't append the same captures twice. URLs
+        given explicitly without a snapshot document get their full history inserted.
+
+        Args:
+            urls (iterable, optional): URLs to refresh. Defaults to every URL in the snapshot collection.
+            cdx_params (dict, optional): Keyword arguments passed to get_cdx_records, e.g. to_date,
+                filter, sleep, rate_limiter, client. A from_date is only used for URLs without
+                stored captures.
+            batch_size (int, optional): URLs per timestamp query and bulk write. Defaults to 500.
+            workers (int, optional): Concurrent CDX requests. With more than one worker and no
+                rate_limiter in cdx_params, a shared one at DEFAULT_CDX_REQUESTS_PER_SECOND is used.
+
+        Returns:
+            dict: Counts of "urls" checked, "updated" URLs, new "captures", "unchanged" URLs,
+                "excluded" URLs (403 from the CDX server) and "conflicts" (appends skipped
+                because another writer got there first).
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        cdx_params = dict(cdx_params or {})
+        base_from_date = cdx_params.pop("from_date", None)
+        # the captures are needed as records, not as a JSON string
+        cdx_params.pop("return_json_string", None)
+        if workers > 1 and cdx_params.get("rate_limiter") is None:
+            cdx_params["rate_limiter"] = make_cdx_rate_limiter(workers)
+
+        def fetch(item):
+            url, latest = item
+            from_date = self._refresh_from_date(latest) if latest else base_from_date
+            return get_cdx_records(url, from_date=from_date, **cdx_params)
+
+        def batches():
+            if urls is None:
+                yield from self.get_latest_snapshot_timestamps(batch_size=batch_size)
+                return
+            url_list = list(dict.fromkeys(urls))
+            for start in range(0, len(url_list), batch_size):
+                chunk = url_list[start:start + batch_size]
+                stored = {}
+                for found in self.get_latest_snapshot_timestamps(chunk, batch_size):
+                    stored.update(found)
+                # URLs without a snapshot document are fetched from base_from_date and upserted
+                yield [(url, stored.get(url, False)) for url in chunk]
+
+        counts = {"urls": 0, "updated": 0, "captures": 0, "unchanged": 0, "excluded": 0, "conflicts": 0}
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            for batch in batches():
+                items = [(url, latest or None) for url, latest in batch]
+                results = executor.map(fetch, items) if executor is not None else map(fetch, items)
+                operations = []
+                for (url, latest), records in zip(batch, results):
+                    counts["urls"] += 1
+                    if isinstance(records, str):
+                        # get_cdx_records returns an error marker for URLs excluded from the Wayback Machine
+                        counts["excluded"] += 1
+                        continue
+                    new_snapshots = self._new_snapshots(records, latest or None)
+                    if not new_snapshots:
+                        counts["unchanged"] += 1
+                        continue
+                    if latest is False:
+                        update_filter = {"url": url}
+                    elif latest is None:
+                        update_filter = {"url": url, "wayback_cdx.0": {"$exists": False}}
+                    else:
+                        update_filter = {"url": url, "wayback_cdx": {"$not": {"$elemMatch": {"timestamp": {"$gt": latest}}}}}
+                    operations.append(UpdateOne(update_filter, {"$push": {"wayback_cdx": {"$each": new_snapshots}}}, upsert=latest is False))
+                    counts["captures"] += len(new_snapshots)
+                if not operations:
+                    continue
+                with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="bulk_write"):
+                    result = self.snapshot_collection.bulk_write(operations, ordered=False)
+                applied = result.matched_count + result.upserted_count
+                counts["updated"] += applied
+                counts["conflicts"] += len(operations) - applied
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        logger.info("Snapshot refresh finished: %d URLs checked, %d updated with %d new captures, %d unchanged, %d excluded, %d conflicts", counts["urls"], counts["updated"], counts["captures"], counts["unchanged"], counts["excluded"], counts["conflicts"])
+        return counts
+
+    def _new_snapshots(self, records, latest):
+        # captures newer than the stored maximum, without duplicates, oldest first
+        snapshots = self._prepare_snapshots(records)
+        seen = set()
+        new_snapshots = []
+        for snapshot in snapshots:
+            timestamp = str(snapshot["timestamp"])
+            key = (timestamp, snapshot["original"], snapshot["digest"])
+            if (latest is not None and timestamp <= latest) or key in seen:
+                continue
+            seen.add(key)
+            new_snapshots.append(snapshot)
+        new_snapshots.sort(key=lambda snapshot: str(snapshot["timestamp"]))
+        return new_snapshots
+
+    @staticmethod
+    def _validate_snapshot_filters(from_date, to_date, status_code_filter):
         if len(str(from_date)) != 14 or len(str(to_date)) != 14:
             raise ValueError("from_date and to_date must be in YYYYMMDDhhmmss format")
         
         # ensure status_code_filter is a list of integers
         if not all(isinstance(code, int) for code in status_code_filter):
             raise ValueError("status_code_filter must be a list of integers")
-        
-        # make status_code_filter a list of strings for comparison
-        status_code_filter = [str(code) for code in status_code_filter]
-
-        # get all snapshots for the url from the database
-        snapshots = self.snapshot_collection.find_one({"url": url})
-        # get urlkey from the first snapshot
-        if snapshots is not None:
-            urlkey = snapshots.get("wayback_cdx", [])[0].get("urlkey", "") if snapshots else ""
-            if not urlkey:
-                raise ValueError("No urlkey found for URL: " + url)
-            # Filter snapshots by date range
-            filtered_snapshots = [
-                snapshot for snapshot in snapshots.get("wayback_cdx", [])
-                if from_date <= snapshot.get("timestamp", "") <= to_date and str(snapshot.get("statuscode", 0)) in status_code_filter
-            ]
-            
-            # build a dictionary of digest keys to snapshots
-            # format: digest_key: [snapshot_timestamp1, snapshot_timestamp2, ...]
-            digest_to_snapshot = {}
-            for snapshot in filtered_snapshots:
-                digest_key = snapshot.get("digest", "")
-                if digest_key:
-                    if digest_key not in digest_to_snapshot:
-                        digest_to_snapshot[digest_key] = []
-                    digest_to_snapshot[digest_key].append(snapshot["timestamp"])
-            return {
-                "url": url,
-                "urlkey": urlkey,
-                "digest_to_snapshot": digest_to_snapshot
-            }
-        else:
-            raise ValueError("No snapshots found for URL: " + url)
\ No newline at end of file
+
+    @staticmethod
+    def _unique_snapshots_pipeline(match, from_date, to_date, status_code_filter):
+        # filtering and digest grouping run on the server, only digest -> timestamps comes back.
+        # timestamps and status codes are stored as strings, and 14-digit timestamps compare correctly as strings
+        return [
+            {"$match": match},
+            {"$project": {
+                "url": 1,
+                "urlkey": {"$arrayElemAt": ["$wayback_cdx.urlkey", 0]},
+                "wayback_cdx": {"$filter": {
+                    "input": "$wayback_cdx",
+                    "as": "snapshot",
+                    "cond": {"$and": [
+                        {"$gte": ["$$snapshot.timestamp", str(from_date)]},
+                        {"$lte": ["$$snapshot.timestamp", str(to_date)]},
+                        {"$in": [{"$toString": "$$snapshot.statuscode"}, [str(code) for code in status_code_filter]]},
+                        {"$gt": ["$$snapshot.digest", ""]},
+                    ]},
+                }},
+            }},
+            {"$project": {"url": 1, "urlkey": 1, "wayback_cdx.digest": 1, "wayback_cdx.timestamp": 1}},
+            # keep URLs without matching snapshots so they still come back with an empty map
+            {"$unwind": {"path": "$wayback_cdx", "preserveNullAndEmptyArrays": True}},
+            {"$group": {
+                "_id": {"url": "$url", "digest": "$wayback_cdx.digest"},
+                "urlkey": {"$first": "$urlkey"},
+                "timestamps": {"$push": "$wayback_cdx.timestamp"},
+            }},
+            {"$group": {
+                "_id": "$_id.url",
+                "urlkey": {"$first": "$urlkey"},
+                "digests": {"$push": {"digest": "$_id.digest", "timestamps": "$timestamps"}},
+            }},
+        ]
+
+    @staticmethod
+    def _unique_snapshots_result(document):
+        url = document["_id"]
+        if not document.get("urlkey"):
+            raise ValueError("No urlkey found for URL: " + url)
+        digest_to_snapshot = {
+            entry["digest"]: sorted(entry["timestamps"])
+            for entry in document["digests"]
+            if entry.get("digest")
+        }
+        return {
+            "url": url,
+            "urlkey": document["urlkey"],
+            "digest_to_snapshot": digest_to_snapshot
+        }
+
+    def get_unique_url_snapshots(self, url: str, from_date: int = 19960101000000, to_date: int = 20051231000000, status_code_filter: list = [200]) -> dict:
+        self._validate_snapshot_filters(from_date, to_date, status_code_filter)
+
+        # format of digest_to_snapshot: digest_key: [snapshot_timestamp1, snapshot_timestamp2, ...]
+        pipeline = self._unique_snapshots_pipeline({"url": url}, from_date, to_date, status_code_filter)
+        for document in self.snapshot_collection.aggregate(pipeline, allowDiskUse=True):
+            return self._unique_snapshots_result(document)
+        raise ValueError("No snapshots found for URL: " + url)
+
+    def get_unique_url_snapshots_batch(self, urls, from_date: int = 19960101000000, to_date: int = 20051231000000, status_code_filter: list = [200], batch_size: int = 1000) -> dict:
+        """
+        Batch variant of get_unique_url_snapshots.
+
+        Runs one aggregation per batch_size URLs and returns {url: result} where each
+        result has the same format as get_unique_url_snapshots. URLs without a
+        snapshot document are left out of the returned dict.
+        """
+        self._validate_snapshot_filters(from_date, to_date, status_code_filter)
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        urls = list(dict.fromkeys(urls))
+        results = {}
+        for start in range(0, len(urls), batch_size):
+            chunk = urls[start:start + batch_size]
+            pipeline = self._unique_snapshots_pipeline({"url": {"$in": chunk}}, from_date, to_date, status_code_filter)
+            with metrics.timer(MONGO_SECONDS, MONGO_SECONDS_HELP, op="aggregate"):
+                documents = list(self.snapshot_collection.aggregate(pipeline, allowDiskUse=True))
+            for document in documents:
+                results[document["_id"]] = self._unique_snapshots_result(document)
+        return results
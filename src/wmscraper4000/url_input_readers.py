@@ -0,0 +1,146 @@
+import json
+
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+JSON_WHITESPACE = " \t\r\n"
+JSON_NUMBER_CHARS = "0123456789+-.eE"
+
+# largest array element (in characters) the incremental reader buffers before giving up;
+# without a cap one malformed element would make it read the rest of the file into memory
+MAX_JSON_ELEMENT_SIZE = 1 << 24
+
+
+def _iter_json_array(file, chunk_size: int, max_element_size: int = MAX_JSON_ELEMENT_SIZE):
+    # incrementally decodes the elements of a top-level JSON array, holding at most one element plus a chunk in memory.
+    # Malformed input raises ValueError (json.JSONDecodeError) just like json.load would.
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def peek() -> str:
+        # skips whitespace and returns the next character without consuming it, "" at the end of the file
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            fill()
+
+    def error(message: str):
+        return json.JSONDecodeError(message, buffer, pos)
+
+    def refill(reason: json.JSONDecodeError = None):
+        # reads more of an element that isn't complete yet, unless it has outgrown max_element_size
+        if len(buffer) - pos > max_element_size:
+            detail = f": {reason.msg}" if reason is not None else ""
+            raise error(f"Malformed entry or entry longer than {max_element_size} characters{detail}")
+        fill()
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise
+                refill(e)
+                continue
+            # a number followed by nothing but number characters may continue in the next chunk
+            if not eof and type(value) in (int, float) and not buffer[end:].lstrip(JSON_NUMBER_CHARS):
+                refill()
+                continue
+            pos = end
+            return value
+
+    if peek() != "[":
+        raise error("The JSON file must contain an array of entries")
+    pos += 1
+    if peek() == "]":
+        pos += 1
+    else:
+        while True:
+            if peek() == "":
+                raise error("Unexpected end of JSON array")
+            yield decode()
+            separator = peek()
+            pos += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                pos -= 1
+                raise error("Expecting ',' delimiter")
+    if peek() != "":
+        raise error("Extra data")
+
+
+def iter_json_entries(file_path: str, chunk_size: int = 1 << 20, max_element_size: int = MAX_JSON_ELEMENT_SIZE):
+    """
+    Yields the entries of a JSON URL list one at a time.
+
+    Accepts a JSON array of objects (parsed incrementally, never loaded whole) or
+    JSON Lines with one object per line (.jsonl/.ndjson, or any file that doesn't
+    start with "["). Array elements that can't be decoded within max_element_size
+    characters raise json.JSONDecodeError.
+    """
+    with open(file_path, "r") as file:
+        first = ""
+        while True:
+            char = file.read(1)
+            if not char or not char.isspace():
+                first = char
+                break
+        file.seek(0)
+        if first == "[" and not file_path.endswith(JSON_LINES_EXTENSIONS):
+            yield from _iter_json_array(file, chunk_size, max_element_size)
+            return
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_json_batches(file_path: str, batch_size: int = 10000):
+    """Yields lists of at most batch_size entries from a JSON or JSON Lines URL list."""
+    batch = []
+    for entry in iter_json_entries(file_path):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv_batches(file_path: str, batch_size: int = 10000):
+    """Yields DataFrames of at most batch_size rows from a CSV URL list."""
+    import pandas as pd
+
+    with pd.read_csv(file_path, chunksize=batch_size) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def csv_chunk_rows(df):
+    """
+    Yields (url, title, description, category, page_number) tuples for the rows of a CSV chunk.
+
+    Missing category/page_number columns default to None/0 and empty cells become None.
+    """
+    if "category" not in df.columns:
+        df = df.assign(category=None)
+    if "page_number" not in df.columns:
+        df = df.assign(page_number=0)
+    columns = df[["url", "title", "description", "category", "page_number"]].astype(object)
+    return columns.where(columns.notna(), None).itertuples(index=False, name=None)
@@ -0,0 +1,183 @@
+import ipaddress
+import re
+import unicodedata
+from functools import lru_cache
+from .list_of_valid_tlds import list_of_valid_tlds
+
+# scheme (optional) followed by "//" and the netloc, the same split urlparse makes
+_NETLOC_RE = re.compile(r"^(?:[A-Za-z][A-Za-z0-9+.\-]*:)?//([^/?#]*)")
+_INVALID_CHARS_RE = re.compile(r"[<>{}|\\^\[\]` ]")
+_VALID_TLDS = frozenset(list_of_valid_tlds)
+
+# like urlsplit, leading C0 control characters and spaces are stripped and tabs/newlines removed before splitting
+_C0_CONTROL_OR_SPACE = "".join(chr(code) for code in range(0x21))
+_REMOVE_TABS_AND_NEWLINES = str.maketrans("", "", "\t\r\n")
+_IPV_FUTURE_RE = re.compile(r"\Av[a-fA-F0-9]+\..+\Z")
+
+
+def _clean(url: str) -> str:
+    return url.lstrip(_C0_CONTROL_OR_SPACE).translate(_REMOVE_TABS_AND_NEWLINES)
+
+
+def _needs_cleaning(url: str) -> bool:
+    # isprintable is False for every control character (and a few non-ASCII ones, which only cost a no-op _clean)
+    return not (url[:1] > " " and url.isprintable())
+
+
+def _plain_netloc(netloc: str) -> bool:
+    # ASCII without brackets, the netlocs urlsplit never rejects
+    return netloc.isascii() and "[" not in netloc and "]" not in netloc
+
+
+def _bracketed_host_error(netloc: str) -> bool:
+    if ("[" in netloc) != ("]" in netloc):
+        return True
+    host = netloc.partition("[")[2].partition("]")[0]
+    if host.startswith("v"):
+        return not _IPV_FUTURE_RE.match(host)
+    try:
+        return ipaddress.ip_address(host).version == 4
+    except ValueError:
+        return True
+
+
+def _netloc_error(netloc: str) -> bool:
+    # the netlocs urlsplit raises ValueError for: unbalanced brackets or brackets around something
+    # other than an IPv6/IPvFuture address, and non-ASCII characters that NFKC-normalize to separators
+    if ("[" in netloc or "]" in netloc) and _bracketed_host_error(netloc):
+        return True
+    if netloc.isascii():
+        return False
+    stripped = netloc.replace("@", "").replace(":", "").replace("#", "").replace("?", "")
+    normalized = unicodedata.normalize("NFKC", stripped)
+    return normalized != stripped and any(char in normalized for char in "/?#@:")
+
+
+def _netloc(url: str):
+    # the netloc urlsplit finds, or None for URLs without one and those urlsplit rejects
+    if _needs_cleaning(url):
+        url = _clean(url)
+    match = _NETLOC_RE.match(url)
+    if not match:
+        return None
+    netloc = match.group(1)
+    if _plain_netloc(netloc) or not _netloc_error(netloc):
+        return netloc
+    return None
+
+
+def _hostname(netloc: str) -> str:
+    host = netloc.rpartition("@")[2]
+    if "[" in host:
+        return host.partition("[")[2].partition("]")[0].lower()
+    return host.split(":", 1)[0].lower()
+
+
+@lru_cache(maxsize=1 << 20)
+def hostname_verdict(hostname: str) -> str:
+    """
+    Classifies a lowercased hostname, cached because hosts repeat heavily within a lot.
+
+    Returns:
+        str: "ip" for numeric hosts (valid regardless of the other URL checks),
+            "valid" for hosts with a known TLD, or "invalid".
+    """
+    if not hostname:
+        return "invalid"
+
+    # If the hostname is an IP address, skip TLD check
+    parts = hostname.split(".")
+    try:
+        if all(0 <= int(part) < 256 for part in parts):
+            return "ip"
+    except ValueError:
+        pass
+
+    # Need at least domain.tld, and a TLD that was valid at the time
+    if len(parts) < 2 or parts[-1] not in _VALID_TLDS:
+        return "invalid"
+    return "valid"
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form used for storage: the netloc is lowercased, the rest is left as is."""
+    match = _NETLOC_RE.match(url)
+    if not match:
+        if _needs_cleaning(url):
+            # the netloc only appears once control characters are dropped, lowercase it where it occurs
+            netloc = _netloc(url)
+            if netloc:
+                return url.replace(netloc, netloc.lower())
+        return url
+    start, end = match.span(1)
+    return url[:start] + url[start:end].lower() + url[end:]
+
+
+def validate_url(url: str) -> bool:
+    netloc = _netloc(url)
+    if netloc is None:
+        return False
+    verdict = hostname_verdict(_hostname(netloc))
+    if verdict == "ip":
+        return True
+    if verdict == "invalid":
+        return False
+    # no second "//" and none of <, >, {, }, |, \, ^, [, ], ` or spaces
+    return url.count("//") <= 1 and not _INVALID_CHARS_RE.search(url)
+
+
+def validate_and_normalize(urls) -> tuple:
+    """
+    Validates and normalizes a batch of URLs in one pass.
+
+    Returns:
+        tuple: (mask, canonical) lists aligned with urls; canonical holds the
+            normalized URL for valid entries and None for invalid ones.
+    """
+    mask = []
+    canonical = []
+    for url in urls:
+        valid = isinstance(url, str) and validate_url(url)
+        mask.append(valid)
+        canonical.append(normalize_url(url) if valid else None)
+    return mask, canonical
+
+
+def validate_and_normalize_series(series) -> tuple:
+    """
+    Vectorized validate_and_normalize for a pandas Series of URLs.
+
+    Hostname verdicts are computed once per distinct hostname.
+
+    Returns:
+        tuple: (mask, canonical) Series with the index of series; canonical is NaN for invalid entries.
+    """
+    import pandas as pd
+
+    urls = series.astype("string")
+    netlocs = urls.str.extract(_NETLOC_RE, expand=False)
+    # the rare URLs that need urlsplit's cleanup, or whose netloc has brackets or non-ASCII characters, go one by one;
+    # this includes every URL with a NUL, which pandas' hash tables would confuse with the string before it
+    special = pd.Series([
+        isinstance(url, str) and (_needs_cleaning(url) or (isinstance(netloc, str) and not _plain_netloc(netloc)))
+        for url, netloc in zip(urls.tolist(), netlocs.tolist())
+    ], index=urls.index, dtype=bool)
+    netlocs = netlocs.where(~special)
+    hosts = netlocs.str.rpartition("@")[2].str.split(":", n=1).str[0].str.lower()
+    verdicts = hosts.map({host: hostname_verdict(host) for host in hosts.dropna().unique()})
+
+    other_checks = (urls.str.count("//") <= 1) & ~urls.str.contains(_INVALID_CHARS_RE.pattern, regex=True)
+    mask = ((verdicts == "ip") | ((verdicts == "valid") & other_checks)).fillna(False).astype(bool)
+
+    # lowercase only the netloc span: everything up to the netloc, the netloc, then the rest
+    spans = urls.str.extract(r"^(?P<head>(?:[A-Za-z][A-Za-z0-9+.\-]*:)?//)(?P<netloc>[^/?#]*)(?P<rest>.*)$", flags=re.DOTALL)
+    canonical = (spans["head"] + spans["netloc"].str.lower() + spans["rest"]).where(mask)
+
+    if special.any():
+        special_mask, special_canonical = validate_and_normalize(urls[special].tolist())
+        mask[special] = special_mask
+        canonical = canonical.astype(object)
+        canonical[special] = special_canonical
+        canonical = canonical.astype("string")
+    return mask, canonical
+
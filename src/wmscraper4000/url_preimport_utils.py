@@ -1,208 +1,310 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from itertools import islice
 import requests
-import json
-import sqlite3
-from urllib.parse import urlparse, quote
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
 from .wm_cdx_utils import get_cdx_records
-from .list_of_valid_tlds import list_of_valid_tlds
-import requests
+from .url_normalize_utils import validate_url, validate_and_normalize, validate_and_normalize_series
+from .rate_limiter import TokenBucket
+from .http_client import HTTPClient
+from .staging_store import StagingStore
+from .url_input_readers import iter_json_batches, iter_csv_batches, csv_chunk_rows
 
+logger = logging.getLogger(__name__)
 
-def original_url_validator(url: str) -> bool:
-    try:
-        result = urlparse(url)
-    except ValueError:
-        return False
-    
-    # Add check for missing hostname
-    if not result.hostname:
-        return False
+# politeness ceiling used for concurrent CDX fetching when no rate is given,
+# matching the default 1.5s sleep of get_cdx_records
+DEFAULT_CDX_REQUESTS_PER_SECOND = 1 / 1.5
 
-    # If the hostname is an IP address, skip TLD check
-    try:
-        parts = result.hostname.split('.')
-        if all(0 <= int(part) < 256 for part in parts):
-            return True
-    except ValueError:
-        pass
-
-    # Check if the tld of the URL is valid
-    hostname_parts = result.hostname.split('.')
-    if len(hostname_parts) < 2:  # Need at least domain.tld
-        return False
-    
-    tld = hostname_parts[-1]
-    if tld not in list_of_valid_tlds:
-        return False
-    
-    # check if more than one instances of "//" exists in the URL
-    if url.count("//") > 1:
-        return False
-    
-    # check if the URL contains any of the following characters: <, >, {, }, |, \, ^, ~, [, ], `
-    invalid_chars = set('<>{}|\\^[]`')
-    if any(char in invalid_chars for char in url):
-        return False
-    
-    # check if the URL contains spaces
-    if ' ' in url:
-        return False
+# cdx_data stored for URLs that are already in the database
+SKIP_CDX_DATA = [{"note": "skip, already in database"}]
 
-    return True
 
-def check_if_url_already_in_db(url: str, base_pastinternet_url: str = "http://localhost:5000/redirect/") -> bool:
+def original_url_validator(url: str) -> bool:
+    return validate_url(url)
+
+def check_if_url_already_in_db(url: str, base_pastinternet_url: str = "http://localhost:5000/redirect/", client=None) -> bool:
     url = quote(url, safe='')
     check_url = f"{base_pastinternet_url}{url}"
-    response = requests.head(check_url)
+    http = client if client is not None else requests
+    response = http.head(check_url)
     if response.status_code == 404:
         return False
     response.raise_for_status()
     return True
 
-def preprocess_urls_from_json_file(file_path: str, cdx_params: dict, bypass_url_validation: bool = False):
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-    
-    # data validation checks
-    for entry in data:
-        # check first if the three necessary keys are present
-        if not all(key in entry for key in ("url", "title", "description")):
-            raise ValueError("Each entry must contain 'url', 'title', and 'description' keys.")
+def fetch_cdx_data(url: str, cdx_params: dict, rate_limiter=None, client=None, url_in_db: bool = None):
+    # url_in_db is None when no batched existence check has been done for this URL
+    if url_in_db is None:
+        url_in_db = check_if_url_already_in_db(url, client=client)
+    if url_in_db:
+        return SKIP_CDX_DATA
+    if rate_limiter is not None:
+        return get_cdx_records(url, rate_limiter=rate_limiter, client=client, **cdx_params)
+    return get_cdx_records(url, client=client, **cdx_params)
 
-    if not bypass_url_validation:
-        urls_failing_validation = [entry["url"] for entry in data if not original_url_validator(entry["url"])]
-        if urls_failing_validation:
-            print("The following URLs failed validation:")
-            for url in urls_failing_validation:
-                print(url)
-            raise ValueError("One or more URLs failed validation. Please correct them and try again.")
+def _rows_with_existence(rows, existence_checker, batch_size):
+    # yields (id, url, url_in_db), checking existence for batch_size rows per call
+    if existence_checker is None:
+        for id, url in rows:
+            yield id, url, None
+        return
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        existing = existence_checker([url for _, url in batch])
+        for id, url in batch:
+            yield id, url, url in existing
 
-    # If we reach this point, all URLs are valid
-    print("URL validation passed.")
+def fill_pending_cdx_data(store: StagingStore, cdx_params: dict, workers: int = 1, requests_per_second: float = None, burst: int = 1, client: HTTPClient = None, existence_checker=None, existence_batch_size: int = 1000, worker_id: str = None, lease_seconds: float = 600, wait_for_leases: bool = True):
+    """
+    Fetches CDX data for every row of the urls table that has cdx_data as NULL.
+
+    Rows are claimed existence_batch_size at a time with leases (see
+    StagingStore.claim_batch), so this can run alongside run_cdx_worker processes or
+    other preprocess runs on the same database without fetching a URL twice. Rows
+    leased by other workers are waited for: they are claimed once their leases
+    expire (e.g. after a crashed run), unless the other workers finish them first.
+
+    With workers > 1 the CDX requests run on a thread pool and every worker draws
+    from one shared token bucket, so the combined request rate never exceeds
+    requests_per_second (burst requests may go out back to back). Database writes
+    always happen on the calling thread and are committed in small groups.
+
+    Args:
+        store (StagingStore): The preimport staging database.
+        cdx_params (dict): Keyword arguments passed to get_cdx_records.
+        workers (int, optional): Number of concurrent workers. Defaults to 1 (serial).
+        requests_per_second (float, optional): Shared CDX request rate. Defaults to
+            DEFAULT_CDX_REQUESTS_PER_SECOND when workers > 1, and to the per-request
+            sleep of get_cdx_records otherwise.
+        burst (int, optional): Burst size of the shared rate limiter. Defaults to 1.
+        client (HTTPClient, optional): Pooled HTTP client for the dedupe and CDX requests.
+            A client sized to the worker count is created (and closed) when not given.
+        existence_checker (callable, optional): Takes a list of URLs and returns the set of
+            those already in the database, e.g. a KnownURLIndex or a partial of
+            check_urls_already_in_db. Replaces the per-URL check_if_url_already_in_db request.
+        existence_batch_size (int, optional): URLs per existence_checker call and per claim. Defaults to 1000.
+        worker_id (str, optional): Lease owner name. Defaults to host-pid-random.
+        lease_seconds (float, optional): Lease duration, renewed while rows are processed. Defaults to 600.
+        wait_for_leases (bool, optional): Wait for rows leased by other workers instead of
+            leaving them to those workers. Defaults to True.
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    # log the number of rows that need cdx_data
+    logger.info("Number of rows that need cdx_data: %d", store.count_pending())
 
-    # print the number of URLs in the file
-    print(f"Number of URLs in the file: {len(data)}")
+    rate_limiter = make_cdx_rate_limiter(workers, requests_per_second, burst)
+    fetch_cdx_for_claimed_rows(store, cdx_params, worker_id or default_worker_id(), existence_batch_size, lease_seconds, workers, rate_limiter, client, existence_checker, flush_size=100, wait_for_leases=wait_for_leases)
 
-    # check for database file existence and create if not exists. The database file is in the same directory as the JSON file
-    db_path = file_path.rsplit('.', 1)[0] + '.db'    
-    conn = sqlite3.connect(db_path)
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def fetch_cdx_for_claimed_rows(queue, cdx_params: dict, worker_id: str, batch_size: int = 100, lease_seconds: float = 600, workers: int = 1, rate_limiter=None, client: HTTPClient = None, existence_checker=None, flush_size: int = 20, flush_interval: float = 5.0, wait_for_leases: bool = True, poll_interval: float = 5.0) -> int:
+    """
+    Claims batches from a work queue and fetches their CDX data until no claimable rows are left.
+
+    Results are written back with queue.complete every flush_size rows or flush_interval
+    seconds, whichever comes first, and leases are renewed every lease_seconds / 3. Unfinished rows are released on exit, also when an
+    error is raised. When only rows leased by other workers are left, the queue is
+    polled every poll_interval seconds until they are done or their leases expire and
+    they can be claimed; with wait_for_leases=False they are left to those workers and
+    a warning is logged. Returns the number of rows processed.
+    """
+    heartbeat_interval = lease_seconds / 3
+    processed = 0
+    last_heartbeat = time.monotonic()
+    last_flush = time.monotonic()
+    results = []
+
+    def flush():
+        nonlocal results, last_flush
+        if results:
+            queue.complete(worker_id, results)
+            results = []
+        last_flush = time.monotonic()
+
+    def save(id, cdx_data):
+        nonlocal processed, last_heartbeat
+        results.append((id, cdx_data))
+        processed += 1
+        if len(results) >= flush_size or time.monotonic() - last_flush >= flush_interval:
+            flush()
+        if time.monotonic() - last_heartbeat >= heartbeat_interval:
+            queue.heartbeat(worker_id, lease_seconds)
+            last_heartbeat = time.monotonic()
+
+    own_client = client is None
+    if own_client:
+        client = HTTPClient(pool_maxsize=max(workers, 10))
+    waiting = False
     try:
-        cursor = conn.cursor()
-        
-        # if the table does not exist, create it
-        # The table will have columns for url, title, description, page_number, cdx_data
-        if not cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", ('urls',)).fetchone():
-            cursor.execute('''
-                CREATE TABLE urls (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    url TEXT NOT NULL,
-                    title TEXT,
-                    description TEXT,
-                    category TEXT,
-                    page_number INTEGER DEFAULT 0,
-                    cdx_data TEXT
-                );
-            ''')
-
-            # insert the data into the table
-            for entry in data:
-                cursor.execute('''
-                    INSERT INTO urls (url, title, description, category, page_number)
-                    VALUES (?, ?, ?, ?, ?);
-                ''', (entry["url"], entry["title"], entry["description"], entry["category"], entry.get("page_number", 0)))
-                conn.commit()
-        
-        # get a list of rows that have cdx_data as NULL
-        cursor.execute("SELECT id, url FROM urls WHERE cdx_data IS NULL;")
-        rows = cursor.fetchall()
-
-        # print the number of rows that need cdx_data
-        print(f"Number of rows that need cdx_data: {len(rows)}")
-
-        # for each row, get the cdx_data and update the row
-        for row in rows:
-            id, url = row
-            url_in_db = check_if_url_already_in_db(url)
-            if url_in_db:
-                cdx_data = [{"note": "skip, already in database"}]
-            else:
-                cdx_data = get_cdx_records(url, **cdx_params)
-            cursor.execute("UPDATE urls SET cdx_data = ? WHERE id = ?;", (json.dumps(cdx_data), id))
-            conn.commit()
-    
+        while True:
+            rows = queue.claim_batch(worker_id, batch_size, lease_seconds)
+            if not rows:
+                leased, expires = queue.leased_elsewhere(worker_id)
+                if not leased:
+                    break
+                if not wait_for_leases:
+                    logger.warning("%d rows are still leased by other workers and were left to them", leased)
+                    break
+                if not waiting:
+                    logger.info("%d rows are leased by other workers, waiting for them to finish or for their leases to expire", leased)
+                waiting = True
+                time.sleep(max(0.01, min(poll_interval, expires - time.time())))
+                continue
+            waiting = False
+            last_heartbeat = time.monotonic()
+            fetch_cdx_for_rows(rows, save, cdx_params, workers, rate_limiter, client, existence_checker, batch_size)
+            flush()
     finally:
-        conn.close()
+        # keep finished results and hand unfinished rows back to the other workers right away
+        flush()
+        queue.release(worker_id)
+        if own_client:
+            client.close()
+    return processed
+
+def make_cdx_rate_limiter(workers: int = 1, requests_per_second: float = None, burst: int = 1):
+    if requests_per_second is not None:
+        return TokenBucket(requests_per_second, burst)
+    if workers > 1:
+        return TokenBucket(DEFAULT_CDX_REQUESTS_PER_SECOND, burst)
+    return None
+
+def fetch_cdx_for_rows(rows, save, cdx_params: dict, workers: int = 1, rate_limiter=None, client: HTTPClient = None, existence_checker=None, existence_batch_size: int = 1000):
+    """Fetches CDX data for (id, url) rows and calls save(id, cdx_data) for each, on the calling thread."""
+    checked_rows = _rows_with_existence(rows, existence_checker, existence_batch_size)
+    own_client = client is None
+    if own_client:
+        client = HTTPClient(pool_maxsize=max(workers, 10))
+    try:
+        if workers == 1:
+            # for each row, get the cdx_data and update the row
+            for id, url, url_in_db in checked_rows:
+                save(id, fetch_cdx_data(url, cdx_params, rate_limiter, client, url_in_db))
+        else:
+            _fetch_concurrently(checked_rows, cdx_params, workers, rate_limiter, client, save)
+    finally:
+        if own_client:
+            client.close()
+
+def _fetch_concurrently(checked_rows, cdx_params, workers, rate_limiter, client, save):
+    # keep a bounded number of requests in flight so huge lots don't queue every row at once
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        for id, url, url_in_db in checked_rows:
+            if url_in_db:
+                save(id, SKIP_CDX_DATA)
+                continue
+            in_flight[executor.submit(fetch_cdx_data, url, cdx_params, rate_limiter, client, url_in_db)] = id
+            if len(in_flight) < max_in_flight:
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                save(in_flight.pop(future), future.result())
+        for future in list(in_flight):
+            save(in_flight.pop(future), future.result())
 
+def _report_failing_urls(urls_failing_validation, failures_so_far):
+    # failing URLs are logged as each chunk is checked, so nothing accumulates in memory
+    if urls_failing_validation and failures_so_far == 0:
+        logger.error("The following URLs failed validation:")
+    for url in urls_failing_validation:
+        logger.error("%s", url)
+    return failures_so_far + len(urls_failing_validation)
 
-def preprocess_urls_from_csv_file(file_path: str, cdx_params: dict, bypass_url_validation: bool = False):
-    import pandas as pd
+def _check_json_batch(batch, bypass_url_validation: bool) -> list:
+    # data validation checks
+    for entry in batch:
+        # check first if the three necessary keys are present
+        if not all(key in entry for key in ("url", "title", "description")):
+            raise ValueError("Each entry must contain 'url', 'title', and 'description' keys.")
 
-    df = pd.read_csv(file_path)
+    if bypass_url_validation:
+        return []
+    mask, _ = validate_and_normalize([entry["url"] for entry in batch])
+    return [entry["url"] for entry, valid in zip(batch, mask) if not valid]
 
+def _check_csv_chunk(df, bypass_url_validation: bool) -> list:
     # data validation checks
     required_columns = {"url", "title", "description"}
     if not required_columns.issubset(df.columns):
         raise ValueError(f"The CSV file must contain the following columns: {required_columns}")
 
-    if not bypass_url_validation:
-        urls_failing_validation = df[~df['url'].apply(original_url_validator)]['url'].tolist()
-        if urls_failing_validation:
-            print("The following URLs failed validation:")
-            for url in urls_failing_validation:
-                print(url)
-            raise ValueError("One or more URLs failed validation. Please correct them and try again.")
+    if bypass_url_validation:
+        return []
+    mask, _ = validate_and_normalize_series(df['url'])
+    return df[~mask]['url'].tolist()
+
+def _validate_and_stage(file_path: str, batches, check_batch, batch_rows, bypass_url_validation: bool) -> StagingStore:
+    # first pass: validate every chunk before anything is written, like the whole-file checks did
+    total = 0
+    failures = 0
+    for batch in batches():
+        failures = _report_failing_urls(check_batch(batch, bypass_url_validation), failures)
+        total += len(batch)
+    if failures:
+        raise ValueError("One or more URLs failed validation. Please correct them and try again.")
 
     # If we reach this point, all URLs are valid
-    print("URL validation passed.")
+    logger.info("URL validation passed.")
 
-    # print the number of URLs in the file
-    print(f"Number of URLs in the file: {len(df)}")
+    # log the number of URLs in the file
+    logger.info("Number of URLs in the file: %d", total)
 
-    # check for database file existence and create if not exists. The database file is in the same directory as the CSV file
-    db_path = file_path.rsplit('.', 1)[0] + '.db'    
-    conn = sqlite3.connect(db_path)
+    # check for database file existence and create if not exists. The database file is in the same directory as the input file
+    db_path = file_path.rsplit('.', 1)[0] + '.db'
+    store = StagingStore(db_path)
     try:
-        cursor = conn.cursor()
-        
-        # if the table does not exist, create it
-        # The table will have columns for url, title, description, page_number, cdx_data
-        if not cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", ('urls',)).fetchone():
-            cursor.execute('''
-                CREATE TABLE urls (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    url TEXT NOT NULL,
-                    title TEXT,
-                    description TEXT,
-                    category TEXT,
-                    page_number INTEGER DEFAULT 0,
-                    cdx_data TEXT
-                );
-            ''')
-
-            # insert the data into the table
-            for _, row in df.iterrows():
-                cursor.execute('''
-                    INSERT INTO urls (url, title, description, category, page_number)
-                    VALUES (?, ?, ?, ?, ?);
-                ''', (row["url"], row["title"], row["description"], row["category"], row.get("page_number", 0)))
-                conn.commit()
-        
-        # get a list of rows that have cdx_data as NULL
-        cursor.execute("SELECT id, url FROM urls WHERE cdx_data IS NULL;")
-        rows = cursor.fetchall()
-
-        # print the number of rows that need cdx_data
-        print(f"Number of rows that need cdx_data: {len(rows)}")
-
-        # for each row, get the cdx_data and update the row
-        for row in rows:
-            id, url = row
-            url_in_db = check_if_url_already_in_db(url)
-            if url_in_db:
-                cdx_data = [{"note": "skip, already in database"}]
-            else:
-                cdx_data = get_cdx_records(url, **cdx_params)
-            cursor.execute("UPDATE urls SET cdx_data = ? WHERE id = ?;", (json.dumps(cdx_data), id))
-            conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+        # second pass: insert the data into the table, unless an earlier run already did
+        if not store.ingest_complete:
+            for batch in batches():
+                store.insert_rows(batch_rows(batch))
+            store.mark_ingest_complete()
+    except BaseException:
+        store.close()
+        raise
+    return store
+
+def preprocess_urls_from_json_file(file_path: str, cdx_params: dict, bypass_url_validation: bool = False, workers: int = 1, requests_per_second: float = None, burst: int = 1, client: HTTPClient = None, existence_checker=None, batch_size: int = 10000, stage_only: bool = False) -> str:
+    # the file is streamed twice (validation, then staging) in batches of batch_size entries,
+    # so memory use doesn't grow with the size of the list. With stage_only the CDX data is
+    # left to run_cdx_worker (e.g. after MongoWorkQueue.enqueue_from_store). Returns the staging database path.
+    store = _validate_and_stage(
+        file_path,
+        lambda: iter_json_batches(file_path, batch_size),
+        _check_json_batch,
+        lambda batch: ((entry["url"], entry["title"], entry["description"], entry.get("category"), entry.get("page_number", 0)) for entry in batch),
+        bypass_url_validation,
+    )
+    with store:
+        if not stage_only:
+            fill_pending_cdx_data(store, cdx_params, workers=workers, requests_per_second=requests_per_second, burst=burst, client=client, existence_checker=existence_checker)
+    return store.db_path
+
+
+def preprocess_urls_from_csv_file(file_path: str, cdx_params: dict, bypass_url_validation: bool = False, workers: int = 1, requests_per_second: float = None, burst: int = 1, client: HTTPClient = None, existence_checker=None, batch_size: int = 10000, stage_only: bool = False) -> str:
+    # the file is read twice (validation, then staging) in chunks of batch_size rows,
+    # so memory use doesn't grow with the size of the list. stage_only and the return value
+    # work like in preprocess_urls_from_json_file.
+    store = _validate_and_stage(
+        file_path,
+        lambda: iter_csv_batches(file_path, batch_size),
+        _check_csv_chunk,
+        csv_chunk_rows,
+        bypass_url_validation,
+    )
+    with store:
+        if not stage_only:
+            fill_pending_cdx_data(store, cdx_params, workers=workers, requests_per_second=requests_per_second, burst=burst, client=client, existence_checker=existence_checker)
+    return store.db_path
@@ -0,0 +1,139 @@
+import gzip
+import os
+import re
+import threading
+import uuid
+from urllib.parse import urlsplit
+
+# headers describing the transfer rather than the payload; the body is written de-chunked but
+# with its Content-Encoding kept, since that is what the payload digest covers
+_TRANSFER_HEADERS = {"transfer-encoding", "content-length", "connection"}
+
+
+def surt_urlkey(url: str) -> str:
+    """Builds a CDX-style SURT urlkey, e.g. http://www.Example.com/a?b -> com,example)/a?b"""
+    parts = urlsplit(url if "://" in url else "http://" + url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split("."))) + ")"
+    if parts.port and parts.port not in (80, 443):
+        key = key[:-1] + f":{parts.port})"
+    key += (parts.path or "/").lower()
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.lower().split("&")))
+    return key
+
+
+def _header(headers, name: str, default: str) -> str:
+    # plain dicts keep the server's casing, and HTTP/2 (httpx) header names are lowercase
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+def _warc_date(timestamp) -> str:
+    ts = str(timestamp).ljust(14, "0")
+    return f"{ts[0:4]}-{ts[4:6]}-{ts[6:8]}T{ts[8:10]}:{ts[10:12]}:{ts[12:14]}Z"
+
+
+class WARCWriter:
+    """Appends response records to a WARC file and writes a matching CDX index.
+
+    Each record is written as its own gzip member (when compress is True), the
+    usual layout for .warc.gz files, so individual records can be read back by
+    offset. For every record a CDX line
+    (urlkey timestamp original mimetype statuscode digest redirect meta length offset filename)
+    is appended to index_path, which defaults to the WARC path plus ".cdx".
+    The writer is safe to share between threads.
+
+    Args:
+        path (str): WARC file to append to.
+        compress (bool, optional): Gzip every record. Defaults to True.
+        index_path (str, optional): CDX index file.
+    """
+
+    def __init__(self, path: str, compress: bool = True, index_path: str = None):
+        self.path = path
+        self.compress = compress
+        self.index_path = index_path or path + ".cdx"
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        new_index = not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        if new_index:
+            self._index.write(" CDX N b a m s k r M S V g\n")
+
+    def write_response(self, target_uri: str, timestamp, status_code: int, reason: str, headers: dict, body, body_length: int, payload_digest: str, chunk_size: int = 65536) -> int:
+        """
+        Writes a response record whose payload is read from the file object body.
+
+        Returns:
+            int: Offset of the record in the WARC file.
+        """
+        http_headers = f"HTTP/1.1 {status_code} {reason or ''}".rstrip() + "\r\n"
+        for name, value in headers.items():
+            if name.lower() not in _TRANSFER_HEADERS:
+                http_headers += f"{name}: {value}\r\n"
+        http_headers += f"Content-Length: {body_length}\r\n\r\n"
+        http_block = http_headers.encode("utf-8", errors="replace")
+
+        warc_headers = (
+            "WARC/1.0\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+            f"WARC-Date: {_warc_date(timestamp)}\r\n"
+            f"WARC-Target-URI: {target_uri}\r\n"
+            f"WARC-Payload-Digest: sha1:{payload_digest}\r\n"
+            "Content-Type: application/http; msgtype=response\r\n"
+            f"Content-Length: {len(http_block) + body_length}\r\n\r\n"
+        ).encode("utf-8")
+
+        with self._lock:
+            offset = self._file.tell()
+            out = gzip.GzipFile(fileobj=self._file, mode="wb") if self.compress else self._file
+            out.write(warc_headers)
+            out.write(http_block)
+            body.seek(0)
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+            out.write(b"\r\n\r\n")
+            if self.compress:
+                out.close()
+            self._file.flush()
+            length = self._file.tell() - offset
+
+            mimetype = _header(headers, "Content-Type", "unk").split(";")[0].strip() or "unk"
+            redirect = _header(headers, "Location", "-") if 300 <= status_code < 400 else "-"
+            line = " ".join([
+                surt_urlkey(target_uri),
+                str(timestamp),
+                target_uri,
+                re.sub(r"\s", "", mimetype),
+                str(status_code),
+                payload_digest,
+                redirect.replace(" ", "%20"),
+                "-",
+                str(length),
+                str(offset),
+                os.path.basename(self.path),
+            ])
+            self._index.write(line + "\n")
+            self._index.flush()
+        return offset
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
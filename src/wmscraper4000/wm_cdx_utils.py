@@ -1,54 +1,229 @@
 import requests
-from urllib.parse import quote
+import os
 import time
 import json
+import logging
+from .cdx_record import CDX_FIELDS, CDXRecord, CDXRecordBatch
+from .instrumentation import metrics
 
-def get_cdx_records(original_url: str, from_date: str = None, to_date: str = None, filter: str = None, sleep: float = 1.5, return_json_string: bool = False) -> list:
-    base = "https://web.archive.org/cdx/search/cdx"
+logger = logging.getLogger(__name__)
+
+CDX_SERVER_URL = "https://web.archive.org/cdx/search/cdx"
+
+def _parse_cdx_line(line: str, fields=CDX_FIELDS) -> dict:
+    # the columns of a line are the fields requested with fl=, all seven by default
+    return dict(zip(fields, line.split(" ")))
+
+def _cdx_query_params(original_url, from_date, to_date, filter, fields, collapse, limit, as_records, **extra) -> dict:
+    if fields is not None:
+        fields = tuple(fields)
+        if not fields:
+            raise ValueError("fields must name at least one CDX field")
+        if as_records and not set(fields).issubset(CDX_FIELDS):
+            raise ValueError(f"as_records only supports the fields {CDX_FIELDS}")
     params = {
         "url": original_url,
         "from": from_date,
         "to": to_date,
-        "filter": filter,
+        # filter and collapse may be repeated; requests sends a list as one parameter per value
+        "filter": list(filter) if isinstance(filter, (list, tuple)) else filter,
+        "collapse": list(collapse) if isinstance(collapse, (list, tuple)) else collapse,
+        "fl": ",".join(fields) if fields is not None else None,
+        "limit": limit,
+        **extra,
     }
 
-    # remove None values from params
-    params = {k: v for k, v in params.items() if v is not None}
+    # remove None values (and empty filter/collapse lists) from params
+    return {k: v for k, v in params.items() if v is not None and v != []}
+
+def get_cdx_records(original_url: str, from_date: str = None, to_date: str = None, filter=None, sleep: float = 1.5, return_json_string: bool = False, rate_limiter=None, base: str = CDX_SERVER_URL, client=None, as_records: bool = False, cache=None, fields=None, collapse=None, limit: int = None) -> list:
+    """
+    Fetches the CDX records of a URL in one request.
+
+    fields, collapse, filter and limit are applied by the CDX server, which keeps
+    responses small. For example, fields=("timestamp", "digest") with
+    filter="statuscode:200" and collapse="digest" returns only what digest-based
+    deduplication needs. Records then hold just the requested fields. With
+    as_records the missing ones are empty strings, or -1 for numbers.
+
+    Args:
+        original_url (str): The URL to query.
+        from_date (str, optional): Start of the timestamp range.
+        to_date (str, optional): End of the timestamp range.
+        filter (str or list, optional): CDX filter expression(s), e.g. "statuscode:200" or
+            ["statuscode:200", "!mimetype:image/.*"].
+        sleep (float, optional): Seconds to wait before the request when no rate limiter is given.
+        return_json_string (bool, optional): Return the records as a JSON string.
+        rate_limiter (TokenBucket, optional): Shared rate limiter used instead of the sleep.
+        base (str, optional): CDX server endpoint.
+        client (HTTPClient, optional): Pooled HTTP client.
+        as_records (bool, optional): Return a compact CDXRecordBatch instead of dicts.
+        cache (DiskCache, optional): Cache for the raw response, keyed on base, the URL and all query parameters.
+        fields (sequence, optional): CDX fields to return (fl=), in this order. Defaults to all seven.
+        collapse (str or list, optional): Collapse expression(s), e.g. "digest" or "timestamp:8".
+        limit (int, optional): Maximum number of records. Negative values return the last captures.
 
-    # request the CDX records from the server
-    time.sleep(sleep)  # be polite and avoid hammering the server
-    print(f"Requesting CDX records for {original_url} with params: {params}")
-    print(f"Full URL: {base}?{requests.compat.urlencode(params)}")
-    response = requests.get(base, params=params)
-    if response.status_code == 403:
-        print("Access forbidden due to the URL being excluded from the Wayback Machine.")
-        return '[{"error": 403}]'
-    response.raise_for_status()
+    Returns:
+        list or CDXRecordBatch or str: The records; '[{"error": 403}]' for URLs excluded from the Wayback Machine.
+    """
+    params = _cdx_query_params(original_url, from_date, to_date, filter, fields, collapse, limit, as_records)
+    fields = tuple(fields) if fields is not None else CDX_FIELDS
+
+    # serve repeated queries from the on-disk cache, keyed by endpoint + normalized URL + params
+    cache_key = cache.cdx_key(original_url, params, base) if cache is not None else None
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
+        logger.debug("Using cached CDX records for %s with params: %s", original_url, params)
+        text = cached[0].decode("utf-8")
+    else:
+        # request the CDX records from the server
+        # when a shared rate limiter is given it replaces the fixed sleep
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        else:
+            time.sleep(sleep)  # be polite and avoid hammering the server
+        logger.debug("Requesting CDX records for %s with params: %s", original_url, params)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Full URL: %s?%s", base, requests.compat.urlencode(params))
+        http = client if client is not None else requests
+        with metrics.timer("wmscraper_cdx_request_seconds", "CDX request latency"):
+            response = http.get(base, params=params)
+        metrics.counter("wmscraper_cdx_requests_total", "CDX requests by status code").inc(status=response.status_code)
+        if response.status_code == 403:
+            logger.info("Access forbidden due to the URL being excluded from the Wayback Machine: %s", original_url)
+            return '[{"error": 403}]'
+        response.raise_for_status()
+        text = response.text
+        if cache is not None:
+            cache.set(cache_key, text.encode("utf-8"))
+
+    # compact struct-of-arrays representation, skips building a dict per line
+    if as_records:
+        records = CDXRecordBatch.from_lines(text.strip().split("\n"), fields)
+        metrics.counter("wmscraper_cdx_records_total", "CDX records parsed").inc(len(records))
+        logger.debug("Retrieved %d CDX records for %s", len(records), original_url)
+        return records
 
     # convert the response to a list of dictionaries
     records = []
 
     # if the response is not empty, parse it
-    if response.text.strip():
-        for line in response.text.strip().split("\n"):
-            parts = line.split(" ")
-            record = {
-                "urlkey": parts[0],
-                "timestamp": parts[1],
-                "original": parts[2],
-                "mimetype": parts[3],
-                "statuscode": parts[4],
-                "digest": parts[5],
-                "length": parts[6],
-            }
-            records.append(record)
-
-    print(f"Retrieved {len(records)} CDX records for {original_url}")
+    if text.strip():
+        for line in text.strip().split("\n"):
+            records.append(_parse_cdx_line(line, fields))
+
+    metrics.counter("wmscraper_cdx_records_total", "CDX records parsed").inc(len(records))
+    logger.debug("Retrieved %d CDX records for %s", len(records), original_url)
 
     if return_json_string:
         return json.dumps(records, indent=2, ensure_ascii=False)
     return records
 
+def _read_resume_key(resume_key_file: str):
+    if resume_key_file and os.path.exists(resume_key_file):
+        with open(resume_key_file, "r") as file:
+            return file.read().strip() or None
+    return None
+
+def _write_resume_key(resume_key_file: str, resume_key: str):
+    if not resume_key_file:
+        return
+    if resume_key is None:
+        if os.path.exists(resume_key_file):
+            os.remove(resume_key_file)
+        return
+    # write to a temporary file first so a crash never leaves a truncated key behind
+    tmp_path = resume_key_file + ".tmp"
+    with open(tmp_path, "w") as file:
+        file.write(resume_key)
+    os.replace(tmp_path, resume_key_file)
+
+def iter_cdx_records(original_url: str, from_date: str = None, to_date: str = None, filter=None, match_type: str = None, page_size: int = 5000, resume_key_file: str = None, sleep: float = 1.5, rate_limiter=None, base: str = CDX_SERVER_URL, client=None, as_records: bool = False, fields=None, collapse=None):
+    """
+    Lazily yields CDX records for a URL, one page at a time.
+
+    Each page is requested with `limit` and `showResumeKey=true` and its body is
+    streamed line by line, so memory stays flat regardless of how many captures
+    the URL has. The resume key returned by the CDX server is written to
+    resume_key_file after every completed page and removed once the last page has
+    been read; calling again with the same file continues where an interrupted
+    crawl stopped. Records of a page that was interrupted midway are yielded again.
+
+    Args:
+        original_url (str): The URL (or URL prefix/domain) to query.
+        from_date (str, optional): Start of the timestamp range.
+        to_date (str, optional): End of the timestamp range.
+        filter (str or list, optional): CDX filter expression(s), e.g. "statuscode:200".
+        match_type (str, optional): CDX matchType (exact, prefix, host or domain).
+        page_size (int, optional): Number of records requested per page. Defaults to 5000.
+        resume_key_file (str, optional): Path where the resume key is persisted.
+        sleep (float, optional): Seconds to wait before each page request when no rate limiter is given.
+        rate_limiter (TokenBucket, optional): Shared rate limiter used instead of the sleep.
+        base (str, optional): CDX server endpoint.
+        client (HTTPClient, optional): Pooled HTTP client.
+        as_records (bool, optional): Yield compact CDXRecord objects instead of dicts. Defaults to False.
+        fields (sequence, optional): CDX fields to return (fl=), see get_cdx_records. Defaults to all seven.
+        collapse (str or list, optional): Collapse expression(s), e.g. "digest" or "timestamp:8".
+
+    Yields:
+        dict or CDXRecord: A CDX record with the requested fields (urlkey, timestamp, original,
+            mimetype, statuscode, digest and length by default).
+
+    Raises:
+        requests.HTTPError: If the CDX server answers with an error status (403 for excluded URLs).
+    """
+    http = client if client is not None else requests
+    params = _cdx_query_params(original_url, from_date, to_date, filter, fields, collapse, page_size, as_records, matchType=match_type, showResumeKey="true")
+    fields = tuple(fields) if fields is not None else CDX_FIELDS
+    parse = CDXRecord.from_line if as_records else _parse_cdx_line
+
+    resume_key = _read_resume_key(resume_key_file)
+    if resume_key:
+        logger.info("Resuming CDX crawl for %s from resume key: %s", original_url, resume_key)
+
+    count = 0
+    while True:
+        page_params = dict(params)
+        if resume_key:
+            page_params["resumeKey"] = resume_key
+
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        else:
+            time.sleep(sleep)  # be polite and avoid hammering the server
+
+        with metrics.timer("wmscraper_cdx_request_seconds", "CDX request latency"):
+            response = http.get(base, params=page_params, stream=True)
+        metrics.counter("wmscraper_cdx_requests_total", "CDX requests by status code").inc(status=response.status_code)
+        try:
+            response.raise_for_status()
+
+            # records come first, then an empty line followed by the resume key (if there are more pages)
+            next_resume_key = None
+            after_blank = False
+            for line in response.iter_lines():
+                if isinstance(line, bytes):
+                    line = line.decode("utf-8", errors="replace")
+                line = line.strip()
+                if not line:
+                    after_blank = True
+                    continue
+                if after_blank:
+                    next_resume_key = line
+                    continue
+                count += 1
+                yield parse(line, fields)
+        finally:
+            response.close()
+
+        _write_resume_key(resume_key_file, next_resume_key)
+        if next_resume_key is None:
+            break
+        resume_key = next_resume_key
+
+    metrics.counter("wmscraper_cdx_records_total", "CDX records parsed").inc(count)
+    logger.debug("Streamed %d CDX records for %s", count, original_url)
+
 if __name__ == "__main__":
     # Example usage
     url = "mrshow.com"
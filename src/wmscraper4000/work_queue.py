@@ -0,0 +1,159 @@
+import json
+import logging
+import time
+import uuid
+from pymongo import UpdateOne
+from .url_preimport_utils import fetch_cdx_for_claimed_rows, make_cdx_rate_limiter, default_worker_id
+from .http_client import HTTPClient
+
+logger = logging.getLogger(__name__)
+
+
+class MongoWorkQueue:
+    """Lease-based CDX work queue in a Mongo collection, for workers spread over several machines.
+
+    Has the same claim_batch/heartbeat/complete/release interface as StagingStore,
+    so run_cdx_worker works with either. Each document holds one URL:
+    {url, title, description, category, page_number, cdx_data, lease_owner, lease_expires}.
+    cdx_data holds the decoded CDX data (not the JSON text of the staging database).
+
+    Args:
+        collection: Mongo collection used as the queue (one per lot).
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index("url", unique=True)
+        self.collection.create_index([("cdx_done", 1), ("lease_expires", 1)])
+
+    def enqueue_from_store(self, store, batch_size: int = 10000) -> int:
+        """
+        Copies the rows of a StagingStore into the queue; rows already queued are left alone.
+
+        Stage the input without fetching CDX data first, with stage_only=True in
+        preprocess_urls_from_json_file / preprocess_urls_from_csv_file.
+        """
+        cursor = store.conn.execute("SELECT url, title, description, category, page_number, cdx_data FROM urls;")
+        inserted = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            operations = [
+                UpdateOne({"url": url}, {"$setOnInsert": {
+                    "url": url,
+                    "title": title,
+                    "description": description,
+                    "category": category,
+                    "page_number": page_number,
+                    "cdx_data": json.loads(cdx_data) if cdx_data is not None else None,
+                    "cdx_done": cdx_data is not None,
+                    "lease_owner": None,
+                    "lease_expires": None,
+                }}, upsert=True)
+                for url, title, description, category, page_number, cdx_data in rows
+            ]
+            inserted += self.collection.bulk_write(operations, ordered=False).upserted_count
+        logger.info("Queued %d new URLs", inserted)
+        return inserted
+
+    def _claimable(self, now: float) -> dict:
+        return {"cdx_done": False, "$or": [{"lease_expires": None}, {"lease_expires": {"$lt": now}}]}
+
+    def claim_batch(self, worker_id: str, batch_size: int = 100, lease_seconds: float = 600) -> list:
+        """
+        Leases up to batch_size pending URLs to worker_id.
+
+        Candidates are tagged with a unique claim token in one update_many whose filter
+        re-checks that they are still claimable, so a document can only be won by one
+        worker even when several claim the same candidates at once.
+
+        Returns:
+            list: (id, url) tuples of the claimed documents.
+        """
+        now = time.time()
+        candidates = [document["_id"] for document in self.collection.find(self._claimable(now), {"_id": 1}).limit(batch_size)]
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        claim_filter = self._claimable(now)
+        claim_filter["_id"] = {"$in": candidates}
+        self.collection.update_many(claim_filter, {"$set": {
+            "lease_owner": worker_id,
+            "lease_expires": now + lease_seconds,
+            "lease_token": token,
+        }})
+        return [(document["_id"], document["url"]) for document in self.collection.find({"lease_token": token}, {"url": 1})]
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = 600):
+        """Extends every lease held by worker_id."""
+        self.collection.update_many(
+            {"lease_owner": worker_id, "cdx_done": False},
+            {"$set": {"lease_expires": time.time() + lease_seconds}},
+        )
+
+    def complete(self, worker_id: str, updates):
+        """Stores cdx_data for (id, cdx_data) pairs and drops their leases."""
+        operations = [
+            UpdateOne({"_id": id}, {"$set": {
+                "cdx_data": cdx_data,
+                "cdx_done": True,
+                "lease_owner": None,
+                "lease_expires": None,
+            }})
+            for id, cdx_data in updates
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def release(self, worker_id: str):
+        """Gives back the unfinished URLs leased by worker_id."""
+        self.collection.update_many(
+            {"lease_owner": worker_id, "cdx_done": False},
+            {"$set": {"lease_owner": None, "lease_expires": None}},
+        )
+
+    def leased_elsewhere(self, worker_id: str) -> tuple:
+        """Returns the number of pending URLs under unexpired leases of other workers and the earliest expiry (None if there are none)."""
+        leased = {"cdx_done": False, "lease_expires": {"$gte": time.time()}, "lease_owner": {"$ne": worker_id}}
+        count = self.collection.count_documents(leased)
+        if not count:
+            return 0, None
+        earliest = self.collection.find(leased, {"lease_expires": 1}).sort("lease_expires", 1).limit(1)
+        return count, next(iter(earliest))["lease_expires"]
+
+
+def run_cdx_worker(queue, cdx_params: dict, worker_id: str = None, batch_size: int = 100, lease_seconds: float = 600, workers: int = 1, requests_per_second: float = None, burst: int = 1, client: HTTPClient = None, existence_checker=None, flush_size: int = 20, wait_for_leases: bool = True) -> int:
+    """
+    Claims and processes batches from a work queue until no claimable rows are left.
+
+    Start one call per process, on as many machines as needed: each claims
+    batch_size rows at a time, fetches their CDX data and writes it back, renewing its
+    leases while it works. Rows of a worker that dies are picked up by the others once
+    its leases expire; a worker that runs out of claimable rows waits for them. Note that requests_per_second applies per worker process, so
+    divide the archive's limit by the number of processes.
+
+    Args:
+        queue (StagingStore or MongoWorkQueue): The shared work queue.
+        cdx_params (dict): Keyword arguments passed to get_cdx_records.
+        worker_id (str, optional): Lease owner name. Defaults to host-pid-random.
+        batch_size (int, optional): Rows claimed at a time. Defaults to 100.
+        lease_seconds (float, optional): Lease duration; renewed every lease_seconds / 3. Defaults to 600.
+        workers (int, optional): Concurrent CDX requests within this process. Defaults to 1.
+        requests_per_second (float, optional): CDX request rate of this process.
+        burst (int, optional): Burst size of the rate limiter. Defaults to 1.
+        client (HTTPClient, optional): Pooled HTTP client.
+        existence_checker (callable, optional): Batched existence check, see fill_pending_cdx_data.
+        flush_size (int, optional): Results written back per complete() call. Defaults to 20.
+        wait_for_leases (bool, optional): Wait for rows leased by other workers once nothing
+            else is claimable, instead of exiting. Defaults to True.
+
+    Returns:
+        int: Number of rows processed by this worker.
+    """
+    worker_id = worker_id or default_worker_id()
+    rate_limiter = make_cdx_rate_limiter(workers, requests_per_second, burst)
+    logger.info("Worker %s started", worker_id)
+    processed = fetch_cdx_for_claimed_rows(queue, cdx_params, worker_id, batch_size, lease_seconds, workers, rate_limiter, client, existence_checker, flush_size, wait_for_leases=wait_for_leases)
+    logger.info("Worker %s finished after processing %d rows", worker_id, processed)
+    return processed
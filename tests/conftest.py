@@ -0,0 +1,22 @@
+import pytest
+
+from wmscraper4000 import url_import_utils
+from wmscraper4000.url_import_utils import URLImporter
+
+
+@pytest.fixture
+def mongo_client():
+    """An in-memory mongomock client, made to accept the bulk writes of current pymongo releases."""
+    mongomock = pytest.importorskip("mongomock")
+    from mongo_standin import make_mongomock_compatible
+
+    make_mongomock_compatible(mongomock)
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def importer(monkeypatch, mongo_client):
+    """A URLImporter backed by mongo_client."""
+    monkeypatch.setattr(url_import_utils, "MongoClient", lambda uri: mongo_client)
+    with URLImporter("mongodb://test") as importer:
+        yield importer
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import time
+
+from wmscraper4000.cache import DiskCache
+
+
+def _blob_files(directory):
+    return [name for _, _, names in os.walk(os.path.join(directory, "blobs")) for name in names]
+
+
+def test_shared_blobs_are_stored_once(tmp_path):
+    with DiskCache(str(tmp_path)) as cache:
+        cache.set("a", b"x" * 100)
+        cache.set("b", b"x" * 100)
+        cache.set("c", b"y" * 50)
+        assert cache.stats()["bytes"] == 150
+        assert len(_blob_files(str(tmp_path))) == 2
+        assert cache.get("b") == (b"x" * 100, {})
+
+
+def test_overwriting_and_expiring_release_blobs(tmp_path):
+    with DiskCache(str(tmp_path), ttl=0.05) as cache:
+        cache.set("a", b"x" * 100)
+        cache.set("b", b"x" * 100)
+        cache.set("a", b"z" * 10)
+        assert cache.stats()["bytes"] == 110
+        time.sleep(0.1)
+        assert cache.get("a") is None
+        assert cache.get("b") is None
+        assert cache.stats()["bytes"] == 0
+        assert _blob_files(str(tmp_path)) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    with DiskCache(str(tmp_path), max_bytes=300) as cache:
+        for key in ("a", "b", "c"):
+            cache.set(key, key.encode() * 100)
+            time.sleep(0.01)
+        cache.get("a")
+        cache.set("d", b"d" * 100)
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["bytes"] == 300
+        assert len(_blob_files(str(tmp_path))) == 3
+
+
+def test_eviction_keeps_shared_blob_until_last_reference(tmp_path):
+    with DiskCache(str(tmp_path), max_bytes=150) as cache:
+        cache.set("a", b"x" * 100)
+        cache.set("b", b"x" * 100)
+        cache.set("c", b"y" * 100)
+        assert cache.get("a") is None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.stats()["bytes"] == 100
+
+
+def test_upgrades_index_of_earlier_versions(tmp_path):
+    with DiskCache(str(tmp_path)) as cache:
+        cache.set("a", b"x" * 100)
+        cache.set("b", b"x" * 100)
+        cache.set("c", b"y" * 50)
+    conn = sqlite3.connect(str(tmp_path / "index.db"))
+    conn.execute("DROP TABLE blobs;")
+    conn.execute("DROP TABLE cache_meta;")
+    conn.commit()
+    conn.close()
+    with DiskCache(str(tmp_path)) as cache:
+        assert cache.stats()["bytes"] == 150
+        cache.set("a", b"q")
+        cache.set("b", b"q")
+        assert cache.stats()["bytes"] == 51
+
+
+def test_keys_include_the_endpoint():
+    params = {"url": "example.com", "output": "json"}
+    assert DiskCache.cdx_key("http://example.com/", params, "http://localhost:8080/cdx") != DiskCache.cdx_key("http://example.com/", params, "https://web.archive.org/cdx/search/cdx")
+    assert DiskCache.snapshot_key("http://example.com/", "2020", "id_", "http://localhost:8080/web/") != DiskCache.snapshot_key("http://example.com/", "2020", "id_", "https://web.archive.org/web/")
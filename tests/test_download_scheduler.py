@@ -0,0 +1,98 @@
+import threading
+
+import requests
+
+from wmscraper4000.download_scheduler import plan_downloads, run_download_plan
+from wmscraper4000.retry_policy import CircuitBreaker, RetryPolicy
+
+BASE = "http://archive.test/web/"
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"payload"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": "application/octet-stream"}
+        self.encoding = None
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+class FakeClient:
+    """Answers each request with the next status of statuses, then with the last one."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            status = self.statuses[min(self.calls, len(self.statuses) - 1)]
+            self.calls += 1
+        return FakeResponse(status)
+
+
+def _plan(count):
+    return plan_downloads([{"url": f"http://example.com/{i}", "digest_to_snapshot": {f"D{i}": ["20200101000000"]}} for i in range(count)])
+
+
+def _run_with_timeout(plan, client, **kwargs):
+    results = {}
+
+    def target():
+        results["stats"] = run_download_plan(plan, lambda *args: None, client=client, requests_per_second=1000, burst=10, base=BASE, **kwargs)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), "run_download_plan did not finish"
+    return results["stats"]
+
+
+def test_downloads_every_digest_and_fans_out():
+    plan = plan_downloads([
+        {"url": "http://example.com/a", "digest_to_snapshot": {"X": ["20200101000000", "20210101000000"]}},
+        {"url": "http://example.com/b", "digest_to_snapshot": {"X": ["20190101000000"], "Y": ["20200101000000"]}},
+    ])
+    assert plan["X"]["url"] == "http://example.com/b"
+    seen = []
+    stats = run_download_plan(plan, lambda url, timestamp, digest, result: seen.append((digest, url, timestamp)), client=FakeClient([200]), requests_per_second=1000, base=BASE)
+    assert stats["downloaded"] == 2
+    assert stats["references"] == 4
+    assert sorted(seen) == [
+        ("X", "http://example.com/a", "20200101000000"),
+        ("X", "http://example.com/a", "20210101000000"),
+        ("X", "http://example.com/b", "20190101000000"),
+        ("Y", "http://example.com/b", "20200101000000"),
+    ]
+
+
+def test_permanent_error_ends_half_open_trial():
+    # the 503 opens the breaker; the trial request then fails permanently, which must not leave the circuit open for good
+    client = FakeClient([503, 400])
+    stats = _run_with_timeout(
+        _plan(6),
+        client,
+        workers=1,
+        retry_policy=RetryPolicy(max_attempts=1),
+        circuit_breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0),
+    )
+    assert len(stats["failed"]) == 6
+    assert client.calls == 6
+
+
+def test_retryable_errors_are_retried():
+    client = FakeClient([503, 503, 200])
+    stats = _run_with_timeout(
+        _plan(1),
+        client,
+        workers=1,
+        retry_policy=RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.01),
+        circuit_breaker=CircuitBreaker(failure_threshold=10, reset_timeout=0),
+    )
+    assert stats["downloaded"] == 1
+    assert stats["retries"] == 2
+    assert not stats["failed"]
@@ -0,0 +1,38 @@
+import io
+import logging
+
+from wmscraper4000.instrumentation import MetricsRegistry, enable_console_logging, logger, use_application_logging
+
+
+def test_records_propagate_to_the_application(caplog):
+    assert all(isinstance(handler, logging.NullHandler) for handler in logger.handlers)
+    with caplog.at_level(logging.INFO):
+        logging.getLogger("wmscraper4000.staging_store").info("hello")
+    assert "hello" in caplog.text
+
+
+def test_console_logging_is_opt_in(caplog):
+    stream = io.StringIO()
+    enable_console_logging(logging.INFO, stream)
+    try:
+        enable_console_logging(logging.INFO, stream)
+        with caplog.at_level(logging.INFO):
+            logging.getLogger("wmscraper4000.pipeline").info("progress")
+        assert stream.getvalue() == "progress\n"
+        assert "progress" not in caplog.text
+    finally:
+        use_application_logging()
+        logger.setLevel(logging.NOTSET)
+    assert all(isinstance(handler, logging.NullHandler) for handler in logger.handlers)
+    assert logger.propagate
+
+
+def test_metrics_export():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc(status=200)
+    registry.counter("requests_total").inc(2, status=200)
+    registry.histogram("latency_seconds", "Latency", (0.1, 1)).observe(0.5)
+    text = registry.to_prometheus()
+    assert 'requests_total{status="200"} 3' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert registry.to_dict()["requests_total"] == {"{status=\"200\"}": 3}
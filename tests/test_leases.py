@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from wmscraper4000.staging_store import StagingStore
+
+
+def _rows(count):
+    return [(f"http://example.com/{i}", None, None, None, 0) for i in range(count)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StagingStore(str(tmp_path / "staging.db"))
+    store.insert_rows(_rows(10))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def mongo_queue(mongo_client):
+    from wmscraper4000.work_queue import MongoWorkQueue
+    return MongoWorkQueue(mongo_client.db.queue)
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def queue(request, store):
+    if request.param == "sqlite":
+        return store
+    queue = request.getfixturevalue("mongo_queue")
+    queue.enqueue_from_store(store)
+    return queue
+
+
+def test_claims_are_disjoint(queue):
+    first = queue.claim_batch("a", batch_size=6)
+    second = queue.claim_batch("b", batch_size=6)
+    assert len(first) == 6
+    assert len(second) == 4
+    assert not {url for _, url in first} & {url for _, url in second}
+    assert queue.claim_batch("c") == []
+
+
+def test_expired_leases_can_be_reclaimed(queue):
+    claimed = queue.claim_batch("a", batch_size=10, lease_seconds=0.05)
+    time.sleep(0.1)
+    assert sorted(queue.claim_batch("b", batch_size=10)) == sorted(claimed)
+
+
+def test_heartbeat_extends_leases(queue):
+    queue.claim_batch("a", batch_size=10, lease_seconds=0.05)
+    queue.heartbeat("a", lease_seconds=60)
+    time.sleep(0.1)
+    assert queue.claim_batch("b") == []
+
+
+def test_completed_rows_are_not_claimed_again(queue):
+    claimed = queue.claim_batch("a", batch_size=4, lease_seconds=0)
+    queue.complete("a", [(id, [["20200101000000", "DIGEST", "200"]]) for id, _ in claimed])
+    time.sleep(0.01)
+    reclaimed = queue.claim_batch("b", batch_size=10)
+    assert len(reclaimed) == 6
+    assert not {id for id, _ in claimed} & {id for id, _ in reclaimed}
+
+
+def test_release_returns_unfinished_rows(queue):
+    claimed = queue.claim_batch("a", batch_size=10)
+    queue.complete("a", [(claimed[0][0], [])])
+    queue.release("a")
+    assert len(queue.claim_batch("b", batch_size=10)) == 9
+
+
+def test_leases_held_elsewhere_are_reported(queue):
+    assert queue.leased_elsewhere("a") == (0, None)
+    queue.claim_batch("b", batch_size=3, lease_seconds=60)
+    queue.claim_batch("c", batch_size=2, lease_seconds=30)
+    count, expires = queue.leased_elsewhere("a")
+    assert count == 5
+    assert 25 < expires - time.time() <= 30
+    assert queue.leased_elsewhere("b")[0] == 2
+    queue.claim_batch("d", batch_size=5, lease_seconds=0)
+    time.sleep(0.01)
+    # expired leases are claimable, not held
+    assert queue.leased_elsewhere("a")[0] == 5
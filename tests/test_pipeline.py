@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from wmscraper4000 import pipeline
+from wmscraper4000.cdx_record import CDXRecordBatch
+
+GOOD = "GOODDIGEST"
+BAD = "BADDIGEST"
+
+
+@pytest.fixture
+def archive(monkeypatch):
+    downloads = []
+
+    def fake_get_cdx_records(url, **kwargs):
+        digest = GOOD if "good" in url else BAD
+        return CDXRecordBatch.from_lines([f"com,example)/ 20200101000000 {url} text/html 200 {digest} 100"])
+
+    def fake_stream_archived_snapshot(url, timestamp, dest=None, expected_digest=None, **kwargs):
+        downloads.append(expected_digest)
+        with open(dest, "wb") as file:
+            file.write(b"payload")
+        matches = expected_digest == GOOD
+        return {"status_code": 200, "path": dest, "length": 7, "digest": GOOD, "digest_matches": matches}
+
+    monkeypatch.setattr(pipeline, "get_cdx_records", fake_get_cdx_records)
+    monkeypatch.setattr(pipeline, "stream_archived_snapshot", fake_stream_archived_snapshot)
+    return downloads
+
+
+def _run(tmp_path, importer):
+    path = tmp_path / "urls.json"
+    path.write_text(json.dumps([
+        {"url": "http://good.example.com/", "title": "t", "description": "d"},
+        {"url": "http://bad.example.com/", "title": "t", "description": "d"},
+        {"url": "http://good.example.com/", "title": "t", "description": "again"},
+    ]))
+    return asyncio.run(pipeline.run_pipeline(str(path), importer, 1, output_dir=str(tmp_path / "out"), cdx_requests_per_second=1000, download_requests_per_second=1000, mongo_flush_interval=0.01))
+
+
+def test_mismatched_payloads_are_quarantined_and_refetched(tmp_path, importer, archive):
+    stats = _run(tmp_path, importer)
+    assert stats["urls"] == 2
+    assert stats["repeated"] == 1
+    assert stats["downloaded"] == 2
+    assert stats["digest_mismatches"] == 1
+    out = tmp_path / "out"
+    assert sorted(os.listdir(out)) == [GOOD, "mismatched"]
+    assert os.listdir(out / "mismatched") == [BAD]
+
+    # the verified payload is reused, the mismatched one is fetched again
+    archive.clear()
+    stats = _run(tmp_path, importer)
+    assert archive == [BAD]
+    assert stats["digest_mismatches"] == 1
+    assert importer.snapshot_collection.count_documents({}) == 2
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from wmscraper4000 import url_preimport_utils
+from wmscraper4000.staging_store import StagingStore
+from wmscraper4000.url_preimport_utils import fill_pending_cdx_data, preprocess_urls_from_json_file
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    urls = []
+
+    def fake_get_cdx_records(url, **kwargs):
+        urls.append(url)
+        return [["com,example)/", "20200101000000", url, "text/html", "200", "DIGEST", "100"]]
+
+    monkeypatch.setattr(url_preimport_utils, "get_cdx_records", fake_get_cdx_records)
+    return urls
+
+
+@pytest.fixture
+def url_list(tmp_path):
+    path = tmp_path / "urls.json"
+    path.write_text(json.dumps([{"url": f"http://site{i}.example.com/", "title": "t", "description": "d"} for i in range(30)]))
+    return str(path)
+
+
+def _no_existing(urls):
+    return set()
+
+
+def test_stage_only_does_not_fetch(url_list, fetched):
+    db_path = preprocess_urls_from_json_file(url_list, {}, stage_only=True)
+    assert db_path == url_list[:-len(".json")] + ".db"
+    with StagingStore(db_path) as store:
+        assert store.count_pending() == 30
+    assert fetched == []
+
+
+def test_fill_skips_rows_leased_by_another_worker(url_list, fetched, caplog):
+    db_path = preprocess_urls_from_json_file(url_list, {}, stage_only=True)
+    with StagingStore(db_path) as store:
+        leased = {url for _, url in store.claim_batch("other", batch_size=10)}
+        fill_pending_cdx_data(store, {}, existence_checker=_no_existing, existence_batch_size=7, wait_for_leases=False)
+        assert store.count_pending() == 10
+        assert "10 rows are still leased by other workers" in caplog.text
+        assert not leased & set(fetched)
+        assert len(fetched) == 20
+        # nothing is left leased to the filling worker
+        assert store.conn.execute("SELECT COUNT(*) FROM urls WHERE lease_owner IS NOT NULL AND lease_owner != 'other';").fetchone()[0] == 0
+
+
+def test_rerun_claims_rows_of_a_crashed_worker_once_their_leases_expire(url_list, fetched):
+    db_path = preprocess_urls_from_json_file(url_list, {}, stage_only=True)
+    with StagingStore(db_path) as store:
+        # a worker that was killed without releasing its leases
+        crashed = {url for _, url in store.claim_batch("crashed", batch_size=2, lease_seconds=0.2)}
+    preprocess_urls_from_json_file(url_list, {}, existence_checker=_no_existing)
+    with StagingStore(db_path) as store:
+        assert store.count_pending() == 0
+    assert crashed <= set(fetched)
+    assert len(fetched) == 30
+
+
+def test_enqueue_stores_decoded_cdx_data(url_list, fetched, mongo_client):
+    from wmscraper4000.work_queue import MongoWorkQueue
+
+    db_path = preprocess_urls_from_json_file(url_list, {}, existence_checker=_no_existing)
+    queue = MongoWorkQueue(mongo_client.db.queue)
+    with StagingStore(db_path) as store:
+        assert queue.enqueue_from_store(store) == 30
+    document = queue.collection.find_one()
+    assert document["cdx_done"]
+    assert isinstance(document["cdx_data"], list)
+    assert document["cdx_data"][0][2] == document["url"]
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+import requests
+
+from wmscraper4000.retry_policy import CONNECTION_ERROR, PERMANENT, CircuitBreaker, DelayedQueue, RetryPolicy, classify_error
+
+
+@pytest.mark.parametrize("error", [
+    requests.ConnectionError(),
+    requests.Timeout(),
+    requests.exceptions.ChunkedEncodingError(),
+    requests.exceptions.ContentDecodingError(),
+    ConnectionResetError(),
+    TimeoutError(),
+])
+def test_transport_errors_are_retried(error):
+    assert classify_error(error) == CONNECTION_ERROR
+    assert RetryPolicy().should_retry(error, 1)
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.MissingSchema(),
+    requests.exceptions.InvalidURL(),
+    requests.exceptions.InvalidSchema(),
+    requests.TooManyRedirects(),
+    FileNotFoundError(),
+    PermissionError(),
+    IsADirectoryError(),
+    ValueError(),
+])
+def test_request_construction_and_local_errors_are_permanent(error):
+    assert classify_error(error) == PERMANENT
+    assert not RetryPolicy().should_retry(error, 1)
+
+
+def test_circuit_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure("host")
+    assert breaker.allow("host")
+    breaker.record_failure("host")
+    assert not breaker.allow("host")
+    assert breaker.is_open("host")
+    assert breaker.retry_in("host") > 0
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure("host")
+    assert breaker.allow("host")
+    assert not breaker.allow("host")
+    assert breaker.is_open("host")
+
+
+def test_trial_success_closes_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure("host")
+    assert breaker.allow("host")
+    breaker.record_success("host")
+    assert not breaker.is_open("host")
+    assert breaker.allow("host")
+    assert breaker.allow("host")
+
+
+def test_trial_failure_reopens_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    breaker.record_failure("host")
+    time.sleep(0.25)
+    assert breaker.allow("host")
+    breaker.record_failure("host")
+    assert not breaker.allow("host")
+    time.sleep(0.25)
+    assert breaker.allow("host")
+
+
+def test_hosts_are_independent():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure("a")
+    assert not breaker.allow("a")
+    assert breaker.allow("b")
+
+
+def test_delayed_queue_orders_by_due_time():
+    queue = DelayedQueue()
+    queue.push("later", 0.1)
+    queue.push("now")
+    assert queue.pop_ready() == ["now"]
+    assert len(queue) == 1
+    time.sleep(0.15)
+    assert queue.pop_ready() == ["later"]
+    assert queue.next_ready_in() is None
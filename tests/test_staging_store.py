@@ -0,0 +1,27 @@
+import json
+
+from wmscraper4000.staging_store import StagingStore
+
+
+def test_duplicate_urls_collapse(tmp_path):
+    with StagingStore(str(tmp_path / "staging.db"), batch_size=2) as store:
+        rows = [(f"http://example.com/{i % 3}", "t", "d", None, 0) for i in range(7)]
+        assert store.insert_rows(rows) == 3
+        assert store.count_rows() == 3
+
+
+def test_pending_rows_are_read_in_batches(tmp_path):
+    with StagingStore(str(tmp_path / "staging.db")) as store:
+        store.insert_rows((f"http://example.com/{i}", None, None, None, 0) for i in range(10))
+        store.complete("w", [(3, []), (4, [])])
+        assert store.count_pending() == 8
+
+        rows = store.pending_rows(batch_size=3)
+        first = [next(rows) for _ in range(3)]
+        assert [id for id, _ in first] == [1, 2, 5]
+        # rows finished while iterating are not returned again, and later rows still are
+        store.complete("w", [(6, [["20200101000000"]])])
+        assert [id for id, _ in rows] == [7, 8, 9, 10]
+
+        stored = store.conn.execute("SELECT cdx_data FROM urls WHERE id = 6;").fetchone()[0]
+        assert json.loads(stored) == [["20200101000000"]]
@@ -0,0 +1,78 @@
+import gzip
+import hashlib
+import io
+
+import requests
+import urllib3
+
+from wmscraper4000.url_download_utils import cdx_digest, download_archived_snapshot, stream_archived_snapshot
+from wmscraper4000.warc_utils import WARCWriter
+
+BODY = b"<html>" + b"hello " * 1000 + b"</html>"
+ENCODED = gzip.compress(BODY)
+
+
+class FakeClient:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = requests.structures.CaseInsensitiveDict(self.headers)
+        response.raw = urllib3.HTTPResponse(body=io.BytesIO(ENCODED), headers=self.headers, status=200, preload_content=False)
+        return response
+
+
+def test_digest_covers_the_content_encoded_entity(tmp_path):
+    # the CDX digest of a capture archived with Content-Encoding: gzip is taken over the gzip bytes
+    expected = cdx_digest(hashlib.sha1(ENCODED))
+    client = FakeClient({"Content-Type": "text/html", "Content-Encoding": "gzip"})
+    dest = tmp_path / "body"
+    result = stream_archived_snapshot("http://example.com/", "20200101000000", dest=str(dest), expected_digest=expected, detect_encoding=True, sleep=0, client=client)
+    assert result["digest_matches"]
+    assert result["length"] == len(ENCODED)
+    assert dest.read_bytes() == ENCODED
+
+
+def test_warc_record_keeps_content_encoding_and_lowercase_headers(tmp_path):
+    client = FakeClient({"content-type": "text/html; charset=utf-8", "content-encoding": "gzip"})
+    path = tmp_path / "out.warc"
+    with WARCWriter(str(path), compress=False) as writer:
+        stream_archived_snapshot("http://example.com/", "20200101000000", warc_writer=writer, sleep=0, client=client)
+        writer.write_response("http://example.com/old", "20200101000000", 301, "Moved", {"location": "http://example.com/"}, io.BytesIO(b""), 0, "DIGEST")
+    record = path.read_bytes()
+    assert b"content-encoding: gzip\r\n" in record
+    assert ENCODED in record
+    lines = (tmp_path / "out.warc.cdx").read_text().splitlines()
+    assert lines[1].split()[3] == "text/html"
+    assert lines[2].split()[6] == "http://example.com/"
+
+
+class ReplayClient:
+    def __init__(self, body):
+        self.body = body
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = requests.structures.CaseInsensitiveDict({"Content-Type": "application/octet-stream"})
+        response._content = self.body
+        return response
+
+
+def test_only_verified_bodies_are_cached_by_digest(tmp_path):
+    from wmscraper4000.cache import DiskCache
+
+    good = cdx_digest(hashlib.sha1(b"payload"))
+    with DiskCache(str(tmp_path)) as cache:
+        client = ReplayClient(b"not the payload")
+        download_archived_snapshot("http://a.example.com/", "20200101000000", sleep=0, client=client, cache=cache, digest=good)
+        client.body = b"payload"
+        assert download_archived_snapshot("http://b.example.com/", "20200101000000", sleep=0, client=client, cache=cache, digest=good)["payload"] == b"payload"
+        assert len(client.requests) == 2
+        # the verified body is shared with other captures of the same payload
+        assert download_archived_snapshot("http://c.example.com/", "20200101000000", sleep=0, client=client, cache=cache, digest=good)["payload"] == b"payload"
+        assert len(client.requests) == 2
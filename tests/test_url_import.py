@@ -0,0 +1,64 @@
+import pytest
+
+
+def _entry(url, lot_id, lot_path="", title="t"):
+    return {"url": url, "lot_id": lot_id, "site_title": title, "lot_path": lot_path}
+
+
+def test_bulk_counts_and_dedupe(importer):
+    counts = importer.add_urls_bulk([
+        _entry("http://a.example.com/", 1, "x"),
+        _entry("http://a.example.com/", 1, "x", title="same lot again"),
+        _entry("http://a.example.com/", 2, "x"),
+        _entry("http://b.example.com/", 1, "x"),
+    ])
+    assert counts == {"inserted": 2, "updated": 1, "skipped": 1}
+    document = importer.collection.find_one({"url": "http://a.example.com/"})
+    assert [lot["lot_id"] for lot in document["in_lots"]] == [1, 2]
+
+    counts = importer.add_urls_bulk([_entry("http://a.example.com/", 2, "x"), _entry("http://b.example.com/", 3, "y")], batch_size=1)
+    assert counts == {"inserted": 0, "updated": 1, "skipped": 1}
+
+
+def test_lot_is_added_to_url_inserted_by_another_importer(importer):
+    # the URL exists before the batch is written, e.g. created by a concurrent importer
+    importer.collection.insert_one({"url": "http://a.example.com/", "in_lots": [{"lot_id": 9, "site_title": "other", "site_desc": ""}]})
+    counts = importer.add_urls_bulk([_entry("http://a.example.com/", 1, "x")])
+    assert counts == {"inserted": 0, "updated": 1, "skipped": 0}
+    document = importer.collection.find_one({"url": "http://a.example.com/"})
+    assert [lot["lot_id"] for lot in document["in_lots"]] == [9, 1]
+    assert importer.collection.count_documents({}) == 1
+
+
+def test_matches_add_url_semantics(importer):
+    importer.add_url("http://a.example.com/", 1, "t", lot_path="x")
+    importer.add_url("http://a.example.com/", 1, "t", lot_path="y")
+    bulk = importer.add_urls_bulk([_entry("http://a.example.com/", 1, "x"), _entry("http://a.example.com/", 1, "z")])
+    assert bulk == {"inserted": 0, "updated": 1, "skipped": 1}
+    document = importer.collection.find_one({"url": "http://a.example.com/"})
+    assert [lot["lot_path"] for lot in document["in_lots"]] == ["x", "y", "z"]
+
+
+def test_snapshots_from_field_subsets_are_rejected(importer):
+    from wmscraper4000.cdx_record import CDXRecordBatch
+
+    full = CDXRecordBatch.from_lines(["com,example)/ 20200101000000 http://example.com/ text/html - ABC -"])
+    assert importer.add_url_snapshots_bulk([("http://example.com/", full)]) == {"inserted": 1, "updated": 0, "skipped": 0}
+    stored = importer.snapshot_collection.find_one({"url": "http://example.com/"})["wayback_cdx"]
+    assert stored[0]["statuscode"] == "-"
+
+    subset = CDXRecordBatch.from_lines(["20200101000000 ABC"], fields=("timestamp", "digest"))
+    with pytest.raises(ValueError, match="mimetype"):
+        importer.add_url_snapshots_bulk([("http://example.org/", subset)])
+    no_digest = CDXRecordBatch.from_lines(["com,example)/ 20200101000000 http://example.com/ text/html 200 - 10"])
+    with pytest.raises(ValueError, match="digest"):
+        importer.add_url_snapshots_bulk([("http://example.org/", no_digest)])
+    assert importer.snapshot_collection.count_documents({"url": "http://example.org/"}) == 0
+
+
+def test_lot_without_path_is_recorded_once_for_new_urls(importer):
+    entry = {"url": "http://a.example.com/", "lot_id": 1, "site_title": "t"}
+    assert importer.add_urls_bulk([entry, {**entry, "url": "http://b.example.com/"}]) == {"inserted": 2, "updated": 0, "skipped": 0}
+    importer.add_url("http://c.example.com/", 1, "t")
+    for url in ("http://a.example.com/", "http://b.example.com/", "http://c.example.com/"):
+        assert importer.collection.find_one({"url": url})["in_lots"] == [{"lot_id": 1, "site_title": "t", "site_desc": ""}]
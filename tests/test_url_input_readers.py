@@ -0,0 +1,46 @@
+import io
+import json
+
+import pytest
+
+from wmscraper4000.url_input_readers import _iter_json_array, iter_json_batches, iter_json_entries
+
+VALID = [
+    "[12345, 678]",
+    " [ ] ",
+    '[{"url": "http://example.com/a,]b", "title": "\\u00e9"}, [1, 2], "s", true, null, -1.5e3]',
+]
+MALFORMED = ["[1 2]", "[1,]", "[1] x", "[1", "[,1]", '{"url": 1}', "[1,,2]", "[tru]", "[1]]", "[1.5.5]"]
+
+
+@pytest.mark.parametrize("text", VALID)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1000])
+def test_array_matches_json_loads(text, chunk_size):
+    assert list(_iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize("text", MALFORMED)
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_malformed_array_raises(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(_iter_json_array(io.StringIO(text), chunk_size))
+
+
+def test_malformed_entry_stops_reading_at_the_element_size_limit():
+    entries = ",".join(json.dumps({"url": f"http://example.com/{i}"}) for i in range(10000))
+    file = io.StringIO('[{"url": "http://example.com/", "title": tru}, ' + entries + "]")
+    with pytest.raises(ValueError, match="longer than 1000 characters"):
+        list(_iter_json_array(file, 100, max_element_size=1000))
+    assert file.tell() < 1200
+
+
+def test_large_entries_below_the_limit_are_read():
+    text = json.dumps([{"url": "http://example.com/", "description": "x" * 5000}] * 3)
+    assert list(_iter_json_array(io.StringIO(text), 100, max_element_size=6000)) == json.loads(text)
+
+
+def test_json_lines_and_batches(tmp_path):
+    path = tmp_path / "urls.jsonl"
+    path.write_text("\n".join(json.dumps({"url": f"http://example.com/{i}"}) for i in range(5)) + "\n\n")
+    assert [entry["url"] for entry in iter_json_entries(str(path))] == [f"http://example.com/{i}" for i in range(5)]
+    assert [len(batch) for batch in iter_json_batches(str(path), batch_size=2)] == [2, 2, 1]
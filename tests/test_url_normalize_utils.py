@@ -0,0 +1,39 @@
+import pytest
+
+from wmscraper4000.url_normalize_utils import normalize_url, validate_and_normalize, validate_and_normalize_series, validate_url
+
+# expected verdicts are what the urlparse-based validator returned
+CASES = [
+    ("http://example.com/", True),
+    ("https://example.uk\n", True),
+    ("\x01http://example.com/", True),
+    ("http://exa\tmple.com/", True),
+    ("http://bad url.com/", False),
+    ("http://example.invalidtld/", False),
+    ("//t}[@2:M{", False),
+    ("http://[::1]/", False),
+    ("http://[::1]@1.2.3.4/", True),
+    ("http://[1.2.3.4]/", False),
+    ("http://exa＃mple.com/", False),
+    ("http://1.2.3.4/a b", True),
+    ("", False),
+]
+
+
+@pytest.mark.parametrize("url, valid", CASES)
+def test_validate_url_matches_urlparse(url, valid):
+    assert validate_url(url) == valid
+
+
+def test_batch_and_series_agree():
+    pd = pytest.importorskip("pandas")
+    urls = [url for url, _ in CASES] + ["http://..com", "https://\x00_.com", "http://A.com/"]
+    mask, canonical = validate_and_normalize(urls)
+    series_mask, series_canonical = validate_and_normalize_series(pd.Series(urls))
+    assert series_mask.tolist() == mask
+    assert [value if valid else None for value, valid in zip(series_canonical.tolist(), mask)] == canonical
+
+
+def test_normalize_lowercases_the_netloc_only():
+    assert normalize_url("http://Example.COM/Path") == "http://example.com/Path"
+    assert normalize_url("\x01http://Example.com/A") == "\x01http://example.com/A"